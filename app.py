@@ -24,10 +24,15 @@ import urllib.parse
 import re
 import random
 import io
+import hashlib
+import shutil
+import struct
+import subprocess
+import wave
 from threading import Lock
 
 # --- Third-Party Imports ---
-from flask import Flask, render_template, request, redirect, url_for, send_from_directory, jsonify
+from flask import Flask, render_template, request, redirect, url_for, send_from_directory, send_file, jsonify, Response
 from flask_socketio import SocketIO, emit, join_room, leave_room, rooms
 from mutagen._file import File as MutagenFile
 from mutagen.id3._frames import APIC
@@ -37,6 +42,8 @@ from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 import syncedlyrics
 from urllib.parse import urlparse
+from werkzeug.utils import safe_join
+from werkzeug.wsgi import FileWrapper
 import threading
 import time as _time
 from collections import OrderedDict
@@ -44,6 +51,17 @@ import concurrent.futures
 from PIL import Image
 import base64
 import json
+try:
+    import boto3  # Optional: only needed for STORAGE_BACKEND=s3
+except ImportError:
+    boto3 = None
+try:
+    import redis  # Optional: shares proxy ids between workers when PROXY_REDIS_URL is set
+except ImportError:
+    redis = None
+import heapq
+import atexit
+import signal
 try:
     try:
         from Crypto.Cipher import AES
@@ -52,13 +70,13 @@ try:
 except ImportError:
     AES = None
 # --- Configure optimized HTTP session for downloads ---
-def create_download_session():
+def create_download_session(retries=3):
     """Create an optimized requests session for downloads."""
     session = requests.Session()
     
     # Configure retry strategy
     retry_strategy = Retry(
-        total=3,
+        total=retries,
         backoff_factor=1,
         status_forcelist=[429, 500, 502, 503, 504],
     )
@@ -87,6 +105,8 @@ def create_download_session():
 
 # Global download session
 download_session = create_download_session()
+# Stream opens are hedged (see open_hedged_upstream) instead of retried with backoff
+stream_session = create_download_session(retries=0)
 
 def _tpool_execute(func, *args, **kwargs):
     """
@@ -107,81 +127,146 @@ def _tpool_execute(func, *args, **kwargs):
 
 ## Removed: server-side yt-dlp download helper and any direct YouTube fetching.
 
+# Parallel range downloads (used to pin streamed tracks, see Stream Pinning). The target
+# file is preallocated and split into pieces that a few native worker threads claim from
+# a shared list, each streaming its piece straight to its offset:
+#   - piece size follows the file size (about four pieces per worker, within bounds)
+#   - an idle worker with nothing left to claim splits the largest unfinished piece, so
+#     faster connections end up downloading more of the file
+#   - a failed piece goes back to the list from its first unwritten byte, at most
+#     DOWNLOAD_PIECE_RETRIES times before the download is abandoned
+DOWNLOAD_MAX_WORKERS = int(os.environ.get('DOWNLOAD_MAX_WORKERS', '4'))
+DOWNLOAD_MIN_PIECE = 1024 * 1024
+DOWNLOAD_MAX_PIECE = 16 * 1024 * 1024
+DOWNLOAD_READ_SIZE = 65536
+DOWNLOAD_PIECE_RETRIES = 3
+
 def download_with_range_requests(url, filepath, room):
-    """Try to download using multiple parallel range requests for better speed."""
+    """
+    Blocking (call from a native thread): download url into filepath with parallel range
+    requests, or one plain GET when the server does not do ranges. Returns True on success.
+    """
+    started = time.time()
     try:
-        print(f"[Room {room}] - Attempting parallel range request download")
-
-        # Get file size first
-        head_response = download_session.head(url, timeout=30)
-        if 'Accept-Ranges' not in head_response.headers or head_response.headers['Accept-Ranges'] != 'bytes':
-            print(f"[Room {room}] - Server doesn't support range requests")
-            return False
-
-        content_length = head_response.headers.get('Content-Length')
-        if not content_length:
-            print(f"[Room {room}] - No Content-Length header, cannot use range requests")
-            return False
-
-        total_size = int(content_length)
-        if total_size < 1024 * 1024:  # Less than 1MB, not worth parallelizing
-            print(f"[Room {room}] - File too small for parallel download")
+        probe = stream_session.get(url, headers={'Range': 'bytes=0-0'}, stream=True, timeout=30, allow_redirects=True)
+    except Exception as e:
+        print(f"[Room {room}] - Download failed: {e}")
+        return False
+    total_size = parse_upstream_total(probe) if probe.status_code == 206 else None
+    if total_size is None:
+        # No usable ranges: a single sequential download
+        probe.close()
+        try:
+            with stream_session.get(url, stream=True, timeout=120, allow_redirects=True) as response:
+                response.raise_for_status()
+                with open(filepath, 'wb') as out:
+                    for data in response.iter_content(chunk_size=DOWNLOAD_READ_SIZE):
+                        out.write(data)
+            return True
+        except Exception as e:
+            print(f"[Room {room}] - Download failed: {e}")
             return False
+    probe.close()
 
-        # Split into 4 chunks
-        num_chunks = 4
-        chunk_size = total_size // num_chunks
+    workers = max(1, min(DOWNLOAD_MAX_WORKERS, total_size // (2 * DOWNLOAD_MIN_PIECE)))
+    piece_size = min(DOWNLOAD_MAX_PIECE, max(DOWNLOAD_MIN_PIECE, total_size // (workers * 4) + 1))
+    pending = [
+        {'pos': start, 'end': min(start + piece_size, total_size) - 1, 'failures': 0}
+        for start in range(0, total_size, piece_size)
+    ]
+    active = []
+    lock = native_threading.Lock()
+    aborted = native_threading.Event()
 
-        def download_chunk(start, end, chunk_index):
-            """Download a specific chunk of the file."""
+    with open(filepath, 'wb') as out:
+        if hasattr(os, 'posix_fallocate'):
             try:
-                headers = {'Range': f'bytes={start}-{end}'}
-                response = download_session.get(url, headers=headers, stream=True, timeout=120)
-                response.raise_for_status()
-
-                chunk_data = b''
-                for data in response.iter_content(chunk_size=65536):  # 64KB sub-chunks
-                    if data:
-                        chunk_data += data
-
-                return chunk_index, chunk_data
+                os.posix_fallocate(out.fileno(), 0, total_size)
+            except OSError:
+                out.truncate(total_size)
+        else:
+            out.truncate(total_size)
+
+    def claim_piece():
+        """With lock held: the next piece to fetch, stealing half of the largest active one if none is left."""
+        if pending:
+            piece = pending.pop(0)
+            active.append(piece)
+            return piece
+        largest = max(active, key=lambda p: p['end'] - p['pos'], default=None)
+        if largest is None or largest['end'] - largest['pos'] < 2 * DOWNLOAD_MIN_PIECE:
+            return None
+        # Leave the owner at least one read past its position: it may be writing that read now
+        split = max((largest['pos'] + largest['end']) // 2, largest['pos'] + DOWNLOAD_READ_SIZE)
+        piece = {'pos': split + 1, 'end': largest['end'], 'failures': 0}
+        largest['end'] = split
+        active.append(piece)
+        return piece
+
+    def fetch_piece(piece):
+        with lock:
+            headers = {'Range': f"bytes={piece['pos']}-{piece['end']}"}
+        with stream_session.get(url, headers=headers, stream=True, timeout=30, allow_redirects=True) as response:
+            if response.status_code != 206:
+                raise requests.RequestException(f'range request answered {response.status_code}')
+            with open(filepath, 'r+b') as out:
+                out.seek(piece['pos'])
+                for data in response.iter_content(chunk_size=DOWNLOAD_READ_SIZE):
+                    if aborted.is_set():
+                        return
+                    with lock:
+                        take = min(len(data), piece['end'] + 1 - piece['pos'])
+                    if take > 0:
+                        out.write(data[:take] if take < len(data) else data)
+                    with lock:
+                        piece['pos'] += max(take, 0)
+                        if piece['pos'] > piece['end']:
+                            return
+        with lock:
+            if piece['pos'] <= piece['end']:
+                raise requests.RequestException('range response ended early')
+
+    def worker():
+        while not aborted.is_set():
+            with lock:
+                piece = claim_piece()
+                busy = bool(active)
+            if piece is None:
+                if not busy:
+                    return
+                aborted.wait(0.2)  # a running piece may still fail and come back
+                continue
+            error = None
+            try:
+                fetch_piece(piece)
             except Exception as e:
-                print(f"[Room {room}] - Chunk {chunk_index} download failed: {e}")
-                return chunk_index, None
-
-        # Download chunks in parallel
-        start_time = time.time()
-        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
-            futures = []
-            for i in range(num_chunks):
-                start = i * chunk_size
-                end = start + chunk_size - 1 if i < num_chunks - 1 else total_size - 1
-                future = executor.submit(download_chunk, start, end, i)
-                futures.append(future)
-
-            # Collect results
-            chunks = [None] * num_chunks
-            for future in concurrent.futures.as_completed(futures):
-                chunk_index, chunk_data = future.result()
-                if chunk_data is None:
-                    print(f"[Room {room}] - Parallel download failed, chunk {chunk_index} missing")
-                    return False
-                chunks[chunk_index] = chunk_data
-
-        # Write chunks to file
-        with open(filepath, 'wb') as f:
-            for chunk_data in chunks:
-                f.write(chunk_data)
-
-        end_time = time.time()
-        download_time = end_time - start_time
-        speed_mbps = (total_size / 1024 / 1024) / download_time if download_time > 0 else 0
-        print(f"[Room {room}] - Parallel download successful: {total_size/1024/1024:.2f}MB in {download_time:.2f}s, {speed_mbps:.2f}MB/s")
-        return True
-
-    except Exception as e:
-        print(f"[Room {room}] - Parallel download failed: {e}")
+                error = e
+            with lock:
+                active[:] = [p for p in active if p is not piece]
+                if error is not None:
+                    piece['failures'] += 1
+                    if piece['failures'] > DOWNLOAD_PIECE_RETRIES:
+                        print(f"[Room {room}] - Piece at {piece['pos']} failed {piece['failures']} times: {error}")
+                        aborted.set()
+                    else:
+                        pending.append(piece)  # resumes from the first unwritten byte
+
+    threads = [native_threading.Thread(target=worker, daemon=True) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    with lock:
+        complete = not aborted.is_set() and not pending and not active
+    if not complete:
+        print(f"[Room {room}] - Parallel download failed")
         return False
+    download_time = time.time() - started
+    speed_mbps = (total_size / 1024 / 1024) / download_time if download_time > 0 else 0
+    print(f"[Room {room}] - Parallel download successful: {total_size/1024/1024:.2f}MB in {download_time:.2f}s, "
+          f"{speed_mbps:.2f}MB/s with {workers} workers")
+    return True
 
 # --- Load environment variables from .env file if it exists ---
 try:
@@ -271,6 +356,22 @@ CHANNEL_MODE_RIGHT = 'right'
 VALID_CHANNEL_MODES = {CHANNEL_MODE_STEREO, CHANNEL_MODE_LEFT, CHANNEL_MODE_RIGHT}
 MAX_MEMBER_SYNC_REPORT_AGE_S = 8.0
 
+# Seconds before the current track ends at which clients are told to warm up the next one
+PRELOAD_NEXT_LEAD_S = float(os.environ.get('PRELOAD_NEXT_LEAD_S', '20'))
+TRACK_WATCH_INTERVAL_S = 0.5
+# How long past a track's known duration the server waits for a client 'track_ended' before advancing itself
+AUTO_ADVANCE_GRACE_S = float(os.environ.get('AUTO_ADVANCE_GRACE_S', '0.75'))
+
+# Room-level transition between consecutive tracks
+TRANSITION_MODE_OFF = 'off'
+TRANSITION_MODE_GAPLESS = 'gapless'
+TRANSITION_MODE_CROSSFADE = 'crossfade'
+VALID_TRANSITION_MODES = {TRANSITION_MODE_OFF, TRANSITION_MODE_GAPLESS, TRANSITION_MODE_CROSSFADE}
+DEFAULT_CROSSFADE_S = 6.0
+MAX_CROSSFADE_S = 12.0
+# How far ahead of the shared start time clients receive scheduled_transition
+TRANSITION_SCHEDULE_LEAD_S = 3.0
+
 # =================================================================================
 # Function Definitions
 # =================================================================================
@@ -288,6 +389,280 @@ def sync_rooms_periodically():
                     }, to=room_id)
         socketio.sleep(3)
 
+def watch_track_timelines():
+    """A background task that sends preload_next hints and advances rooms whose track has ended."""
+    while True:
+        pending_hints = []
+        pending_advances = []
+        pending_transitions = []
+        with thread_lock:
+            now_ts = time.time()
+            for room_id in list(rooms_data.keys()):
+                try:
+                    room_state = rooms_data.get(room_id)
+                    if not room_state or not room_state.get('is_playing'):
+                        continue
+
+                    current_item = get_current_audio_item(room_state)
+                    duration_s = (current_item or {}).get('duration')
+                    if not duration_s:
+                        continue
+
+                    track_instance_id = room_state.get('track_instance_id')
+                    remaining_s = duration_s - get_room_reference_time_s(room_state, now_ts=now_ts)
+
+                    scheduled = room_state.get('scheduled_transition')
+                    if scheduled and scheduled.get('from_instance') == track_instance_id:
+                        if now_ts >= scheduled['start_at']:
+                            pending_advances.append((room_id, track_instance_id))
+                        continue
+
+                    if remaining_s <= -AUTO_ADVANCE_GRACE_S:
+                        pending_advances.append((room_id, track_instance_id))
+                        continue
+
+                    transition = schedule_room_transition(room_state, remaining_s, now_ts)
+                    if transition:
+                        pending_transitions.append((room_id, transition))
+                        continue
+
+                    if room_state.get('isLooping') or remaining_s > PRELOAD_NEXT_LEAD_S:
+                        continue
+                    if room_state.get('preload_sent_for') == track_instance_id:
+                        continue
+
+                    room_state['preload_sent_for'] = track_instance_id
+                    next_index = peek_next_queue_index(room_state)
+                    if next_index is None or next_index == room_state.get('current_index'):
+                        continue
+                    pending_hints.append((room_id, next_index, room_state['queue'][next_index], max(0.0, remaining_s)))
+                except Exception as e:
+                    print(f"[Room {room_id}] Track watch failed: {e}")
+
+        # One broken room must not stop auto-advance for every other room
+        for room_id, next_index, audio_item, remaining_s in pending_hints:
+            try:
+                emit_preload_next_to_room(room_id, next_index, audio_item, remaining_s)
+            except Exception as e:
+                print(f"[Room {room_id}] Preload hint failed: {e}")
+        for room_id, transition in pending_transitions:
+            try:
+                emit_scheduled_transition_to_room(room_id, transition)
+            except Exception as e:
+                print(f"[Room {room_id}] Scheduling transition failed: {e}")
+        for room_id, track_instance_id in pending_advances:
+            try:
+                advance_room_track(room_id, track_instance_id, source='server')
+            except Exception as e:
+                print(f"[Room {room_id}] Auto-advance failed: {e}")
+        socketio.sleep(TRACK_WATCH_INTERVAL_S)
+
+def normalize_transition_mode(mode):
+    """Normalize a room transition mode to off/gapless/crossfade."""
+    if isinstance(mode, str):
+        cleaned = mode.strip().lower()
+        if cleaned in VALID_TRANSITION_MODES:
+            return cleaned
+    return TRANSITION_MODE_OFF
+
+def get_transition_overlap_s(room_state):
+    """Return how many seconds the next track overlaps the end of the current one."""
+    if room_state.get('transition_mode') == TRANSITION_MODE_CROSSFADE:
+        try:
+            crossfade_s = float(room_state.get('crossfade_s', DEFAULT_CROSSFADE_S))
+        except (TypeError, ValueError):
+            crossfade_s = DEFAULT_CROSSFADE_S
+        return min(MAX_CROSSFADE_S, max(1.0, crossfade_s))
+    return 0.0
+
+def schedule_room_transition(room_state, remaining_s, now_ts):
+    """
+    Pin the next track's start to an exact server timestamp once the room is close enough.
+    Returns the new schedule, or None if the room does not need one yet. Caller holds thread_lock.
+    """
+    if normalize_transition_mode(room_state.get('transition_mode')) == TRANSITION_MODE_OFF:
+        return None
+    if room_state.get('isLooping') or len(room_state.get('queue', [])) <= 1:
+        return None
+
+    overlap_s = min(get_transition_overlap_s(room_state), max(0.0, remaining_s))
+    start_in_s = remaining_s - overlap_s
+    if start_in_s > TRANSITION_SCHEDULE_LEAD_S or remaining_s <= 0:
+        return None
+
+    next_index = peek_next_queue_index(room_state)
+    if next_index is None or next_index == room_state.get('current_index'):
+        return None
+
+    transition = {
+        'from_instance': room_state.get('track_instance_id'),
+        'next_index': next_index,
+        'start_at': now_ts + start_in_s,
+        'fade_s': overlap_s,
+        'mode': room_state.get('transition_mode')
+    }
+    room_state['scheduled_transition'] = transition
+    return transition
+
+def cancel_scheduled_transition(room_id):
+    """Drop an uncommitted transition after the timeline changed (pause, seek, play). Caller holds thread_lock."""
+    room_state = rooms_data.get(room_id)
+    if not room_state or not room_state.get('scheduled_transition'):
+        return False
+    room_state['scheduled_transition'] = None
+    socketio.emit('transition_cancelled', {}, to=room_id)
+    return True
+
+def reset_upcoming_track(room_id):
+    """
+    The queue or its order changed: forget the pre-picked shuffle target, the preload hint
+    and any scheduled transition, which may all point at another song now. Caller holds thread_lock.
+    """
+    room_state = rooms_data[room_id]
+    room_state['pending_next_index'] = None
+    room_state['preload_sent_for'] = None
+    cancel_scheduled_transition(room_id)
+
+def set_current_queue_item(room_state, room_id, index, is_playing):
+    """Make queue[index] the room's current track, starting from the beginning."""
+    audio_item = room_state['queue'][index]
+    room_state.update({
+        'current_file': audio_item.get('filename'),
+        'current_file_display': audio_item.get('filename_display'),
+        'current_cover': audio_item.get('cover'),
+        'current_title': audio_item.get('title'),
+        'current_artist': audio_item.get('artist'),
+        'current_album': audio_item.get('album'),
+        'current_index': index,
+        'is_playing': is_playing,
+        'last_progress_s': 0,
+        'last_updated_at': time.time(),
+        'current_proxy_id': audio_item.get('proxy_id'),
+        'current_is_stream': audio_item.get('is_stream', False),
+        'current_image_url': audio_item.get('image_url')
+    })
+    begin_track_instance(room_state, room_id)
+    return audio_item
+
+def advance_room_track(room_id, expected_instance_id=None, source='client'):
+    """
+    Move a room past its current track exactly once per track instance.
+    Loops restart the track, a single-item queue stops, otherwise the next item plays.
+    Returns False when the transition already happened (duplicate end-of-track event).
+    """
+    with thread_lock:
+        room_state = rooms_data.get(room_id)
+        if not room_state:
+            return False
+        if expected_instance_id is not None and expected_instance_id != room_state.get('track_instance_id'):
+            print(f"[Room {room_id}] Ignored duplicate end-of-track from {source} (instance {expected_instance_id})")
+            return False
+
+        queue = room_state.get('queue', [])
+        if not queue:
+            return False
+
+        scheduled = room_state.get('scheduled_transition')
+        if scheduled and not 0 <= scheduled.get('next_index', -1) < len(queue):
+            # The queue shrank under the schedule; advance the ordinary way instead
+            cancel_scheduled_transition(room_id)
+            scheduled = None
+        if scheduled and scheduled.get('from_instance') == room_state.get('track_instance_id'):
+            # Clients already started the next track at start_at; only the room state moves.
+            next_index = scheduled['next_index']
+            room_state['scheduled_transition'] = None  # committed, not cancelled
+            audio_item = set_current_queue_item(room_state, room_id, next_index, is_playing=True)
+            room_state['last_updated_at'] = scheduled['start_at']
+            action = 'transition'
+        elif room_state.get('isLooping'):
+            room_state['last_progress_s'] = 0
+            room_state['is_playing'] = True
+            room_state['last_updated_at'] = time.time()
+            begin_track_instance(room_state, room_id)
+            action = 'loop'
+        elif len(queue) <= 1:
+            final_progress = (get_current_audio_item(room_state) or {}).get('duration') or 0
+            room_state['is_playing'] = False
+            room_state['last_progress_s'] = final_progress
+            room_state['last_updated_at'] = time.time()
+            begin_track_instance(room_state, room_id)
+            action = 'stop'
+        else:
+            next_index = peek_next_queue_index(room_state)
+            audio_item = set_current_queue_item(room_state, room_id, next_index, is_playing=True)
+            action = 'next'
+
+        track_instance_id = room_state.get('track_instance_id')
+
+    print(f"[Room {room_id}] Track ended ({source}) -> {action}")
+
+    if action == 'transition':
+        socketio.emit('transition_committed', {
+            'track_instance_id': track_instance_id,
+            'queue_index': next_index
+        }, to=room_id)
+        socketio.emit('queue_update', {
+            'queue': queue,
+            'current_index': next_index
+        }, to=room_id)
+    elif action == 'loop':
+        socketio.emit('loop_restart', {'track_instance_id': track_instance_id}, to=room_id)
+    elif action == 'stop':
+        socketio.emit('pause', {'time': final_progress}, to=room_id)
+    else:
+        emit_new_file_to_room(room_id, audio_item_to_emit_data(audio_item))
+        socketio.emit('scheduled_play', {
+            'audio_time': 0,
+            'target_timestamp': time.time() + 0.5
+        }, to=room_id)
+        socketio.emit('queue_update', {
+            'queue': queue,
+            'current_index': next_index
+        }, to=room_id)
+    return True
+
+def begin_track_instance(room_state, room_id):
+    """
+    Mark that a new track (or a new play of the same track) became current in a room.
+    A transition still scheduled from the old instance is cancelled on the members too.
+    Caller holds thread_lock.
+    """
+    room_state['track_instance_id'] = room_state.get('track_instance_id', 0) + 1
+    room_state['preload_sent_for'] = None
+    room_state['pending_next_index'] = None
+    if room_state.get('scheduled_transition'):
+        room_state['scheduled_transition'] = None
+        socketio.emit('transition_cancelled', {}, to=room_id)
+
+def get_current_audio_item(room_state):
+    """Return the queue item at the room's current index, or None."""
+    queue = room_state.get('queue', [])
+    current_index = room_state.get('current_index', -1)
+    if isinstance(current_index, int) and 0 <= current_index < len(queue):
+        return queue[current_index]
+    return None
+
+def peek_next_queue_index(room_state):
+    """Return the index that next_song will play, picking (and remembering) a shuffle target."""
+    queue = room_state.get('queue', [])
+    if not queue:
+        return None
+    current_index = room_state.get('current_index', -1)
+
+    if room_state.get('is_shuffling') and len(queue) > 1:
+        pending = room_state.get('pending_next_index')
+        if isinstance(pending, int) and 0 <= pending < len(queue) and pending != current_index:
+            return pending
+        available_indices = [i for i in range(len(queue)) if i != current_index]
+        pending = random.choice(available_indices)
+        room_state['pending_next_index'] = pending
+        return pending
+
+    next_index = current_index + 1
+    if next_index >= len(queue):
+        next_index = 0
+    return next_index
+
 def allowed_file(filename):
     """Check if the file's extension is in the allowed list."""
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -413,7 +788,10 @@ def audio_item_to_emit_data(audio_item):
             'image_url': None,
             'video_id': None,
             'stems': None,
-            'is_stem_track': False
+            'is_stem_track': False,
+            'duration': None,
+            'cover_thumbs': None,
+            'palette': None
         }
 
     stems = audio_item.get('stems')
@@ -432,7 +810,16 @@ def audio_item_to_emit_data(audio_item):
         'image_url': audio_item.get('image_url'),
         'video_id': audio_item.get('video_id'),
         'stems': stems,
-        'is_stem_track': bool(stems)
+        'is_stem_track': bool(stems),
+        'premix': audio_item.get('premix') if stems else None,
+        'duration': audio_item.get('duration'),
+        'status': audio_item.get('status', 'ready'),
+        'renditions': audio_item.get('renditions'),
+        'cover_thumbs': cover_thumb_refs(audio_item.get('cover')),
+        'palette': audio_item.get('palette'),
+        'waveform': audio_item.get('waveform'),
+        'hls': audio_item.get('hls'),
+        'gain_db': audio_item.get('gain_db')
     }
 
 def resolve_stem_variant(stems, assigned_role):
@@ -484,11 +871,32 @@ def resolve_emit_data_for_role(emit_data, assigned_role, assigned_channel_mode=C
             isinstance(instrumental_entry, dict) and instrumental_entry.get('filename')
         )
 
-        # For mix role, preserve BOTH stems so the client can layer them together.
-        if normalized_role == AUDIO_ROLE_MIX and has_dual_stems:
+        premix = resolved.get('premix')
+        if normalized_role == AUDIO_ROLE_MIX and has_dual_stems and premix:
+            # One premixed file instead of two synchronized elements
+            resolved['filename'] = premix.get('filename')
+            if vocals_entry.get('cover'):
+                resolved['cover'] = vocals_entry.get('cover')
+                resolved['cover_thumbs'] = cover_thumb_refs(resolved['cover'])
+                resolved['palette'] = vocals_entry.get('palette') or resolved.get('palette')
+            resolved['selected_audio_variant'] = AUDIO_ROLE_MIX
+            resolved['is_stem_track'] = True
+            resolved['renditions'] = None
+            resolved['hls'] = None
+            resolved['waveform'] = vocals_entry.get('waveform')
+            resolved['gain_db'] = premix.get('gain_db')
+            resolved.pop('mix_filenames', None)
+            resolved.pop('mix_covers', None)
+            resolved.pop('mix_renditions', None)
+            base_display = resolved.get('title') or resolved.get('filename_display') or resolved.get('filename') or 'Unknown'
+            resolved['filename_display'] = f"{base_display} [{AUDIO_ROLE_MIX}]"
+        # Without a premix, preserve BOTH stems so the client can layer them together.
+        elif normalized_role == AUDIO_ROLE_MIX and has_dual_stems:
             resolved['filename'] = vocals_entry.get('filename')
             if vocals_entry.get('cover'):
                 resolved['cover'] = vocals_entry.get('cover')
+                resolved['cover_thumbs'] = cover_thumb_refs(resolved['cover'])
+                resolved['palette'] = vocals_entry.get('palette') or resolved.get('palette')
             resolved['selected_audio_variant'] = AUDIO_ROLE_MIX
             resolved['is_stem_track'] = True
             resolved['mix_filenames'] = {
@@ -499,6 +907,15 @@ def resolve_emit_data_for_role(emit_data, assigned_role, assigned_channel_mode=C
                 AUDIO_ROLE_VOCALS: vocals_entry.get('cover'),
                 AUDIO_ROLE_INSTRUMENTAL: instrumental_entry.get('cover')
             }
+            resolved['renditions'] = vocals_entry.get('renditions')
+            resolved['hls'] = None
+            resolved['waveform'] = vocals_entry.get('waveform')
+            stem_gains = [e.get('gain_db') for e in (vocals_entry, instrumental_entry) if e.get('gain_db') is not None]
+            resolved['gain_db'] = min(stem_gains) - STEM_MIX_HEADROOM_DB if len(stem_gains) == 2 else None
+            resolved['mix_renditions'] = {
+                AUDIO_ROLE_VOCALS: vocals_entry.get('renditions'),
+                AUDIO_ROLE_INSTRUMENTAL: instrumental_entry.get('renditions')
+            }
             base_display = resolved.get('title') or resolved.get('filename_display') or resolved.get('filename') or 'Unknown'
             resolved['filename_display'] = f"{base_display} [{AUDIO_ROLE_MIX}]"
         else:
@@ -507,6 +924,12 @@ def resolve_emit_data_for_role(emit_data, assigned_role, assigned_channel_mode=C
                 resolved['filename'] = stem_entry.get('filename')
                 if stem_entry.get('cover'):
                     resolved['cover'] = stem_entry.get('cover')
+                    resolved['cover_thumbs'] = cover_thumb_refs(resolved['cover'])
+                    resolved['palette'] = stem_entry.get('palette') or resolved.get('palette')
+                resolved['renditions'] = stem_entry.get('renditions')
+                resolved['hls'] = stem_entry.get('hls')
+                resolved['waveform'] = stem_entry.get('waveform')
+                resolved['gain_db'] = stem_entry.get('gain_db')
                 resolved['selected_audio_variant'] = selected_variant
                 resolved['is_stem_track'] = True
                 base_display = resolved.get('title') or resolved.get('filename_display') or resolved.get('filename') or 'Unknown'
@@ -516,13 +939,30 @@ def resolve_emit_data_for_role(emit_data, assigned_role, assigned_channel_mode=C
                 resolved['is_stem_track'] = False
             resolved.pop('mix_filenames', None)
             resolved.pop('mix_covers', None)
+            resolved.pop('mix_renditions', None)
     else:
         resolved['selected_audio_variant'] = AUDIO_ROLE_MIX
         resolved['is_stem_track'] = False
         resolved.pop('mix_filenames', None)
         resolved.pop('mix_covers', None)
+        resolved.pop('mix_renditions', None)
+
+    # Single-file members on one side get that channel alone (dual-element mixes stay stereo)
+    if (normalized_channel_mode != CHANNEL_MODE_STEREO and resolved.get('filename')
+            and not resolved.get('is_stream') and not resolved.get('mix_filenames')):
+        variant = channel_variant_filename(resolved['filename'], normalized_channel_mode)
+        # Until the variant is built the member keeps the stereo file
+        if variant and not os.path.exists(os.path.join(app.config['UPLOAD_FOLDER'], variant)):
+            request_channel_variant(variant)
+            variant = None
+        if variant:
+            resolved['filename'] = variant
+            resolved['renditions'] = None
+            resolved['hls'] = None
+            resolved['channel_variant'] = normalized_channel_mode
 
     resolved.pop('stems', None)
+    resolved.pop('premix', None)
     return resolved
 
 def emit_new_file_to_member(room_id, sid, emit_data):
@@ -530,6 +970,7 @@ def emit_new_file_to_member(room_id, sid, emit_data):
     role = get_member_audio_role(room_id, sid)
     channel_mode = get_member_channel_mode(room_id, sid)
     personalized = resolve_emit_data_for_role(emit_data, role, channel_mode)
+    personalized['track_instance_id'] = rooms_data.get(room_id, {}).get('track_instance_id')
     socketio.emit('new_file', personalized, to=sid)
 
 def emit_new_file_to_room(room_id, emit_data):
@@ -540,12 +981,88 @@ def emit_new_file_to_room(room_id, emit_data):
     if not member_list:
         # Fallback for edge cases before member tracking is initialized.
         fallback_payload = resolve_emit_data_for_role(emit_data, AUDIO_ROLE_MIX, CHANNEL_MODE_STEREO)
+        fallback_payload['track_instance_id'] = room_state.get('track_instance_id')
         socketio.emit('new_file', fallback_payload, to=room_id)
         return
 
+    warm_room_media(room_id, emit_data)
+    warm_room_streams(room_id)
     for sid in list(member_list.keys()):
         emit_new_file_to_member(room_id, sid, emit_data)
 
+def build_media_url(filename=None, proxy_id=None):
+    """Return the URL a client should fetch for an uploaded file or a proxied stream."""
+    if proxy_id:
+        return f"/stream_proxy/{proxy_id}"
+    if filename:
+        return f"/uploads/{urllib.parse.quote(filename)}"
+    return None
+
+def resolve_media_urls(resolved):
+    """Return (url, mix_urls) for a role-resolved payload."""
+    mix_filenames = resolved.get('mix_filenames')
+    mix_urls = {role_name: build_media_url(name) for role_name, name in mix_filenames.items()} if mix_filenames else None
+    return build_media_url(resolved.get('filename'), resolved.get('proxy_id')), mix_urls
+
+def emit_scheduled_transition_to_room(room_id, transition):
+    """Send every member the next track and the shared timestamp at which it starts."""
+    room_state = rooms_data.get(room_id, {})
+    queue = room_state.get('queue', [])
+    if not 0 <= transition['next_index'] < len(queue):
+        return
+    emit_data = audio_item_to_emit_data(queue[transition['next_index']])
+
+    for sid in list(room_state.get('member_list', {}).keys()):
+        role = get_member_audio_role(room_id, sid)
+        channel_mode = get_member_channel_mode(room_id, sid)
+        resolved = resolve_emit_data_for_role(emit_data, role, channel_mode)
+        url, mix_urls = resolve_media_urls(resolved)
+        socketio.emit('scheduled_transition', {
+            'mode': transition['mode'],
+            'from_track_instance_id': transition['from_instance'],
+            'queue_index': transition['next_index'],
+            'target_timestamp': transition['start_at'],
+            'fade_s': transition['fade_s'],
+            'url': url,
+            'mix_urls': mix_urls,
+            'renditions': resolved.get('renditions'),
+            'mix_renditions': resolved.get('mix_renditions'),
+            'hls': resolved.get('hls'),
+            'track': resolved
+        }, to=sid)
+
+def emit_preload_next_to_room(room_id, next_index, audio_item, starts_in_s):
+    """Tell every member which file to warm up for the upcoming queue item."""
+    room_state = rooms_data.get(room_id, {})
+    member_list = room_state.get('member_list', {})
+    emit_data = audio_item_to_emit_data(audio_item)
+    warm_room_media(room_id, emit_data)
+
+    for sid in list(member_list.keys()):
+        role = get_member_audio_role(room_id, sid)
+        channel_mode = get_member_channel_mode(room_id, sid)
+        resolved = resolve_emit_data_for_role(emit_data, role, channel_mode)
+        url, mix_urls = resolve_media_urls(resolved)
+        socketio.emit('preload_next', {
+            'queue_index': next_index,
+            'starts_in_s': starts_in_s,
+            'url': url,
+            'mix_urls': mix_urls,
+            'renditions': resolved.get('renditions'),
+            'mix_renditions': resolved.get('mix_renditions'),
+            'gain_db': resolved.get('gain_db'),
+            'channel_variant': resolved.get('channel_variant'),
+            'hls': resolved.get('hls'),
+            'cover': resolved.get('cover'),
+            'cover_thumbs': resolved.get('cover_thumbs'),
+            'palette': resolved.get('palette'),
+            'image_url': resolved.get('image_url'),
+            'title': resolved.get('title'),
+            'artist': resolved.get('artist'),
+            'assigned_audio_role': resolved.get('assigned_audio_role'),
+            'assigned_channel_mode': resolved.get('assigned_channel_mode')
+        }, to=sid)
+
 def build_room_state_for_member(room_id, sid, base_room_state):
     """Build room_state payload personalized for the joining member role."""
     room_state = dict(base_room_state or {})
@@ -563,6 +1080,12 @@ def build_room_state_for_member(room_id, sid, base_room_state):
         room_state['current_file'] = resolved.get('filename')
         room_state['current_file_display'] = resolved.get('filename_display')
         room_state['current_cover'] = resolved.get('cover')
+        room_state['current_cover_thumbs'] = resolved.get('cover_thumbs')
+        room_state['current_palette'] = resolved.get('palette')
+        room_state['current_waveform'] = resolved.get('waveform')
+        room_state['current_gain_db'] = resolved.get('gain_db')
+        room_state['current_channel_variant'] = resolved.get('channel_variant')
+        room_state['current_hls'] = resolved.get('hls')
         room_state['current_title'] = resolved.get('title')
         room_state['current_artist'] = resolved.get('artist')
         room_state['current_album'] = resolved.get('album')
@@ -576,108 +1099,172 @@ def build_room_state_for_member(room_id, sid, base_room_state):
         room_state['current_assigned_channel_mode'] = resolved.get('assigned_channel_mode')
         room_state['current_mix_filenames'] = resolved.get('mix_filenames')
         room_state['current_mix_covers'] = resolved.get('mix_covers')
+        room_state['current_renditions'] = resolved.get('renditions')
+        room_state['current_mix_renditions'] = resolved.get('mix_renditions')
 
     return room_state
 
-def extract_metadata(file_path):
+# Parsed tag probes, keyed by (path, size, mtime) so a rewritten file is re-probed
+PROBE_CACHE_SIZE = int(os.environ.get('PROBE_CACHE_SIZE', '256'))
+probe_cache = OrderedDict()
+probe_cache_lock = threading.Lock()
+probe_stats = {'hits': 0, 'misses': 0}
+
+def read_tag_metadata(audio):
+    """Return title/artist/album from an already parsed mutagen file."""
+    metadata = {}
+    tags = audio.tags if hasattr(audio, 'tags') and audio.tags else None
+
+    def first_tag(tag_keys):
+        if not tags:
+            return None
+        # Try different tag formats
+        for tag_key in tag_keys:
+            if tag_key in tags:
+                return str(tags[tag_key][0]) if isinstance(tags[tag_key], list) else str(tags[tag_key])
+        return None
+
+    title = first_tag(['TIT2', 'TITLE', '\xa9nam', 'Title'])
+    artist = first_tag(['TPE1', 'ARTIST', '\xa9ART', 'Artist'])
+    album = first_tag(['TALB', 'ALBUM', '\xa9alb', 'Album'])
+
+    metadata['title'] = title.strip() if title else None
+    metadata['artist'] = artist.strip() if artist else None
+    metadata['album'] = album.strip() if album else None
+    return metadata
+
+def read_cover_art(audio):
+    """Return (cover_data, cover_ext) from an already parsed mutagen file, or (None, None)."""
+    # MP4/M4A Files
+    if hasattr(audio, 'tags') and audio.tags:
+        if 'covr' in audio.tags:
+            covers = audio.tags['covr']
+            if covers:
+                ext = 'png' if covers[0].imageformat == MP4Cover.FORMAT_PNG else 'jpg'
+                return bytes(covers[0]), ext
+
+    # FLAC Files
+    if hasattr(audio, 'pictures') and audio.pictures:
+        pic = audio.pictures[0]
+        ext = 'png' if 'png' in pic.mime else 'jpg'
+        return pic.data, ext
+
+    # MP3 Files (ID3 Tags)
+    if hasattr(audio, 'tags') and audio.tags:
+        # Try APIC frames (standard for cover art)
+        for tag in audio.tags.keys():
+            if tag.startswith('APIC') or tag.startswith('PIC'):
+                pic = audio.tags[tag]
+                ext = 'png' if 'png' in pic.mime else 'jpg'
+                return pic.data, ext
+
+    # Direct attribute fallback for some formats
+    for attr in ('APIC', 'PIC'):
+        if hasattr(audio, attr):
+            pic = getattr(audio, attr)
+            ext = 'png' if 'png' in pic.mime else 'jpg'
+            return pic.data, ext
+    return None, None
+
+def probe_audio_file(file_path):
     """
-    Extracts metadata (title, artist, album) from an audio file.
-    Returns a dictionary with metadata or fallback values.
+    Parse an audio file once and return its tags, cover art and stream info:
+    { metadata, cover_data, cover_ext, duration, bitrate, sample_rate, channels }.
+    Results are cached by (path, size, mtime); returns None if the file cannot be parsed.
     """
+    try:
+        st = os.stat(file_path)
+    except OSError:
+        return None
+    cache_key = (os.path.abspath(file_path), st.st_size, st.st_mtime_ns)
+
+    with probe_cache_lock:
+        probe = probe_cache.get(cache_key)
+        if probe is not None:
+            probe_cache.move_to_end(cache_key)
+            probe_stats['hits'] += 1
+            return probe
+        probe_stats['misses'] += 1
+
     try:
         audio = MutagenFile(file_path)
-        if not audio:
-            return {}
-        
-        metadata = {}
-        
-        # Extract title
-        title = None
-        if hasattr(audio, 'tags') and audio.tags:
-            # Try different tag formats
-            for tag_key in ['TIT2', 'TITLE', '\xa9nam', 'Title']:
-                if tag_key in audio.tags:
-                    title = str(audio.tags[tag_key][0]) if isinstance(audio.tags[tag_key], list) else str(audio.tags[tag_key])
-                    break
-        
-        # Extract artist
-        artist = None
-        if hasattr(audio, 'tags') and audio.tags:
-            # Try different tag formats
-            for tag_key in ['TPE1', 'ARTIST', '\xa9ART', 'Artist']:
-                if tag_key in audio.tags:
-                    artist = str(audio.tags[tag_key][0]) if isinstance(audio.tags[tag_key], list) else str(audio.tags[tag_key])
-                    break
-        
-        # Extract album
-        album = None
-        if hasattr(audio, 'tags') and audio.tags:
-            # Try different tag formats
-            for tag_key in ['TALB', 'ALBUM', '\xa9alb', 'Album']:
-                if tag_key in audio.tags:
-                    album = str(audio.tags[tag_key][0]) if isinstance(audio.tags[tag_key], list) else str(audio.tags[tag_key])
-                    break
-        
-        metadata['title'] = title.strip() if title else None
-        metadata['artist'] = artist.strip() if artist else None
-        metadata['album'] = album.strip() if album else None
-        
-        return metadata
-        
     except Exception as e:
-        print(f"Could not extract metadata from {os.path.basename(file_path)}: {e}")
-        return {}
+        print(f"Could not parse {os.path.basename(file_path)}: {e}")
+        audio = None
+
+    probe = {
+        'metadata': {},
+        'cover_data': None,
+        'cover_ext': None,
+        'duration': None,
+        'bitrate': None,
+        'sample_rate': None,
+        'channels': None,
+    }
+    if audio is not None:
+        try:
+            probe['metadata'] = read_tag_metadata(audio)
+        except Exception as e:
+            print(f"Could not extract metadata from {os.path.basename(file_path)}: {e}")
+        try:
+            probe['cover_data'], probe['cover_ext'] = read_cover_art(audio)
+        except Exception as e:
+            print(f"Could not extract cover art from {os.path.basename(file_path)}: {e}")
+        info = getattr(audio, 'info', None)
+        if info is not None:
+            length = getattr(info, 'length', None)
+            probe['duration'] = float(length) if length else None
+            probe['bitrate'] = getattr(info, 'bitrate', None) or None
+            probe['sample_rate'] = getattr(info, 'sample_rate', None) or None
+            probe['channels'] = getattr(info, 'channels', None) or None
+
+    with probe_cache_lock:
+        probe_cache[cache_key] = probe
+        probe_cache.move_to_end(cache_key)
+        while len(probe_cache) > PROBE_CACHE_SIZE:
+            probe_cache.popitem(last=False)
+    return probe
+
+def get_probe_stats():
+    with probe_cache_lock:
+        lookups = probe_stats['hits'] + probe_stats['misses']
+        return {
+            'entries': len(probe_cache),
+            'hits': probe_stats['hits'],
+            'misses': probe_stats['misses'],
+            'hit_rate': round(probe_stats['hits'] / lookups, 3) if lookups else 0.0,
+        }
+
+def extract_metadata(file_path):
+    """
+    Extracts metadata (title, artist, album) from an audio file.
+    Returns a dictionary with metadata or fallback values.
+    """
+    probe = probe_audio_file(file_path)
+    return dict(probe['metadata']) if probe else {}
 
 def extract_cover_art(file_path):
     """
     Extracts cover art data and extension from an audio file.
     Returns (cover_data, cover_ext) or (None, None) if not found.
     """
-    try:
-        audio = MutagenFile(file_path)
-        if not audio:
-            return None, None
-
-        # MP4/M4A Files
-        if hasattr(audio, 'tags') and audio.tags:
-            if 'covr' in audio.tags:
-                covers = audio.tags['covr']
-                if covers:
-                    ext = 'png' if covers[0].imageformat == MP4Cover.FORMAT_PNG else 'jpg'
-                    return covers[0], ext
-
-        # FLAC Files
-        if hasattr(audio, 'pictures') and audio.pictures:
-            pic = audio.pictures[0]
-            ext = 'png' if 'png' in pic.mime else 'jpg'
-            return pic.data, ext
+    probe = probe_audio_file(file_path)
+    if not probe:
+        return None, None
+    return probe['cover_data'], probe['cover_ext']
 
-        # MP3 Files (ID3 Tags)
-        if hasattr(audio, 'tags') and audio.tags:
-            # Try APIC frames (standard for cover art)
-            for tag in audio.tags.keys():
-                if tag.startswith('APIC'):
-                    pic = audio.tags[tag]
-                    ext = 'png' if 'png' in pic.mime else 'jpg'
-                    return pic.data, ext
-                if tag.startswith('PIC'):
-                    pic = audio.tags[tag]
-                    ext = 'png' if 'png' in pic.mime else 'jpg'
-                    return pic.data, ext
-
-        # Direct attribute fallback for some formats
-        if hasattr(audio, 'APIC'):
-            pic = audio.APIC
-            ext = 'png' if 'png' in pic.mime else 'jpg'
-            return pic.data, ext
-        if hasattr(audio, 'PIC'):
-            pic = audio.PIC
-            ext = 'png' if 'png' in pic.mime else 'jpg'
-            return pic.data, ext
+def extract_duration(file_path):
+    """Return the audio duration in seconds, or None if it cannot be determined."""
+    probe = probe_audio_file(file_path)
+    return probe['duration'] if probe else None
 
-    except Exception as e:
-        print(f"Could not extract cover art from {os.path.basename(file_path)}: {e}")
-    return None, None
+def parse_duration_s(value):
+    """Parse a duration given as seconds (number or numeric string) into a positive float."""
+    try:
+        duration_s = float(value)
+    except (TypeError, ValueError):
+        return None
+    return duration_s if duration_s > 0 else None
 
 def get_lyrics(artist, title):
     """
@@ -709,69 +1296,1747 @@ def get_lyrics(artist, title):
 
 
 # =================================================================================
-# Flask Routes
+# Content-Addressed Upload Store
 # =================================================================================
 
-@app.route('/metadata/<path:filename>')
-def get_metadata(filename):
-    """Get metadata for an existing audio file."""
+# Uploads are stored as UPLOAD_FOLDER/<sha256>.<ext>; each stored file has a
+# <sha256>.meta.json sidecar with its extracted metadata, duration and cover name.
+UPLOAD_HASH_CHUNK_SIZE = 1024 * 1024
+media_record_cache = {}
+media_store_lock = threading.Lock()
+media_record_update_lock = threading.Lock()
+upload_store_stats = {
+    'uploads': 0,
+    'dedup_hits': 0,
+    'bytes_received': 0,
+    'bytes_saved': 0,
+}
+
+def get_media_record_path(content_hash):
+    return os.path.join(app.config['UPLOAD_FOLDER'], f"{content_hash}.meta.json")
+
+def get_media_record(content_hash):
+    """Return the cached processing record for stored content, or None if not processed yet."""
+    with media_store_lock:
+        record = media_record_cache.get(content_hash)
+    if record is not None:
+        return record
     try:
-        import urllib.parse
-        decoded_filename = urllib.parse.unquote(filename)
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], decoded_filename)
-        
-        if not os.path.exists(file_path):
-            return jsonify({'error': 'File not found'}), 404
-            
-        metadata = extract_metadata(file_path)
-        return jsonify(metadata)
-        
-    except Exception as e:
-        print(f"Error getting metadata for {filename}: {e}")
-        return jsonify({'error': str(e)}), 500
+        with open(get_media_record_path(content_hash), 'r', encoding='utf-8') as f:
+            record = json.load(f)
+    except (OSError, ValueError):
+        return None
+    with media_store_lock:
+        media_record_cache[content_hash] = record
+    register_rendition_savings(record.get('renditions'))
+    return record
+
+def save_media_record(content_hash, record):
+    """Persist a processing record next to the stored file so later uploads can reuse it."""
+    with media_store_lock:
+        media_record_cache[content_hash] = record
+    tmp_path = f"{get_media_record_path(content_hash)}.{uuid.uuid4().hex[:8]}.tmp"
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(record, f, ensure_ascii=False)
+        os.replace(tmp_path, get_media_record_path(content_hash))
+    except OSError as e:
+        print(f"Could not persist media record for {content_hash}: {e}")
+
+def update_media_record(content_hash, fields):
+    """Merge derived fields into the latest record; background jobs finish in any order."""
+    with media_record_update_lock:
+        record = dict(get_media_record(content_hash) or {})
+        record.update(fields)
+        save_media_record(content_hash, record)
+    return record
+
+def hash_stored_file(path):
+    """Return (sha256 hex digest, size) of a file on disk; blocking, run it via _tpool_execute."""
+    hasher = hashlib.sha256()
+    size = 0
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(UPLOAD_HASH_CHUNK_SIZE)
+            if not chunk:
+                break
+            hasher.update(chunk)
+            size += len(chunk)
+    return hasher.hexdigest(), size
 
-@app.route('/lyrics')
-def get_song_lyrics():
-    """Get lyrics for a song based on artist and title parameters."""
-    artist = request.args.get('artist')
-    title = request.args.get('title')
-    
-    if not artist or not title:
-        return jsonify({'error': 'Both artist and title parameters are required'}), 400
-    
+def store_upload(file_obj, original_name):
+    """
+    Stream an uploaded file to disk while hashing it, then store it under its content hash.
+    Identical content already on disk is kept and the new copy discarded.
+    Returns a dict with filename, content_hash, size and deduplicated.
+    """
+    safe_name = unicode_secure_filename(original_name) or ''
+    ext = os.path.splitext(safe_name)[1].lower().lstrip('.')
+    if ext not in ALLOWED_EXTENSIONS:
+        ext = 'mp3'
+
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    tmp_path = os.path.join(app.config['UPLOAD_FOLDER'], f".incoming_{uuid.uuid4().hex}")
+    hasher = hashlib.sha256()
+    size = 0
     try:
-        lyrics = get_lyrics(artist, title)
-        if lyrics:
-            return jsonify({
-                'success': True,
-                'lyrics': lyrics,
-                'artist': artist,
-                'title': title
-            })
+        with open(tmp_path, 'wb') as out:
+            while True:
+                chunk = file_obj.stream.read(UPLOAD_HASH_CHUNK_SIZE)
+                if not chunk:
+                    break
+                hasher.update(chunk)
+                out.write(chunk)
+                size += len(chunk)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    return commit_stored_file(tmp_path, ext, hasher.hexdigest(), size)
+
+def commit_stored_file(tmp_path, ext, content_hash, size):
+    """Move a fully written temp file into the store under its content hash."""
+    filename = f"{content_hash}.{ext}"
+    file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+
+    with media_store_lock:
+        deduplicated = os.path.exists(file_path)
+        if deduplicated:
+            os.remove(tmp_path)
         else:
-            return jsonify({
-                'success': False,
-                'message': 'Lyrics not found',
-                'artist': artist,
-                'title': title
-            }), 404
-    except Exception as e:
-        print(f"Error fetching lyrics for {artist} - {title}: {e}")
-        return jsonify({'error': str(e)}), 500
+            os.replace(tmp_path, file_path)
+        # Inside the lock so an eviction sweep cannot delete content being re-stored
+        touch_media(filename)
+        upload_store_stats['uploads'] += 1
+        upload_store_stats['bytes_received'] += size
+        if deduplicated:
+            upload_store_stats['dedup_hits'] += 1
+            upload_store_stats['bytes_saved'] += size
+
+    if not deduplicated:
+        request_remote_put(filename)
+        request_storage_sweep()
+    return {
+        'filename': filename,
+        'content_hash': content_hash,
+        'size': size,
+        'deduplicated': deduplicated,
+    }
 
-@app.route('/lyrics/<path:filename>')
-def get_lyrics_for_file(filename):
-    """Get lyrics for a song based on its filename (extracts metadata first)."""
+# Cover derivatives: one square thumbnail per view size, in WebP and JPEG.
+# Payloads carry `cover_thumbs` ({view: "<cover>.<size>"}) and clients append the format.
+COVER_THUMB_SIZES = {'queue': 96, 'grid': 256, 'player': 640}
+COVER_THUMB_FORMATS = ('webp', 'jpg')
+COVER_THUMB_MAX_AGE = 31536000  # derivatives are named after immutable covers
+COVER_THUMB_PATTERN = re.compile(r'^(?P<cover>[^/\\]+)\.(?P<size>\d+)\.(?P<fmt>webp|jpg)$')
+
+def cover_thumb_filename(cover_filename, size, fmt):
+    return f"{cover_filename}.{size}.{fmt}"
+
+def cover_thumb_refs(cover_filename):
+    """Return the per-view thumbnail references for an uploaded cover, or None."""
+    if not cover_filename:
+        return None
+    return {view: f"{cover_filename}.{size}" for view, size in COVER_THUMB_SIZES.items()}
+
+def probe_media_file(upload_folder, filename, content_hash):
+    """
+    Extract metadata, duration and cover art for a stored upload and write the cover file.
+    Runs inside the media process pool, so it only touches its arguments and the disk.
+    """
+    probe = probe_audio_file(os.path.join(upload_folder, filename)) or {}
+
+    cover_filename = None
+    if probe.get('cover_data'):
+        cover_filename = f"{content_hash}_cover.{probe['cover_ext']}"
+        with open(os.path.join(upload_folder, cover_filename), 'wb') as imgf:
+            imgf.write(probe['cover_data'])
+        generate_cover_thumbnails(upload_folder, cover_filename)
+        palette = compute_image_palette(probe['cover_data'])
+    else:
+        palette = None
+
+    return {
+        'filename': filename,
+        'metadata': dict(probe.get('metadata') or {}),
+        'duration': probe.get('duration'),
+        'bitrate': probe.get('bitrate'),
+        'sample_rate': probe.get('sample_rate'),
+        'channels': probe.get('channels'),
+        'cover': cover_filename,
+        'palette': palette,
+    }
+
+
+# =================================================================================
+# Post-Upload Processing Pipeline
+# =================================================================================
+
+# Tag parsing and cover extraction are CPU-bound; they run in a small process pool so
+# uploads return as soon as the bytes are stored and the eventlet hub is never stalled.
+MEDIA_PROCESS_WORKERS = int(os.environ.get('MEDIA_PROCESS_WORKERS', '2'))
+MEDIA_POOL_POLL_S = 0.05
+media_process_pool = None
+# content_hash -> list of queue items waiting for that content's processing record
+pending_media_updates = {}
+
+def get_media_process_pool():
+    global media_process_pool
+    if media_process_pool is None:
+        media_process_pool = concurrent.futures.ProcessPoolExecutor(max_workers=MEDIA_PROCESS_WORKERS)
+        register_media_pool_shutdown()
+    return media_process_pool
+
+def shutdown_media_process_pool():
+    """
+    Stop the pool without waiting: queued jobs are cancelled and running ones killed (every
+    job only derives files that are rebuilt on demand). The default exit handler joins the
+    workers instead, which never returns under eventlet.
+    """
+    global media_process_pool
+    pool, media_process_pool = media_process_pool, None
+    if pool is None:
+        return
+    workers = list((getattr(pool, '_processes', None) or {}).values())
+    pool.shutdown(wait=False, cancel_futures=True)
+    for worker in workers:
+        worker.kill()
+
+def register_media_pool_shutdown():
+    """Shut the pool down on interpreter exit (before concurrent.futures joins it) and on SIGTERM."""
+    # concurrent.futures joins the workers from a threading exit hook, multiprocessing from
+    # atexit (the only one that runs under eventlet); both run newest first, so register with both
+    atexit.register(shutdown_media_process_pool)
     try:
-        import urllib.parse
-        decoded_filename = urllib.parse.unquote(filename)
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], decoded_filename)
-        
-        if not os.path.exists(file_path):
-            return jsonify({'error': 'File not found'}), 404
-        
-        # Extract metadata first
-        metadata = extract_metadata(file_path)
+        threading._register_atexit(shutdown_media_process_pool)
+    except (AttributeError, RuntimeError):
+        pass  # no thread-exit hooks, or already shutting down
+
+    try:
+        previous = signal.getsignal(signal.SIGTERM)
+    except ValueError:
+        return
+    owner_pid = os.getpid()
+
+    def on_sigterm(signum, frame):
+        if os.getpid() == owner_pid:  # pool workers inherit the handler
+            shutdown_media_process_pool()
+        if callable(previous):
+            previous(signum, frame)
+        else:
+            signal.signal(signal.SIGTERM, previous if previous is not None else signal.SIG_DFL)
+            os.kill(os.getpid(), signal.SIGTERM)
+
+    try:
+        signal.signal(signal.SIGTERM, on_sigterm)
+    except ValueError:
+        pass  # not the main thread; the exit hook still runs
+
+def wait_for_pool_future(future):
+    """
+    Return a process pool future's result, waiting cooperatively. Under eventlet the
+    future's condition is a green lock, so it cannot be waited on from a tpool thread.
+    """
+    while not future.done():
+        socketio.sleep(MEDIA_POOL_POLL_S)
+    return future.result()
+
+def run_media_processing(stored):
+    """Background task: probe stored content in the process pool, then upgrade waiting queue items."""
+    content_hash = stored['content_hash']
+    record = None
+    try:
+        future = get_media_process_pool().submit(
+            probe_media_file, app.config['UPLOAD_FOLDER'], stored['filename'], content_hash
+        )
+        record = wait_for_pool_future(future)
+        record['size'] = stored['size']
+        save_media_record(content_hash, record)
+        if record.get('cover'):
+            request_remote_put(record['cover'])
+    except Exception as e:
+        print(f"Media processing failed for {stored['filename']}: {e}")
+
+    with media_store_lock:
+        waiting = pending_media_updates.pop(content_hash, [])
+    for entry in waiting:
+        apply_media_record(entry, record)
+    request_media_derivatives(content_hash, record)
+
+def request_media_derivatives(content_hash, record):
+    """Start the background jobs that derive files from processed content (each skips finished work)."""
+    if not record:
+        return
+    request_media_transcodes(content_hash, record)
+    request_waveform(content_hash, record)
+    request_loudness_analysis(content_hash, os.path.join(app.config['UPLOAD_FOLDER'], record['filename']))
+    request_hls_package(content_hash, record)
+
+def request_media_processing(stored, room_id, audio_item, stem_role=None, client_fields=()):
+    """
+    Queue background processing for stored content and remember which queue item to upgrade.
+    Must be called without thread_lock held.
+    """
+    entry = {
+        'room_id': room_id,
+        'audio_item': audio_item,
+        'stem_role': stem_role,
+        'client_fields': set(client_fields),
+    }
+    with media_store_lock:
+        record = media_record_cache.get(stored['content_hash'])
+        if record is None:
+            waiting = pending_media_updates.setdefault(stored['content_hash'], [])
+            waiting.append(entry)
+            start_task = len(waiting) == 1
+    if record is not None:
+        # Another upload of the same bytes finished processing in the meantime.
+        apply_media_record(entry, record)
+    elif start_task:
+        socketio.start_background_task(run_media_processing, stored)
+
+def apply_media_record(entry, record):
+    """Fill a queue item from a processing record and announce it with track_updated."""
+    room_id = entry['room_id']
+    audio_item = entry['audio_item']
+    stem_role = entry['stem_role']
+
+    with thread_lock:
+        room_state = rooms_data.get(room_id)
+        if not room_state:
+            return
+        queue = room_state.get('queue', [])
+        index = next((i for i, item in enumerate(queue) if item is audio_item), None)
+
+        if record is not None:
+            metadata = record.get('metadata') or {}
+            if stem_role:
+                stem_entry = (audio_item.get('stems') or {}).get(stem_role)
+                if isinstance(stem_entry, dict):
+                    stem_entry['cover'] = record.get('cover')
+                    stem_entry['palette'] = record.get('palette')
+                    stem_entry['status'] = 'ready'
+                if record.get('cover') and (stem_role == AUDIO_ROLE_VOCALS or not audio_item.get('cover')):
+                    audio_item['cover'] = record.get('cover')
+                    audio_item['cover_thumbs'] = cover_thumb_refs(record.get('cover'))
+                    audio_item['palette'] = record.get('palette')
+                if record.get('duration'):
+                    audio_item['duration'] = max(audio_item.get('duration') or 0, record['duration'])
+                # Like the synchronous path, the vocals stem supplies the track tags.
+                tag_fields = ('title', 'artist', 'album') if stem_role == AUDIO_ROLE_VOCALS else ('album',)
+            else:
+                audio_item['cover'] = record.get('cover')
+                audio_item['cover_thumbs'] = cover_thumb_refs(record.get('cover'))
+                if record.get('cover'):
+                    audio_item['palette'] = record.get('palette')
+                audio_item['duration'] = record.get('duration')
+                tag_fields = ('title', 'artist', 'album')
+
+            for field in tag_fields:
+                if field not in entry['client_fields'] and metadata.get(field) and not (
+                        field == 'album' and stem_role and audio_item.get('album')):
+                    audio_item[field] = metadata[field]
+
+            if audio_item.get('title'):
+                audio_item['filename_display'] = f"{audio_item['title']} (Stems)" if stem_role else audio_item['title']
+
+        stems = audio_item.get('stems')
+        if isinstance(stems, dict) and any(
+                isinstance(s, dict) and s.get('status') == 'processing' for s in stems.values()):
+            audio_item['status'] = 'processing'
+        else:
+            audio_item['status'] = 'ready' if record is not None else 'failed'
+
+        is_current = index is not None and index == room_state.get('current_index')
+        if is_current:
+            room_state.update({
+                'current_file_display': audio_item.get('filename_display'),
+                'current_cover': audio_item.get('cover'),
+                'current_title': audio_item.get('title'),
+                'current_artist': audio_item.get('artist'),
+                'current_album': audio_item.get('album'),
+                'current_palette': audio_item.get('palette'),
+            })
+
+    if index is None:
+        return
+
+    print(f"[Room {room_id}] - Track processed: {audio_item.get('filename')} ({audio_item['status']})")
+    socketio.emit('track_updated', {
+        'index': index,
+        'is_current': is_current,
+        'item': audio_item,
+    }, to=room_id)
+
+def attach_content_field(content_hash, field, value):
+    """
+    Set a derived field on every queue item (or stem) holding that content and announce it.
+    Stream items are matched by their stream_key instead of a content hash.
+    """
+    updates = []
+    with thread_lock:
+        for room_id, room_state in rooms_data.items():
+            for index, item in enumerate(room_state.get('queue', [])):
+                changed = False
+                if content_hash in (item.get('content_hash'), item.get('stream_key')):
+                    item[field] = value
+                    changed = True
+                stems = item.get('stems')
+                if isinstance(stems, dict):
+                    for stem_entry in stems.values():
+                        if isinstance(stem_entry, dict) and stem_entry.get('content_hash') == content_hash:
+                            stem_entry[field] = value
+                            changed = True
+                if changed:
+                    updates.append((room_id, index, index == room_state.get('current_index'), item))
+
+    for room_id, index, is_current, item in updates:
+        socketio.emit('track_updated', {
+            'index': index,
+            'is_current': is_current,
+            'item': item,
+        }, to=room_id)
+
+
+# =================================================================================
+# Bitrate Ladder Transcoding
+# =================================================================================
+
+# When a local ffmpeg binary is available, lower-bitrate renditions are produced next
+# to each upload. Payloads carry the ladder (source first) and clients pick a rung
+# from their measured bandwidth; the original is still served when nothing fits better.
+FFMPEG_BIN = shutil.which(os.environ.get('FFMPEG_BIN', 'ffmpeg'))
+TRANSCODE_ENABLED = os.environ.get('TRANSCODE_ENABLED', '1') == '1' and FFMPEG_BIN is not None
+# Comma separated codec:kbps rungs, highest first
+TRANSCODE_LADDER = [
+    (codec.strip(), int(kbps))
+    for codec, kbps in (rung.split(':') for rung in os.environ.get('TRANSCODE_LADDER', 'opus:128,aac:128,opus:64').split(',') if ':' in rung)
+]
+# codec -> (ffmpeg encoder, ffmpeg muxer, file extension, mime type advertised to clients)
+TRANSCODE_CODECS = {
+    'opus': ('libopus', 'ogg', 'opus', 'audio/ogg; codecs=opus'),
+    'aac': ('aac', 'ipod', 'm4a', 'audio/mp4; codecs=mp4a.40.2'),
+}
+TRANSCODE_TIMEOUT_S = int(os.environ.get('TRANSCODE_TIMEOUT_S', '600'))
+mimetypes.add_type('audio/ogg', '.opus')
+mimetypes.add_type('audio/mp4', '.m4a')
+
+transcode_lock = threading.Lock()
+transcode_stats = {
+    'jobs': 0,
+    'failures': 0,
+    'transcode_seconds': 0.0,
+    'source_bytes': 0,
+    'rendition_bytes': 0,
+    'rendition_plays': 0,
+    'bytes_saved_served': 0,
+}
+# rendition filename -> bytes saved versus its source, used to account served renditions
+rendition_savings = {}
+transcodes_in_flight = set()
+
+def run_ffmpeg_transcode(source_path, output_path, codec, kbps, mix_with=None, audio_filter=None):
+    """
+    Encode one rendition with ffmpeg. Returns an error string, or None on success.
+    With `mix_with`, the second file is summed into the source (stem premix);
+    `audio_filter` is passed through as -af (channel variants).
+    """
+    encoder, muxer, _, _ = TRANSCODE_CODECS[codec]
+    tmp_path = f"{output_path}.tmp"
+    cmd = [FFMPEG_BIN, '-nostdin', '-v', 'error', '-y', '-i', source_path]
+    if mix_with:
+        # normalize=0 sums at unity, matching two elements playing side by side
+        cmd += ['-i', mix_with, '-filter_complex', 'amix=inputs=2:duration=longest:normalize=0']
+    elif audio_filter:
+        cmd += ['-af', audio_filter]
+    cmd += [
+        '-vn', '-map_metadata', '-1',
+        '-c:a', encoder, '-b:a', f'{kbps}k',
+    ]
+    if muxer == 'ipod':
+        cmd += ['-movflags', '+faststart']
+    cmd += ['-f', muxer, tmp_path]
+    try:
+        result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, timeout=TRANSCODE_TIMEOUT_S)
+        if result.returncode != 0:
+            return result.stderr.decode('utf-8', 'replace').strip()[-300:] or f'ffmpeg exited with {result.returncode}'
+        os.replace(tmp_path, output_path)
+        return None
+    except Exception as e:
+        return str(e)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def build_rendition_ladder(content_hash, record):
+    """Transcode the ladder rungs worth producing for a record and return the rendition list."""
+    source_filename = record['filename']
+    upload_folder = app.config['UPLOAD_FOLDER']
+    source_path = os.path.join(upload_folder, source_filename)
+    source_size = record.get('size') or os.path.getsize(source_path)
+    source_kbps = round(record['bitrate'] / 1000) if record.get('bitrate') else None
+
+    renditions = [{
+        'filename': source_filename,
+        'codec': 'source',
+        'bitrate_kbps': source_kbps,
+        'mime': mimetypes.guess_type(source_filename)[0] or 'audio/mpeg',
+        'size': source_size,
+    }]
+    for codec, kbps in TRANSCODE_LADDER:
+        if codec not in TRANSCODE_CODECS:
+            continue
+        # A rung is only useful when it is clearly smaller than the source
+        if source_kbps and kbps > source_kbps * 0.75:
+            continue
+        ext = TRANSCODE_CODECS[codec][2]
+        filename = f"{content_hash}.{codec}{kbps}.{ext}"
+        output_path = os.path.join(upload_folder, filename)
+
+        started = time.time()
+        error = None if os.path.exists(output_path) else _tpool_execute(
+            run_ffmpeg_transcode, source_path, output_path, codec, kbps
+        )
+        elapsed = time.time() - started
+        with transcode_lock:
+            transcode_stats['jobs'] += 1
+            transcode_stats['transcode_seconds'] += elapsed
+            if error:
+                transcode_stats['failures'] += 1
+        if error:
+            print(f"Transcode {codec}@{kbps}k failed for {source_filename}: {error}")
+            continue
+
+        size = os.path.getsize(output_path)
+        with transcode_lock:
+            transcode_stats['source_bytes'] += source_size
+            transcode_stats['rendition_bytes'] += size
+        print(f"[DEBUG] Transcoded {source_filename} -> {filename} in {elapsed:.1f}s ({size} bytes)")
+        renditions.append({
+            'filename': filename,
+            'codec': codec,
+            'bitrate_kbps': kbps,
+            'mime': TRANSCODE_CODECS[codec][3],
+            'size': size,
+        })
+    return renditions
+
+def register_rendition_savings(renditions):
+    if not renditions:
+        return
+    source_size = renditions[0].get('size') or 0
+    with transcode_lock:
+        for rendition in renditions[1:]:
+            rendition_savings[rendition['filename']] = max(0, source_size - (rendition.get('size') or 0))
+
+def run_media_transcodes(content_hash, record):
+    """Background task: build the bitrate ladder for stored content and attach it to queue items."""
+    try:
+        renditions = build_rendition_ladder(content_hash, record)
+    finally:
+        with transcode_lock:
+            transcodes_in_flight.discard(content_hash)
+    if len(renditions) < 2:
+        return
+
+    update_media_record(content_hash, {'renditions': renditions})
+    register_rendition_savings(renditions)
+    attach_content_field(content_hash, 'renditions', renditions)
+
+def request_media_transcodes(content_hash, record):
+    """Start ladder transcoding for a processed record unless it is disabled or already done."""
+    if not TRANSCODE_ENABLED or not record or record.get('renditions'):
+        return
+    with transcode_lock:
+        if content_hash in transcodes_in_flight:
+            return
+        transcodes_in_flight.add(content_hash)
+    socketio.start_background_task(run_media_transcodes, content_hash, record)
+
+def record_rendition_served(filename):
+    """Count one listener playing a rendition instead of its source for one track instance."""
+    with transcode_lock:
+        saved = rendition_savings.get(filename)
+        if saved is None:
+            return
+        transcode_stats['rendition_plays'] += 1
+        transcode_stats['bytes_saved_served'] += saved
+
+def get_transcode_stats():
+    with transcode_lock:
+        stats = dict(transcode_stats)
+    stats['enabled'] = TRANSCODE_ENABLED
+    stats['transcode_seconds'] = round(stats['transcode_seconds'], 2)
+    stats['bytes_saved_per_listener'] = (
+        stats['bytes_saved_served'] // stats['rendition_plays'] if stats['rendition_plays'] else 0
+    )
+    return stats
+
+# =================================================================================
+# Waveform Peak Index
+# =================================================================================
+
+# Each upload is decoded once (ffmpeg pipe, or the wave module for WAV without ffmpeg)
+# into mono 16-bit PCM read in fixed blocks, so memory stays bounded by the block size
+# plus the peak arrays. Peaks are stored as int8 min/max pairs at several resolutions.
+#
+# File layout (<content_hash>.peaks, little endian):
+#   header: b'AFPK', version u8, bits u8, level count u16, sample rate u32
+#   level table: samples_per_peak u32, peak count u32, byte offset u32 (per level)
+#   data: interleaved int8 (min, max) pairs, finest level first
+WAVEFORM_SAMPLE_RATE = 22050
+WAVEFORM_SAMPLES_PER_PEAK = 256
+WAVEFORM_MIN_PEAKS = 512  # coarsest level keeps at least this many peaks
+WAVEFORM_READ_SAMPLES = 256 * 1024
+WAVEFORM_MAGIC = b'AFPK'
+WAVEFORM_MAX_AGE = 31536000  # peak files are keyed by content hash and never change
+WAVEFORM_VERSION = 1
+waveform_lock = threading.Lock()
+waveforms_in_flight = set()
+
+def get_waveform_path(upload_folder, content_hash):
+    return os.path.join(upload_folder, f"{content_hash}.peaks")
+
+def iter_pcm_blocks(source_path, channels=1, sample_rate=WAVEFORM_SAMPLE_RATE, max_seconds=None):
+    """
+    Yield int16 numpy blocks of the decoded file at `sample_rate` (or the WAV's own rate
+    without ffmpeg). Mono blocks are 1-D; multichannel blocks have shape (frames, channels).
+    With `max_seconds` ffmpeg stops after that much audio, so a URL is only read that far.
+    """
+    import numpy as np
+    if FFMPEG_BIN:
+        limit = ['-t', f'{max_seconds:g}'] if max_seconds else []
+        proc = subprocess.Popen(
+            [FFMPEG_BIN, '-nostdin', '-v', 'error', '-i', source_path, '-vn', *limit,
+             '-ac', str(channels), '-ar', str(sample_rate), '-f', 's16le', '-'],
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+        )
+        frame_bytes = 2 * channels
+        try:
+            while True:
+                data = proc.stdout.read(WAVEFORM_READ_SAMPLES * frame_bytes)
+                if not data:
+                    break
+                samples = np.frombuffer(data[:len(data) - len(data) % frame_bytes], dtype='<i2')
+                yield samples.reshape(-1, channels) if channels > 1 else samples
+        finally:
+            proc.stdout.close()
+            proc.kill()
+            proc.wait()
+        return
+
+    with wave.open(source_path, 'rb') as wav:
+        width = wav.getsampwidth()
+        file_channels = wav.getnchannels()
+        if width not in (1, 2, 4):
+            raise ValueError(f'unsupported WAV sample width {width}')
+        while True:
+            frames = wav.readframes(WAVEFORM_READ_SAMPLES)
+            if not frames:
+                break
+            if width == 1:
+                samples = (np.frombuffer(frames, dtype=np.uint8).astype(np.int16) - 128) << 8
+            elif width == 2:
+                samples = np.frombuffer(frames, dtype='<i2')
+            else:
+                samples = (np.frombuffer(frames, dtype='<i4') >> 16).astype(np.int16)
+            samples = samples[:len(samples) - len(samples) % file_channels].reshape(-1, file_channels)
+            if channels == 1:
+                yield samples.mean(axis=1).astype(np.int16)
+            elif file_channels >= channels:
+                yield samples[:, :channels]
+            else:
+                yield np.repeat(samples[:, :1], channels, axis=1)
+
+def waveform_source_rate(source_path, sample_rate=WAVEFORM_SAMPLE_RATE):
+    """Rate of the blocks iter_pcm_blocks yields for this source."""
+    if FFMPEG_BIN:
+        return sample_rate
+    with wave.open(source_path, 'rb') as wav:
+        return wav.getframerate()
+
+def can_decode_source(source):
+    """Whether iter_pcm_blocks can decode this file or URL here."""
+    return bool(FFMPEG_BIN) or (not source.startswith(('http://', 'https://')) and source.lower().endswith('.wav'))
+
+def build_waveform_file(upload_folder, filename, content_hash):
+    """
+    Decode a stored upload and write its multi-resolution peak file.
+    Runs inside the media process pool; returns the peak filename or None.
+    """
+    import numpy as np
+    source_path = os.path.join(upload_folder, filename)
+    if not can_decode_source(source_path):
+        return None
+
+    spp = WAVEFORM_SAMPLES_PER_PEAK
+    mins, maxs = [], []
+    carry = np.empty(0, dtype=np.int16)
+    for block in iter_pcm_blocks(source_path):
+        block = np.concatenate((carry, block)) if len(carry) else block
+        usable = len(block) - len(block) % spp
+        if usable:
+            frames = block[:usable].reshape(-1, spp)
+            mins.append(frames.min(axis=1))
+            maxs.append(frames.max(axis=1))
+        carry = block[usable:].copy()
+    if len(carry):
+        mins.append(carry.min(keepdims=True))
+        maxs.append(carry.max(keepdims=True))
+    if not mins:
+        return None
+
+    level_min = (np.concatenate(mins) >> 8).astype(np.int8)
+    level_max = (np.concatenate(maxs) >> 8).astype(np.int8)
+    levels = [(spp, level_min, level_max)]
+    while len(level_min) >= WAVEFORM_MIN_PEAKS * 2:
+        even = len(level_min) - len(level_min) % 2
+        level_min = np.minimum(level_min[:even:2], level_min[1:even:2])
+        level_max = np.maximum(level_max[:even:2], level_max[1:even:2])
+        spp *= 2
+        levels.append((spp, level_min, level_max))
+
+    header = struct.pack('<4sBBHI', WAVEFORM_MAGIC, WAVEFORM_VERSION, 8, len(levels), waveform_source_rate(source_path))
+    offset = len(header) + 12 * len(levels)
+    table = b''
+    for samples_per_peak, level_min, _ in levels:
+        table += struct.pack('<III', samples_per_peak, len(level_min), offset)
+        offset += len(level_min) * 2
+
+    peaks_path = get_waveform_path(upload_folder, content_hash)
+    tmp_path = f"{peaks_path}.{uuid.uuid4().hex[:8]}.tmp"
+    with open(tmp_path, 'wb') as out:
+        out.write(header)
+        out.write(table)
+        for _, level_min, level_max in levels:
+            out.write(np.column_stack((level_min, level_max)).tobytes())
+    os.replace(tmp_path, peaks_path)
+    return os.path.basename(peaks_path)
+
+def run_waveform_build(content_hash, record):
+    """Background task: build the peak file in the process pool, then advertise it on queue items."""
+    peaks_filename = None
+    try:
+        future = get_media_process_pool().submit(
+            build_waveform_file, app.config['UPLOAD_FOLDER'], record['filename'], content_hash
+        )
+        peaks_filename = wait_for_pool_future(future)
+    except Exception as e:
+        print(f"Waveform analysis failed for {record['filename']}: {e}")
+    finally:
+        with waveform_lock:
+            waveforms_in_flight.discard(content_hash)
+    if not peaks_filename:
+        return
+
+    waveform_url = f"/waveform/{content_hash}"
+    update_media_record(content_hash, {'waveform': waveform_url})
+    attach_content_field(content_hash, 'waveform', waveform_url)
+
+def request_waveform(content_hash, record):
+    """Start peak analysis for a processed record unless it already has a waveform."""
+    if not record or record.get('waveform'):
+        return
+    with waveform_lock:
+        if content_hash in waveforms_in_flight:
+            return
+        waveforms_in_flight.add(content_hash)
+    socketio.start_background_task(run_waveform_build, content_hash, record)
+
+# =================================================================================
+# Loudness Normalization
+# =================================================================================
+
+# Integrated loudness follows ITU-R BS.1770: K-weighted mean square over 400 ms blocks
+# (100 ms hop) with the -70 LUFS absolute and -10 LU relative gates. The K-weighting is
+# applied in the frequency domain per 100 ms segment so the whole pass stays vectorized.
+# True peak is measured on a 4x windowed-sinc interpolation that carries its filter
+# context across PCM blocks, so block edges add no spurious peaks. The resulting gain
+# moves a track to LOUDNESS_TARGET_LUFS without pushing its true peak above
+# LOUDNESS_MAX_TRUE_PEAK. Streams are measured on their first LOUDNESS_STREAM_MAX_S
+# seconds only, read through the relay cache (see read_stream_for_analysis), so the
+# analysis never pulls a whole remote file and shares its bytes with playback.
+LOUDNESS_TARGET_LUFS = float(os.environ.get('LOUDNESS_TARGET_LUFS', '-14'))
+LOUDNESS_MAX_TRUE_PEAK = -1.0  # dBTP
+LOUDNESS_GAIN_RANGE = (-20.0, 12.0)  # dB
+LOUDNESS_SAMPLE_RATE = 44100
+LOUDNESS_STREAM_CACHE_SIZE = 512
+LOUDNESS_STREAM_MAX_S = float(os.environ.get('LOUDNESS_STREAM_MAX_S', '90'))
+TRUE_PEAK_OVERSAMPLE = 4
+TRUE_PEAK_TAPS = 12  # per interpolated phase
+# Two stems summed in the mix can peak up to 6 dB over either one
+STEM_MIX_HEADROOM_DB = 6.0
+loudness_lock = threading.Lock()
+loudness_in_flight = set()
+stream_loudness_cache = OrderedDict()
+
+def k_weighting_power(freqs):
+    """|H(f)|^2 of the BS.1770 K-weighting (48 kHz reference biquads evaluated at f)."""
+    import numpy as np
+    z = np.exp(-1j * 2 * np.pi * freqs / 48000.0)
+
+    def biquad(b, a):
+        return (b[0] + b[1] * z + b[2] * z ** 2) / (a[0] + a[1] * z + a[2] * z ** 2)
+
+    shelf = biquad((1.53512485958697, -2.69169618940638, 1.19839281085285), (1.0, -1.69065929318241, 0.73248077421585))
+    highpass = biquad((1.0, -2.0, 1.0), (1.0, -1.99004745483398, 0.99007225036621))
+    return np.abs(shelf * highpass) ** 2
+
+def true_peak_kernels():
+    """Windowed-sinc taps, one row per fractional phase between two input samples."""
+    import numpy as np
+    half = TRUE_PEAK_TAPS // 2
+    offsets = np.arange(-half + 1, half + 1)  # input samples n-5 .. n+6 around phase n+f
+    kernels = []
+    for phase in range(1, TRUE_PEAK_OVERSAMPLE):
+        t = phase / TRUE_PEAK_OVERSAMPLE - offsets
+        taps = np.sinc(t) * (0.5 + 0.5 * np.cos(np.pi * t / (half + 0.5)))
+        kernels.append(taps / taps.sum())
+    return np.array(kernels, dtype=np.float32)
+
+def block_true_peak(samples, context, kernels):
+    """
+    Peak of the interpolated signal for one block, continuing from the previous block's
+    `context` (the last TAPS - 1 input frames). Returns (peak, context for the next block).
+    """
+    import numpy as np
+    from numpy.lib.stride_tricks import sliding_window_view
+    buffered = np.concatenate((context, samples))
+    if len(buffered) < TRUE_PEAK_TAPS:
+        return 0.0, buffered
+    windows = sliding_window_view(buffered, TRUE_PEAK_TAPS, axis=0)  # (frames, channels, taps)
+    interpolated = windows @ kernels.T
+    return float(np.abs(interpolated).max()), buffered[-(TRUE_PEAK_TAPS - 1):]
+
+def analyze_loudness(source, max_seconds=None):
+    """
+    Decode a file or URL once and return {integrated_lufs, true_peak_dbtp, gain_db}.
+    Runs inside the media process pool; returns None when the source cannot be measured.
+    """
+    import numpy as np
+    if not can_decode_source(source):
+        return None
+
+    rate = waveform_source_rate(source, LOUDNESS_SAMPLE_RATE)
+    segment = rate // 10  # 100 ms
+    spectrum_weights = k_weighting_power(np.fft.rfftfreq(segment, 1.0 / rate))
+    # Parseval for a real FFT: every bin but DC/Nyquist stands for two
+    spectrum_weights[1:(segment + 1) // 2] *= 2
+    spectrum_weights /= segment * segment
+
+    segment_powers = []
+    peak = 0.0
+    carry = None
+    kernels = true_peak_kernels()
+    peak_context = None
+    blocks = iter_pcm_blocks(source, channels=2, sample_rate=LOUDNESS_SAMPLE_RATE, max_seconds=max_seconds)
+    for block in blocks:
+        samples = block.astype(np.float32) / 32768.0
+        if samples.ndim == 1:
+            samples = samples[:, None]
+
+        if peak_context is None:
+            peak_context = np.zeros((TRUE_PEAK_TAPS // 2 - 1, samples.shape[1]), dtype=np.float32)
+        block_peak, peak_context = block_true_peak(samples, peak_context, kernels)
+        peak = max(peak, block_peak, float(np.abs(samples).max()))
+
+        if carry is not None and len(carry):
+            samples = np.concatenate((carry, samples))
+        usable = len(samples) - len(samples) % segment
+        if usable:
+            segments = samples[:usable].reshape(-1, segment, samples.shape[1])
+            power = (np.abs(np.fft.rfft(segments, axis=1)) ** 2 * spectrum_weights[None, :, None]).sum(axis=1)
+            segment_powers.append(power.sum(axis=1))  # channel weights are 1.0 for L/R
+        carry = samples[usable:]
+
+    if not segment_powers:
+        return None
+    powers = np.concatenate(segment_powers)
+    if len(powers) < 4:
+        block_powers = np.array([powers.mean()])
+    else:
+        block_powers = np.convolve(powers, np.ones(4) / 4, mode='valid')
+
+    with np.errstate(divide='ignore'):
+        block_loudness = -0.691 + 10 * np.log10(block_powers)
+    gated = block_powers[block_loudness > -70]
+    if not len(gated):
+        return None
+    relative_gate = -0.691 + 10 * np.log10(gated.mean()) - 10
+    gated = block_powers[(block_loudness > -70) & (block_loudness > relative_gate)]
+    integrated = -0.691 + 10 * np.log10(gated.mean())
+    true_peak = 20 * np.log10(peak) if peak > 0 else -120.0
+
+    gain = min(LOUDNESS_TARGET_LUFS - integrated, LOUDNESS_MAX_TRUE_PEAK - true_peak)
+    gain = max(LOUDNESS_GAIN_RANGE[0], min(LOUDNESS_GAIN_RANGE[1], gain))
+    return {
+        'integrated_lufs': round(float(integrated), 2),
+        'true_peak_dbtp': round(float(true_peak), 2),
+        'gain_db': round(float(gain), 2),
+    }
+
+def get_stream_key(url):
+    """Stable key for an upstream stream URL (query strings often carry expiring tokens)."""
+    parsed = urlparse(url)
+    return 'stream:' + hashlib.sha256(f"{parsed.netloc}{parsed.path}".encode('utf-8')).hexdigest()
+
+def run_loudness_analysis(key, source):
+    """Background task: measure loudness in the process pool and attach gain_db to queue items."""
+    loudness = None
+    copied_path = None
+    try:
+        max_seconds = None
+        if key.startswith('stream:'):
+            # source is the stream's proxy id
+            source = copied_path = read_stream_for_analysis(source)
+            max_seconds = LOUDNESS_STREAM_MAX_S
+        if source is not None:
+            future = get_media_process_pool().submit(analyze_loudness, source, max_seconds)
+            loudness = wait_for_pool_future(future)
+    except Exception as e:
+        print(f"Loudness analysis failed for {key}: {e}")
+    finally:
+        with loudness_lock:
+            loudness_in_flight.discard(key)
+        if copied_path is not None:
+            try:
+                os.remove(copied_path)
+            except OSError:
+                pass
+    if not loudness:
+        return
+
+    print(f"[DEBUG] Loudness {key[:16]}: {loudness['integrated_lufs']} LUFS, "
+          f"{loudness['true_peak_dbtp']} dBTP -> {loudness['gain_db']:+} dB")
+    if key.startswith('stream:'):
+        with loudness_lock:
+            stream_loudness_cache[key] = loudness
+            while len(stream_loudness_cache) > LOUDNESS_STREAM_CACHE_SIZE:
+                stream_loudness_cache.popitem(last=False)
+    else:
+        update_media_record(key, {'loudness': loudness})
+    attach_content_field(key, 'gain_db', loudness['gain_db'])
+
+def request_loudness_analysis(key, source):
+    """
+    Return a known gain for an upload (content hash) or stream key, or start measuring it.
+    source is the stored file for an upload and the proxy id for a stream.
+    Returns None while the analysis is pending.
+    """
+    if key.startswith('stream:'):
+        with loudness_lock:
+            loudness = stream_loudness_cache.get(key)
+    else:
+        loudness = (get_media_record(key) or {}).get('loudness')
+    if loudness:
+        return loudness['gain_db']
+    if not can_decode_source(source):
+        return None
+    with loudness_lock:
+        if key in loudness_in_flight:
+            return None
+        loudness_in_flight.add(key)
+    socketio.start_background_task(run_loudness_analysis, key, source)
+    return None
+
+# =================================================================================
+# Stem Premix
+# =================================================================================
+
+# Mix-role members of a stem track would otherwise download and sync both stems. Once
+# both are stored, a single premixed file is encoded in the background and advertised
+# as the stem item's `premix`; until then (or without ffmpeg) the two-element path stays.
+STEM_PREMIX_ENABLED = os.environ.get('STEM_PREMIX_ENABLED', '1').lower() not in ('0', 'false', 'no')
+STEM_PREMIX_CODEC = os.environ.get('STEM_PREMIX_CODEC', 'aac')
+STEM_PREMIX_KBPS = int(os.environ.get('STEM_PREMIX_KBPS', '192'))
+premix_lock = threading.Lock()
+premixes_in_flight = set()
+
+def get_premix_key(vocals_hash, instrumental_hash):
+    """Record key for the premix of a stem pair."""
+    return hashlib.sha256(f"premix:{vocals_hash}:{instrumental_hash}".encode('ascii')).hexdigest()
+
+def get_stored_premix(premix_key):
+    """Return the premix payload for a stem pair if it was already produced, else None."""
+    record = get_media_record(premix_key)
+    if not record or not os.path.exists(os.path.join(app.config['UPLOAD_FOLDER'], record['filename'])):
+        return None
+    return {
+        'filename': record['filename'],
+        'gain_db': (record.get('loudness') or {}).get('gain_db'),
+    }
+
+def run_stem_premix(premix_key, vocals_filename, instrumental_filename):
+    """Background task: encode the premix, measure its loudness and attach it to stem items."""
+    upload_folder = app.config['UPLOAD_FOLDER']
+    filename = f"{premix_key}.mix{STEM_PREMIX_KBPS}.{TRANSCODE_CODECS[STEM_PREMIX_CODEC][2]}"
+    output_path = os.path.join(upload_folder, filename)
+    try:
+        started = time.time()
+        error = _tpool_execute(
+            run_ffmpeg_transcode, os.path.join(upload_folder, vocals_filename), output_path,
+            STEM_PREMIX_CODEC, STEM_PREMIX_KBPS, os.path.join(upload_folder, instrumental_filename)
+        )
+        if error:
+            print(f"Stem premix failed for {vocals_filename} + {instrumental_filename}: {error}")
+            return
+        print(f"[DEBUG] Premixed {vocals_filename} + {instrumental_filename} -> {filename} in {time.time() - started:.1f}s")
+
+        loudness = None
+        try:
+            future = get_media_process_pool().submit(analyze_loudness, output_path)
+            loudness = wait_for_pool_future(future)
+        except Exception as e:
+            print(f"Loudness analysis failed for {filename}: {e}")
+        update_media_record(premix_key, {'filename': filename, 'loudness': loudness})
+    finally:
+        with premix_lock:
+            premixes_in_flight.discard(premix_key)
+
+    premix = get_stored_premix(premix_key)
+    if premix:
+        attach_premix(premix_key, premix)
+
+def attach_premix(premix_key, premix):
+    """Set the premix on every stem item of that pair and announce it."""
+    updates = []
+    with thread_lock:
+        for room_id, room_state in rooms_data.items():
+            for index, item in enumerate(room_state.get('queue', [])):
+                if item.get('premix_key') == premix_key and item.get('premix') != premix:
+                    item['premix'] = premix
+                    updates.append((room_id, index, index == room_state.get('current_index'), item))
+
+    for room_id, index, is_current, item in updates:
+        socketio.emit('track_updated', {
+            'index': index,
+            'is_current': is_current,
+            'item': item,
+        }, to=room_id)
+
+def request_stem_premix(premix_key, vocals_filename, instrumental_filename):
+    """Return the premix for a stem pair if it exists, otherwise start producing it."""
+    premix = get_stored_premix(premix_key)
+    if premix or not STEM_PREMIX_ENABLED or not FFMPEG_BIN or STEM_PREMIX_CODEC not in TRANSCODE_CODECS:
+        return premix
+    with premix_lock:
+        if premix_key in premixes_in_flight:
+            return None
+        premixes_in_flight.add(premix_key)
+    socketio.start_background_task(run_stem_premix, premix_key, vocals_filename, instrumental_filename)
+    return None
+
+# =================================================================================
+# Channel Variants
+# =================================================================================
+
+# Members set to the left or right channel only need half of a stereo file. They are
+# pointed at "<file>.<side>.<ext>", a mono file holding just that channel (AAC with
+# ffmpeg, WAV-to-WAV without). The first request for a variant starts a background
+# build; until it exists members keep the stereo file and /uploads answers 503.
+CHANNEL_VARIANTS_ENABLED = os.environ.get('CHANNEL_VARIANTS_ENABLED', '1').lower() not in ('0', 'false', 'no')
+CHANNEL_VARIANT_CODEC = 'aac'
+CHANNEL_VARIANT_KBPS = int(os.environ.get('CHANNEL_VARIANT_KBPS', '96'))
+CHANNEL_VARIANT_PATTERN = re.compile(r'^(?P<source>.+)\.(?P<side>left|right)\.(?P<ext>m4a|wav)$')
+CHANNEL_VARIANT_RETRY_AFTER_S = 5
+channel_variant_lock = threading.Lock()
+channel_variants_in_flight = set()
+
+def channel_variant_filename(filename, side):
+    """Name of the mono variant of an upload for `side`, or None when it cannot be produced here."""
+    if not CHANNEL_VARIANTS_ENABLED or side not in (CHANNEL_MODE_LEFT, CHANNEL_MODE_RIGHT):
+        return None
+    if CHANNEL_VARIANT_PATTERN.match(filename):
+        return None
+    if FFMPEG_BIN:
+        return f"{filename}.{side}.{TRANSCODE_CODECS[CHANNEL_VARIANT_CODEC][2]}"
+    if filename.lower().endswith('.wav'):
+        return f"{filename}.{side}.wav"
+    return None
+
+def build_channel_variant(upload_folder, source_filename, side, output_filename):
+    """
+    Write the mono `side` channel of an upload. Runs inside the media process pool;
+    returns an error string, or None on success.
+    """
+    source_path = os.path.join(upload_folder, source_filename)
+    output_path = os.path.join(upload_folder, output_filename)
+    channel = 0 if side == CHANNEL_MODE_LEFT else 1
+    if output_filename.endswith('.wav') and not FFMPEG_BIN:
+        tmp_path = f"{output_path}.tmp"
+        try:
+            rate = waveform_source_rate(source_path)
+            with wave.open(tmp_path, 'wb') as out:
+                out.setnchannels(1)
+                out.setsampwidth(2)
+                out.setframerate(rate)
+                for block in iter_pcm_blocks(source_path, channels=2):
+                    out.writeframes(block[:, channel].astype('<i2').tobytes())
+            os.replace(tmp_path, output_path)
+            return None
+        except Exception as e:
+            return str(e)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    # Mono sources are upmixed first so both sides still get the signal
+    return run_ffmpeg_transcode(
+        source_path, output_path, CHANNEL_VARIANT_CODEC, CHANNEL_VARIANT_KBPS,
+        audio_filter=f'aformat=channel_layouts=stereo,pan=mono|c0=c{channel}'
+    )
+
+def run_channel_variant_build(filename, source_filename, side):
+    """Background task: bring the source back if it was evicted and build one channel variant."""
+    upload_folder = app.config['UPLOAD_FOLDER']
+    try:
+        if not os.path.exists(os.path.join(upload_folder, source_filename)) and not fetch_remote_media(source_filename):
+            print(f"Channel variant {filename} failed: source {source_filename} is gone")
+            return
+        started = time.time()
+        future = get_media_process_pool().submit(build_channel_variant, upload_folder, source_filename, side, filename)
+        error = wait_for_pool_future(future)
+        if error:
+            print(f"Channel variant {filename} failed: {error}")
+            return
+        print(f"[DEBUG] Built channel variant {filename} in {time.time() - started:.1f}s")
+    except Exception as e:
+        print(f"Channel variant {filename} failed: {e}")
+    finally:
+        with channel_variant_lock:
+            channel_variants_in_flight.discard(filename)
+
+def request_channel_variant(filename):
+    """
+    Start building a channel variant in the background unless it exists or is already being
+    built. Returns True when the variant exists or is on its way, False when it cannot be made.
+    Never waits for the build, so it is safe on the request path.
+    """
+    if os.path.exists(os.path.join(app.config['UPLOAD_FOLDER'], filename)):
+        return True
+    match = CHANNEL_VARIANT_PATTERN.match(filename)
+    if not match or channel_variant_filename(match.group('source'), match.group('side')) != filename:
+        return False
+    if not os.path.exists(os.path.join(app.config['UPLOAD_FOLDER'], match.group('source'))) and get_s3_client() is None:
+        return False
+    with channel_variant_lock:
+        if filename in channel_variants_in_flight:
+            return True
+        channel_variants_in_flight.add(filename)
+    socketio.start_background_task(run_channel_variant_build, filename, match.group('source'), match.group('side'))
+    return True
+
+# =================================================================================
+# HLS Packaging
+# =================================================================================
+
+# Optional: each upload is also cut into short fMP4 segments with a VOD playlist under
+# <uploads>/hls/<content_hash>/. A first play or far seek then fetches one small segment
+# instead of ranges of a large file, so start latency is about the same on every member.
+# Clients that play HLS natively use it; the others keep the progressive file.
+HLS_ENABLED = os.environ.get('HLS_ENABLED', '0').lower() in ('1', 'true', 'yes')
+HLS_SEGMENT_S = int(os.environ.get('HLS_SEGMENT_S', '4'))
+HLS_KBPS = int(os.environ.get('HLS_KBPS', '160'))
+HLS_DIRNAME = 'hls'
+HLS_FILE_PATTERN = re.compile(r'^(index\.m3u8|init\.mp4|seg\d{5}\.m4s)$')
+mimetypes.add_type('application/vnd.apple.mpegurl', '.m3u8')
+mimetypes.add_type('video/iso.segment', '.m4s')
+hls_lock = threading.Lock()
+hls_in_flight = set()
+
+def get_hls_dir(content_hash):
+    return os.path.join(app.config['UPLOAD_FOLDER'], HLS_DIRNAME, content_hash)
+
+def run_hls_segmenter(source_path, output_dir):
+    """Segment one file with ffmpeg into output_dir. Returns an error string, or None on success."""
+    tmp_dir = f"{output_dir}.{uuid.uuid4().hex[:8]}.tmp"
+    os.makedirs(tmp_dir)
+    cmd = [
+        FFMPEG_BIN, '-nostdin', '-v', 'error', '-y',
+        '-i', source_path, '-vn', '-map_metadata', '-1',
+        '-c:a', 'aac', '-b:a', f'{HLS_KBPS}k',
+        '-f', 'hls', '-hls_time', str(HLS_SEGMENT_S), '-hls_playlist_type', 'vod',
+        '-hls_segment_type', 'fmp4', '-hls_fmp4_init_filename', 'init.mp4',
+        '-hls_segment_filename', os.path.join(tmp_dir, 'seg%05d.m4s'),
+        os.path.join(tmp_dir, 'index.m3u8'),
+    ]
+    try:
+        result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, timeout=TRANSCODE_TIMEOUT_S)
+        if result.returncode != 0:
+            return result.stderr.decode('utf-8', 'replace').strip()[-300:] or f'ffmpeg exited with {result.returncode}'
+        os.replace(tmp_dir, output_dir)
+        return None
+    except Exception as e:
+        return str(e)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+def run_hls_package(content_hash, record):
+    """Background task: segment stored content and advertise the playlist on queue items."""
+    output_dir = get_hls_dir(content_hash)
+    try:
+        if not os.path.exists(os.path.join(output_dir, 'index.m3u8')):
+            os.makedirs(os.path.dirname(output_dir), exist_ok=True)
+            started = time.time()
+            error = _tpool_execute(
+                run_hls_segmenter, os.path.join(app.config['UPLOAD_FOLDER'], record['filename']), output_dir
+            )
+            if error:
+                print(f"HLS packaging failed for {record['filename']}: {error}")
+                return
+            print(f"[DEBUG] Packaged {record['filename']} as HLS in {time.time() - started:.1f}s")
+    finally:
+        with hls_lock:
+            hls_in_flight.discard(content_hash)
+
+    hls_url = f"/hls/{content_hash}/index.m3u8"
+    update_media_record(content_hash, {'hls': hls_url})
+    attach_content_field(content_hash, 'hls', hls_url)
+
+def request_hls_package(content_hash, record):
+    """Start HLS packaging for a processed record when enabled and not done yet."""
+    if not HLS_ENABLED or not FFMPEG_BIN or not record or record.get('hls'):
+        return
+    with hls_lock:
+        if content_hash in hls_in_flight:
+            return
+        hls_in_flight.add(content_hash)
+    socketio.start_background_task(run_hls_package, content_hash, record)
+
+def get_upload_store_stats():
+    """Return dedup counters for the upload store."""
+    with media_store_lock:
+        stats = dict(upload_store_stats)
+    stats['dedup_hit_rate'] = round(stats['dedup_hits'] / stats['uploads'], 4) if stats['uploads'] else 0.0
+    with upload_session_lock:
+        stats['open_sessions'] = len(upload_sessions)
+    return stats
+
+# =================================================================================
+# Media Storage
+# =================================================================================
+
+# UPLOAD_FOLDER is the working copy every pipeline stage reads. Its files are grouped by
+# the content hash their names start with (source, record, cover, thumbnails, renditions,
+# peaks, variants, HLS). With STORAGE_QUOTA_MB set, a sweep deletes groups that no room
+# queue references, least recently accessed first, once the folder outgrows the quota.
+#
+# STORAGE_BACKEND=s3 also copies each new upload and cover to an S3-compatible bucket
+# (S3_ENDPOINT_URL points at MinIO or another compatible service). Those local copies
+# are then only a cache: a sweep may drop them even while queued, and /uploads fetches
+# them back on the next request.
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'local').lower()
+STORAGE_QUOTA_BYTES = int(os.environ.get('STORAGE_QUOTA_MB', '0')) * 1024 * 1024
+STORAGE_LOW_WATER = 0.9  # a sweep frees space down to this fraction of the quota
+STORAGE_MIN_IDLE_S = int(os.environ.get('STORAGE_MIN_IDLE_S', '600'))
+STORAGE_SWEEP_INTERVAL_S = 300
+S3_BUCKET = os.environ.get('S3_BUCKET', '')
+S3_PREFIX = os.environ.get('S3_PREFIX', 'audioflow/')
+S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL') or None
+MEDIA_GROUP_PATTERN = re.compile(r'^([0-9a-f]{64})')
+storage_lock = threading.Lock()
+storage_sweep_running = False
+media_last_access = {}
+remote_media = set()
+s3_client = None
+storage_stats = {
+    'sweeps': 0,
+    'evicted_groups': 0,
+    'evicted_files': 0,
+    'evicted_bytes': 0,
+    'remote_puts': 0,
+    'remote_fetches': 0,
+    'remote_failures': 0,
+}
+
+def media_group_key(filename):
+    match = MEDIA_GROUP_PATTERN.match(filename or '')
+    return match.group(1) if match else None
+
+def touch_media(filename):
+    """Record an access for LRU eviction (plain dict write, cheap enough for the serving path)."""
+    key = media_group_key(filename)
+    if key:
+        media_last_access[key] = time.time()
+
+def get_s3_client():
+    """Return the S3 client for STORAGE_BACKEND=s3, or None when remote storage is off."""
+    global s3_client
+    if STORAGE_BACKEND != 's3' or not S3_BUCKET or boto3 is None:
+        return None
+    if s3_client is None:
+        s3_client = boto3.client('s3', endpoint_url=S3_ENDPOINT_URL)
+    return s3_client
+
+def storage_put(filename):
+    """Copy a local file to the remote backend. Returns True on success."""
+    client = get_s3_client()
+    path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    if client is None or not os.path.isfile(path):
+        return False
+    try:
+        client.upload_file(path, S3_BUCKET, S3_PREFIX + filename,
+                           ExtraArgs={'ContentType': mimetypes.guess_type(filename)[0] or 'application/octet-stream'})
+    except Exception as e:
+        print(f"Remote storage put failed for {filename}: {e}")
+        with storage_lock:
+            storage_stats['remote_failures'] += 1
+        return False
+    with storage_lock:
+        remote_media.add(filename)
+        storage_stats['remote_puts'] += 1
+    return True
+
+def storage_fetch(filename):
+    """Restore a file from the remote backend into UPLOAD_FOLDER. Returns True when it is local."""
+    client = get_s3_client()
+    if client is None or not media_group_key(filename):
+        return False
+    path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    tmp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+    try:
+        client.download_file(S3_BUCKET, S3_PREFIX + filename, tmp_path)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        if getattr(e, 'response', {}).get('Error', {}).get('Code') not in ('404', 'NoSuchKey'):
+            print(f"Remote storage fetch failed for {filename}: {e}")
+            with storage_lock:
+                storage_stats['remote_failures'] += 1
+        return False
+    with storage_lock:
+        remote_media.add(filename)
+        storage_stats['remote_fetches'] += 1
+    touch_media(filename)
+    return True
+
+def storage_exists_remote(filename):
+    """Whether the remote backend holds a copy (remembered after the first check)."""
+    with storage_lock:
+        if filename in remote_media:
+            return True
+    client = get_s3_client()
+    if client is None:
+        return False
+    try:
+        client.head_object(Bucket=S3_BUCKET, Key=S3_PREFIX + filename)
+    except Exception:
+        return False
+    with storage_lock:
+        remote_media.add(filename)
+    return True
+
+def request_remote_put(filename):
+    if filename and get_s3_client() is not None:
+        socketio.start_background_task(_tpool_execute, storage_put, filename)
+
+def fetch_remote_media(filename):
+    """Bring an evicted file back from the remote backend (blocking in a native thread)."""
+    if get_s3_client() is None:
+        return False
+    return _tpool_execute(storage_fetch, filename)
+
+def get_media_refcounts():
+    """Count queue references per content group across all rooms (items, stems, covers, premixes)."""
+    counts = {}
+    with thread_lock:
+        for room_state in rooms_data.values():
+            for item in room_state.get('queue', []):
+                names = {item.get('filename'), item.get('cover'), (item.get('premix') or {}).get('filename')}
+                for stem in (item.get('stems') or {}).values():
+                    if isinstance(stem, dict):
+                        names.update((stem.get('filename'), stem.get('cover')))
+                    else:
+                        names.add(stem)
+                for name in names:
+                    key = media_group_key(name)
+                    if key:
+                        counts.setdefault(key, {'refs': 0, 'names': set()})
+                        counts[key]['refs'] += 1
+                        counts[key]['names'].add(name)
+    return counts
+
+def scan_media_groups():
+    """Return {group: {'files': [(name, path, size)], 'bytes': n, 'mtime': t}} for UPLOAD_FOLDER."""
+    upload_folder = app.config['UPLOAD_FOLDER']
+    groups = {}
+
+    def add(key, name, path, size, mtime):
+        group = groups.setdefault(key, {'files': [], 'bytes': 0, 'mtime': 0})
+        group['files'].append((name, path, size))
+        group['bytes'] += size
+        group['mtime'] = max(group['mtime'], mtime)
+
+    try:
+        entries = list(os.scandir(upload_folder))
+    except OSError:
+        return groups
+    for entry in entries:
+        key = media_group_key(entry.name)
+        if not key:
+            continue
+        try:
+            stat = entry.stat()
+        except OSError:
+            continue
+        if entry.is_file():
+            add(key, entry.name, entry.path, stat.st_size, stat.st_mtime)
+
+    hls_root = os.path.join(upload_folder, HLS_DIRNAME)
+    if os.path.isdir(hls_root):
+        for entry in os.scandir(hls_root):
+            key = media_group_key(entry.name)
+            if not key or not entry.is_dir():
+                continue
+            size = 0
+            for segment in os.scandir(entry.path):
+                try:
+                    size += segment.stat().st_size
+                except OSError:
+                    pass
+            add(key, f"{HLS_DIRNAME}/{entry.name}", entry.path, size, entry.stat().st_mtime)
+    return groups
+
+def evict_media_files(key, files, whole_group, sweep_started):
+    """Delete files of one group; returns bytes freed. Skips groups touched since the sweep began."""
+    freed = 0
+    with media_store_lock:
+        if media_last_access.get(key, 0) > sweep_started:
+            return 0
+        for name, path, size in files:
+            try:
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+            except OSError as e:
+                print(f"Could not evict {name}: {e}")
+                continue
+            freed += size
+            discard_hot_media(name)
+            with storage_lock:
+                storage_stats['evicted_files'] += 1
+        if whole_group:
+            media_record_cache.pop(key, None)
+    return freed
+
+def enforce_storage_quota():
+    """Evict least recently used media until UPLOAD_FOLDER fits STORAGE_LOW_WATER of the quota."""
+    if not STORAGE_QUOTA_BYTES:
+        return
+    sweep_started = time.time()
+    groups = _tpool_execute(scan_media_groups)
+    total = sum(group['bytes'] for group in groups.values())
+    with storage_lock:
+        storage_stats['sweeps'] += 1
+        storage_stats['used_bytes'] = total
+    if total <= STORAGE_QUOTA_BYTES:
+        return
+
+    target = STORAGE_QUOTA_BYTES * STORAGE_LOW_WATER
+    refcounts = get_media_refcounts()
+    remote_enabled = get_s3_client() is not None
+    candidates = sorted(groups.items(), key=lambda kv: media_last_access.get(kv[0]) or kv[1]['mtime'])
+    for key, group in candidates:
+        if total <= target:
+            break
+        last_access = media_last_access.get(key) or group['mtime']
+        if sweep_started - last_access < STORAGE_MIN_IDLE_S:
+            continue
+        refs = refcounts.get(key)
+        if not refs:
+            files, whole_group = group['files'], True
+        elif remote_enabled:
+            # Queued media: only drop local copies the bucket can give back
+            files = [f for f in group['files'] if f[0] in refs['names'] and _tpool_execute(storage_exists_remote, f[0])]
+            whole_group = False
+        else:
+            continue
+        if not files:
+            continue
+        freed = evict_media_files(key, files, whole_group, sweep_started)
+        if freed:
+            total -= freed
+            with storage_lock:
+                storage_stats['evicted_bytes'] += freed
+                if whole_group:
+                    storage_stats['evicted_groups'] += 1
+            if whole_group:
+                media_last_access.pop(key, None)
+    with storage_lock:
+        storage_stats['used_bytes'] = total
+    if total > STORAGE_QUOTA_BYTES:
+        print(f"[DEBUG] Storage still over quota after sweep: {total} of {STORAGE_QUOTA_BYTES} bytes (queued media)")
+
+def run_storage_sweep():
+    global storage_sweep_running
+    try:
+        enforce_storage_quota()
+    except Exception as e:
+        print(f"Storage sweep failed: {e}")
+    finally:
+        with storage_lock:
+            storage_sweep_running = False
+
+def request_storage_sweep():
+    """Start a quota sweep unless one is running (new uploads and the periodic watcher call this)."""
+    global storage_sweep_running
+    if not STORAGE_QUOTA_BYTES:
+        return
+    with storage_lock:
+        if storage_sweep_running:
+            return
+        storage_sweep_running = True
+    socketio.start_background_task(run_storage_sweep)
+
+def watch_media_storage():
+    """Background task: derived files (renditions, peaks, HLS) grow after upload, so sweep periodically."""
+    while True:
+        socketio.sleep(STORAGE_SWEEP_INTERVAL_S)
+        request_storage_sweep()
+
+def get_storage_stats():
+    with storage_lock:
+        stats = dict(storage_stats)
+    stats['backend'] = 's3' if get_s3_client() is not None else 'local'
+    stats['quota_bytes'] = STORAGE_QUOTA_BYTES or None
+    return stats
+
+
+# =================================================================================
+# Resumable Chunked Uploads
+# =================================================================================
+
+# A session preallocates its destination file; chunks are written at their offsets
+# (in any order, possibly in parallel) and finalize hashes the result into the store.
+UPLOAD_CHUNK_SIZE = int(os.environ.get('UPLOAD_CHUNK_SIZE', str(4 * 1024 * 1024)))
+UPLOAD_SESSION_MAX_BYTES = int(os.environ.get('UPLOAD_SESSION_MAX_BYTES', str(1024 * 1024 * 1024)))
+UPLOAD_SESSION_TTL = int(os.environ.get('UPLOAD_SESSION_TTL', '3600'))  # seconds since last activity
+upload_sessions = {}
+upload_session_lock = threading.Lock()
+
+def expire_upload_sessions():
+    """Drop sessions (and their partial files) idle for longer than UPLOAD_SESSION_TTL."""
+    cutoff = time.time() - UPLOAD_SESSION_TTL
+    with upload_session_lock:
+        expired = [sid for sid, s in upload_sessions.items() if s['updated_at'] < cutoff]
+        sessions = [upload_sessions.pop(sid) for sid in expired]
+    for session in sessions:
+        if session.get('tmp_path') and os.path.exists(session['tmp_path']):
+            os.remove(session['tmp_path'])
+        print(f"[Room {session['room']}] - Upload session expired: {session['id']}")
+
+def create_upload_session(room, original_name, size):
+    """Create a session for a file of `size` bytes and preallocate its partial file."""
+    expire_upload_sessions()
+
+    safe_name = unicode_secure_filename(original_name) or ''
+    ext = os.path.splitext(safe_name)[1].lower().lstrip('.')
+    if ext not in ALLOWED_EXTENSIONS:
+        ext = 'mp3'
+
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    session_id = uuid.uuid4().hex
+    tmp_path = os.path.join(app.config['UPLOAD_FOLDER'], f".partial_{session_id}")
+    with open(tmp_path, 'wb') as out:
+        out.truncate(size)
+
+    session = {
+        'id': session_id,
+        'room': room,
+        'original_filename': original_name,
+        'ext': ext,
+        'size': size,
+        'chunk_size': UPLOAD_CHUNK_SIZE,
+        'chunk_count': max(1, -(-size // UPLOAD_CHUNK_SIZE)),
+        'received': set(),
+        'tmp_path': tmp_path,
+        'stored': None,
+        'finalizing': False,
+        'created_at': time.time(),
+        'updated_at': time.time(),
+    }
+    with upload_session_lock:
+        upload_sessions[session_id] = session
+    return session
+
+def get_upload_session(session_id):
+    with upload_session_lock:
+        return upload_sessions.get(session_id)
+
+def describe_upload_session(session):
+    with upload_session_lock:
+        received = sorted(session['received'])
+    return {
+        'success': True,
+        'session_id': session['id'],
+        'size': session['size'],
+        'chunk_size': session['chunk_size'],
+        'chunk_count': session['chunk_count'],
+        'received': received,
+        'finalized': session['stored'] is not None,
+    }
+
+def write_upload_chunk(session, offset, data, checksum=None):
+    """
+    Write one chunk at its offset in the session's partial file.
+    Returns an error string, or None when the chunk was accepted.
+    """
+    if offset < 0 or offset % session['chunk_size'] or offset >= session['size']:
+        return 'Offset is not a chunk boundary'
+    expected_length = min(session['chunk_size'], session['size'] - offset)
+    if len(data) != expected_length:
+        return f'Chunk must be {expected_length} bytes'
+    if checksum and hashlib.sha256(data).hexdigest() != checksum.lower():
+        return 'Chunk checksum mismatch'
+    with upload_session_lock:
+        if session['finalizing'] or session['stored'] is not None:
+            return 'Upload is already finalized'
+
+    with open(session['tmp_path'], 'r+b') as out:
+        out.seek(offset)
+        out.write(data)
+
+    with upload_session_lock:
+        session['received'].add(offset // session['chunk_size'])
+        session['updated_at'] = time.time()
+    return None
+
+def finalize_upload_session(session):
+    """
+    Hash the completed partial file and move it into the store.
+    Returns the stored-upload dict (as store_upload does), or None if chunks are missing.
+    A concurrent finalize of the same session waits for the first one and shares its result.
+    """
+    while True:
+        with upload_session_lock:
+            if session['stored'] is not None:
+                return session['stored']
+            if len(session['received']) < session['chunk_count']:
+                return None
+            if not session['finalizing']:
+                session['finalizing'] = True
+                break
+        socketio.sleep(0.1)
+
+    try:
+        # Hashing hundreds of MB must not stall the green hub
+        content_hash, _ = _tpool_execute(hash_stored_file, session['tmp_path'])
+        stored = commit_stored_file(session['tmp_path'], session['ext'], content_hash, session['size'])
+        with upload_session_lock:
+            session['stored'] = stored
+            session['updated_at'] = time.time()
+        return stored
+    finally:
+        with upload_session_lock:
+            session['finalizing'] = False
+
+def claim_finalized_upload(session_id, room):
+    """
+    Take a finalized session for enqueueing (each session can be enqueued once).
+    Returns (stored, original_filename) or (None, None).
+    """
+    claimed = claim_finalized_uploads([session_id], room)
+    return claimed[0] if claimed else (None, None)
+
+def claim_finalized_uploads(session_ids, room):
+    """
+    Take several finalized sessions at once: all of them, or none when any is missing,
+    unfinalized, from another room or repeated. Returns a list of (stored, original_filename) or None.
+    """
+    with upload_session_lock:
+        sessions = [upload_sessions.get(session_id) for session_id in session_ids]
+        if len(set(session_ids)) != len(session_ids) or any(
+            not session or session['room'] != room or session['stored'] is None for session in sessions
+        ):
+            return None
+        for session_id in session_ids:
+            del upload_sessions[session_id]
+    return [(session['stored'], session['original_filename']) for session in sessions]
+
+
+# =================================================================================
+# Flask Routes
+# =================================================================================
+
+@app.route('/stats')
+def get_server_stats():
+    """Report server-side media pipeline counters."""
+    return jsonify({
+        'upload_store': get_upload_store_stats(),
+        'tag_probe': get_probe_stats(),
+        'transcode': get_transcode_stats(),
+        'media_serve': get_media_serve_stats(),
+        'storage': get_storage_stats(),
+        'stream_relay': get_stream_relay_stats(),
+        'proxy_map': get_proxy_map_stats(),
+        'stream_pins': get_stream_pin_stats(),
+    })
+
+@app.route('/metadata/<path:filename>')
+def get_metadata(filename):
+    """Get metadata for an existing audio file."""
+    try:
+        import urllib.parse
+        decoded_filename = urllib.parse.unquote(filename)
+        file_path = os.path.join(app.config['UPLOAD_FOLDER'], decoded_filename)
+        
+        if not os.path.exists(file_path):
+            return jsonify({'error': 'File not found'}), 404
+            
+        probe = probe_audio_file(file_path) or {}
+        metadata = dict(probe.get('metadata') or {})
+        for field in ('duration', 'bitrate', 'sample_rate', 'channels'):
+            metadata[field] = probe.get(field)
+        return jsonify(metadata)
+        
+    except Exception as e:
+        print(f"Error getting metadata for {filename}: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/lyrics')
+def get_song_lyrics():
+    """Get lyrics for a song based on artist and title parameters."""
+    artist = request.args.get('artist')
+    title = request.args.get('title')
+    
+    if not artist or not title:
+        return jsonify({'error': 'Both artist and title parameters are required'}), 400
+    
+    try:
+        lyrics = get_lyrics(artist, title)
+        if lyrics:
+            return jsonify({
+                'success': True,
+                'lyrics': lyrics,
+                'artist': artist,
+                'title': title
+            })
+        else:
+            return jsonify({
+                'success': False,
+                'message': 'Lyrics not found',
+                'artist': artist,
+                'title': title
+            }), 404
+    except Exception as e:
+        print(f"Error fetching lyrics for {artist} - {title}: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/lyrics/<path:filename>')
+def get_lyrics_for_file(filename):
+    """Get lyrics for a song based on its filename (extracts metadata first)."""
+    try:
+        import urllib.parse
+        decoded_filename = urllib.parse.unquote(filename)
+        file_path = os.path.join(app.config['UPLOAD_FOLDER'], decoded_filename)
+        
+        if not os.path.exists(file_path):
+            return jsonify({'error': 'File not found'}), 404
+        
+        # Extract metadata first
+        metadata = extract_metadata(file_path)
         artist = metadata.get('artist')
         title = metadata.get('title')
         
@@ -805,65 +3070,439 @@ def get_lyrics_for_file(filename):
         print(f"Error getting lyrics for file {filename}: {e}")
         return jsonify({'error': str(e)}), 500
 
+# =================================================================================
+# Upload Serving
+# =================================================================================
+
+# /uploads is hit for every Range request an audio element makes while buffering and
+# seeking, so this path does no logging and a single stat. Files in the content store
+# are named after their content hash and never change: they get a strong ETag from
+# that name and immutable caching. Werkzeug answers Range (206), If-Range and
+# If-None-Match (304). With MEDIA_OFFLOAD a front proxy streams the bytes instead:
+#   x-accel    -> X-Accel-Redirect: MEDIA_OFFLOAD_PREFIX/<file> (nginx "internal" location)
+#   x-sendfile -> X-Sendfile: <absolute path> (Apache mod_xsendfile, lighttpd)
+MEDIA_OFFLOAD = os.environ.get('MEDIA_OFFLOAD', '').lower()
+MEDIA_OFFLOAD_PREFIX = os.environ.get('MEDIA_OFFLOAD_PREFIX', '/_uploads/').rstrip('/') + '/'
+MEDIA_READ_BLOCK = 256 * 1024  # file iterator chunk when the server has no wsgi.file_wrapper
+MEDIA_IMMUTABLE_MAX_AGE = 31536000
+CONTENT_ADDRESSED_PATTERN = re.compile(r'^[0-9a-f]{64}[0-9A-Za-z_.\-]*$')
+media_serve_lock = threading.Lock()
+media_serve_stats = {
+    'requests': 0,
+    'partial': 0,
+    'not_modified': 0,
+    'offloaded': 0,
+    'bytes_sent': 0,
+}
+
+def media_file_wrapper(file, buffer_size=8192):
+    return FileWrapper(file, max(buffer_size, MEDIA_READ_BLOCK))
+
+def resolve_upload_path(filename):
+    """Return (filename, absolute path) of an existing upload, or (None, None)."""
+    upload_folder = app.config['UPLOAD_FOLDER']
+    for candidate in (filename, urllib.parse.unquote(filename)):
+        path = safe_join(upload_folder, candidate)
+        if path and os.path.isfile(path):
+            return candidate, path
+        if candidate == filename and '%' not in filename:
+            break
+    if CHANNEL_VARIANT_PATTERN.match(filename):
+        return None, None  # variants are rebuilt locally (request_channel_variant), never fetched
+    if '/' not in filename and fetch_remote_media(filename):
+        return filename, safe_join(upload_folder, filename)
+    return None, None
+
+def count_media_response(status_code, length=0, offloaded=False):
+    with media_serve_lock:
+        media_serve_stats['requests'] += 1
+        if status_code == 206:
+            media_serve_stats['partial'] += 1
+        elif status_code == 304:
+            media_serve_stats['not_modified'] += 1
+        if offloaded:
+            media_serve_stats['offloaded'] += 1
+        media_serve_stats['bytes_sent'] += length or 0
+
+def get_media_serve_stats():
+    with media_serve_lock:
+        stats = dict(media_serve_stats)
+    stats['offload'] = MEDIA_OFFLOAD or None
+    stats['hot_cache'] = get_hot_media_stats()
+    return stats
+
+# ---------------------------------------------------------------------------------
+# Hot Media Cache
+# ---------------------------------------------------------------------------------
+
+# When a track starts, every member of the room fetches the same files within the same
+# second. The files of the current and next track (per member role/channel resolution,
+# plus the cover) are read once into a byte-bounded LRU and served from memory, Range
+# requests included. Only content-addressed files are cached: their bytes never change,
+# so a hit needs no stat.
+HOT_MEDIA_CACHE_BYTES = int(os.environ.get('HOT_MEDIA_CACHE_MB', '256')) * 1024 * 1024
+HOT_MEDIA_MAX_FILE_BYTES = int(os.environ.get('HOT_MEDIA_MAX_FILE_MB', '64')) * 1024 * 1024
+hot_media_lock = threading.Lock()
+hot_media_cache = OrderedDict()  # filename -> (bytes, mtime)
+hot_media_size = 0
+hot_media_warming = set()
+hot_media_stats = {
+    'hits': 0,
+    'misses': 0,
+    'bytes_served': 0,
+    'warmed_files': 0,
+    'evictions': 0,
+}
+
+def get_hot_media(filename):
+    """Return (data, mtime) for a cached file, or None. Only cacheable names count as misses."""
+    if not HOT_MEDIA_CACHE_BYTES or not CONTENT_ADDRESSED_PATTERN.match(filename):
+        return None
+    with hot_media_lock:
+        entry = hot_media_cache.get(filename)
+        if entry is None:
+            hot_media_stats['misses'] += 1
+            return None
+        hot_media_cache.move_to_end(filename)
+        hot_media_stats['hits'] += 1
+        return entry
+
+def cache_hot_media(filename, data, mtime):
+    global hot_media_size
+    with hot_media_lock:
+        if filename in hot_media_cache:
+            return
+        hot_media_cache[filename] = (data, mtime)
+        hot_media_size += len(data)
+        while hot_media_size > HOT_MEDIA_CACHE_BYTES and len(hot_media_cache) > 1:
+            _, (evicted, _) = hot_media_cache.popitem(last=False)
+            hot_media_size -= len(evicted)
+            hot_media_stats['evictions'] += 1
+
+def discard_hot_media(filename):
+    """Drop a file from the cache (it is being deleted)."""
+    global hot_media_size
+    with hot_media_lock:
+        entry = hot_media_cache.pop(filename, None)
+        if entry is not None:
+            hot_media_size -= len(entry[0])
+
+def read_media_file(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+def run_hot_media_warm(filenames):
+    """Background task: read not-yet-cached files into the hot cache."""
+    upload_folder = app.config['UPLOAD_FOLDER']
+    try:
+        for filename in filenames:
+            with hot_media_lock:
+                if filename in hot_media_cache:
+                    hot_media_cache.move_to_end(filename)
+                    continue
+            path = safe_join(upload_folder, filename)
+            try:
+                if not path or not os.path.isfile(path):
+                    continue
+                stat = os.stat(path)
+                if stat.st_size > HOT_MEDIA_MAX_FILE_BYTES:
+                    continue
+                data = _tpool_execute(read_media_file, path)
+            except OSError as e:
+                print(f"Could not warm {filename}: {e}")
+                continue
+            cache_hot_media(filename, data, stat.st_mtime)
+            with hot_media_lock:
+                hot_media_stats['warmed_files'] += 1
+    finally:
+        with hot_media_lock:
+            hot_media_warming.difference_update(filenames)
+
+def warm_room_media(room_id, emit_data):
+    """Warm the files a room's members will request for a track (current or next)."""
+    if not HOT_MEDIA_CACHE_BYTES or not emit_data or emit_data.get('is_stream'):
+        return
+    member_list = rooms_data.get(room_id, {}).get('member_list', {})
+    resolutions = {
+        (get_member_audio_role(room_id, sid), get_member_channel_mode(room_id, sid)) for sid in member_list
+    } or {(AUDIO_ROLE_MIX, CHANNEL_MODE_STEREO)}
+
+    filenames = []
+    for role, channel_mode in resolutions:
+        resolved = resolve_emit_data_for_role(emit_data, role, channel_mode)
+        for name in (resolved.get('filename'), resolved.get('cover'), *(resolved.get('mix_filenames') or {}).values()):
+            if name and name not in filenames and CONTENT_ADDRESSED_PATTERN.match(name):
+                filenames.append(name)
+
+    with hot_media_lock:
+        filenames = [name for name in filenames if name not in hot_media_warming]
+        hot_media_warming.update(filenames)
+    if filenames:
+        socketio.start_background_task(run_hot_media_warm, filenames)
+
+def get_hot_media_stats():
+    with hot_media_lock:
+        stats = dict(hot_media_stats)
+        stats['files'] = len(hot_media_cache)
+        stats['bytes'] = hot_media_size
+    stats['capacity_bytes'] = HOT_MEDIA_CACHE_BYTES
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_rate'] = round(stats['hits'] / lookups, 3) if lookups else None
+    return stats
+
 @app.route('/uploads/<path:filename>')
 def serve_file(filename):
-    """Serve uploaded files with proper Unicode handling."""
-    print(f"[DEBUG] Serving file: {repr(filename)}")
-    # Ensure filename is properly decoded
-    try:
-        import urllib.parse
-        decoded_filename = urllib.parse.unquote(filename)
-        print(f"[DEBUG] Decoded filename: {repr(decoded_filename)}")
-        return send_from_directory(app.config['UPLOAD_FOLDER'], decoded_filename)
-    except Exception as e:
-        print(f"[DEBUG] Fallback to original filename due to error: {e}")
-        return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    """Serve an uploaded file (audio, rendition, variant or cover) with Range and conditional support."""
+    touch_media(filename)
+    hot = get_hot_media(filename) if MEDIA_OFFLOAD not in ('x-accel', 'x-sendfile') else None
+    if hot is not None:
+        data, mtime = hot
+        response = Response(data, mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+        response.last_modified = mtime
+        response.set_etag(filename)
+        response.make_conditional(request, accept_ranges=True, complete_length=len(data))
+        count_media_response(response.status_code, response.content_length)
+        with hot_media_lock:
+            hot_media_stats['bytes_served'] += response.content_length or 0
+        response.headers['Cache-Control'] = f'public, max-age={MEDIA_IMMUTABLE_MAX_AGE}, immutable'
+        return response
+
+    requested = filename
+    filename, path = resolve_upload_path(filename)
+    if not path:
+        if CHANNEL_VARIANT_PATTERN.match(requested) and request_channel_variant(requested):
+            response = jsonify({'error': 'Channel variant is being built'})
+            response.status_code = 503
+            response.headers['Retry-After'] = str(CHANNEL_VARIANT_RETRY_AFTER_S)
+            return response
+        return jsonify({'error': 'File not found'}), 404
+
+    stat = os.stat(path)
+    immutable = bool(CONTENT_ADDRESSED_PATTERN.match(filename))
+    etag = filename if immutable else f"{stat.st_size:x}-{stat.st_mtime_ns:x}"
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    max_age = MEDIA_IMMUTABLE_MAX_AGE if immutable else None
+
+    if MEDIA_OFFLOAD in ('x-accel', 'x-sendfile'):
+        if request.if_none_match.contains_weak(etag):
+            response = Response(status=304)
+        else:
+            response = Response(mimetype=mimetype)
+            if MEDIA_OFFLOAD == 'x-accel':
+                response.headers['X-Accel-Redirect'] = MEDIA_OFFLOAD_PREFIX + urllib.parse.quote(filename)
+            else:
+                response.headers['X-Sendfile'] = os.path.abspath(path)
+        response.set_etag(etag, weak=not immutable)
+        count_media_response(response.status_code, offloaded=response.status_code != 304)
+    else:
+        request.environ.setdefault('wsgi.file_wrapper', media_file_wrapper)
+        response = send_file(path, mimetype=mimetype, conditional=False, etag=False,
+                             last_modified=stat.st_mtime, max_age=max_age)
+        # Our ETag must be in place before the Range / If-None-Match / If-Range evaluation
+        response.set_etag(etag, weak=not immutable)
+        response.make_conditional(request, accept_ranges=True, complete_length=stat.st_size)
+        count_media_response(response.status_code, response.content_length)
+
+    response.headers['Accept-Ranges'] = 'bytes'
+    if immutable:
+        response.headers['Cache-Control'] = f'public, max-age={MEDIA_IMMUTABLE_MAX_AGE}, immutable'
+    return response
+
+
+@app.route('/hls/<content_hash>/<name>')
+def serve_hls(content_hash, name):
+    """Serve an HLS playlist or segment (see HLS Packaging); all of them are immutable."""
+    if not re.fullmatch(r'[0-9a-f]{64}', content_hash) or not HLS_FILE_PATTERN.match(name):
+        return jsonify({'error': 'Unknown segment'}), 404
+    hls_dir = get_hls_dir(content_hash)
+    if not os.path.isfile(os.path.join(hls_dir, name)):
+        return jsonify({'error': 'Segment not found'}), 404
+
+    response = send_from_directory(hls_dir, name, conditional=True, max_age=MEDIA_IMMUTABLE_MAX_AGE)
+    response.headers['Cache-Control'] = f'public, max-age={MEDIA_IMMUTABLE_MAX_AGE}, immutable'
+    return response
+
+@app.route('/waveform/<track>')
+def serve_waveform(track):
+    """Serve a track's peak file (see Waveform Peak Index); <track> is the content hash or stored filename."""
+    content_hash = track.split('.', 1)[0].lower()
+    if not re.fullmatch(r'[0-9a-f]{64}', content_hash):
+        return jsonify({'error': 'Unknown track'}), 404
+
+    upload_folder = app.config['UPLOAD_FOLDER']
+    if not os.path.exists(get_waveform_path(upload_folder, content_hash)):
+        with waveform_lock:
+            pending = content_hash in waveforms_in_flight
+        return jsonify({'error': 'Waveform not ready' if pending else 'Waveform not found', 'pending': pending}), 404
+
+    # conditional=True lets clients fetch a single level with a Range request
+    response = send_from_directory(upload_folder, f"{content_hash}.peaks",
+                                   mimetype='application/octet-stream', conditional=True, max_age=WAVEFORM_MAX_AGE)
+    response.headers['Cache-Control'] = f'public, max-age={WAVEFORM_MAX_AGE}, immutable'
+    return response
+
+@app.route('/covers/<path:filename>')
+def serve_cover_thumbnail(filename):
+    """Serve a cover thumbnail (<cover>.<size>.<webp|jpg>), generating the set on first request."""
+    match = COVER_THUMB_PATTERN.match(filename)
+    if not match or int(match.group('size')) not in COVER_THUMB_SIZES.values():
+        return jsonify({'error': 'Unknown thumbnail'}), 404
+
+    upload_folder = app.config['UPLOAD_FOLDER']
+    if not os.path.exists(os.path.join(upload_folder, filename)):
+        if not os.path.exists(os.path.join(upload_folder, match.group('cover'))):
+            return jsonify({'error': 'Cover not found'}), 404
+        # Covers processed before derivatives existed are converted lazily, off the hub
+        _tpool_execute(generate_cover_thumbnails, upload_folder, match.group('cover'))
+
+    response = send_from_directory(upload_folder, filename, max_age=COVER_THUMB_MAX_AGE)
+    response.headers['Cache-Control'] = f'public, max-age={COVER_THUMB_MAX_AGE}, immutable'
+    return response
 
 
 # ==================================================================
 # Streaming proxy support
 # ==================================================================
 
-# Simple in-memory mapping for resolved download links with expiry
-# key: proxy_id, value: { 'url': original_url, 'expires_at': timestamp }
-proxy_url_map = OrderedDict()
+# proxy_id -> upstream URL, with a sliding PROXY_TTL and at most PROXY_MAP_CAPACITY ids.
+# The local map is an LRU (OrderedDict) plus a min-heap of (expires_at, proxy_id):
+# expiry pops only what is due, O(log n) each, inline with adds and lookups. Lookups
+# just move the deadline; a popped heap item whose entry was refreshed meanwhile is
+# pushed back with the new deadline instead of being removed.
+# With PROXY_REDIS_URL the ids also live in redis (SETEX/EXPIRE), so any worker can
+# resolve them; the local map then works as a read-through cache in front of it.
+proxy_url_map = OrderedDict()  # proxy_id -> {'url', 'alternates', 'expires_at', 'shared_at'}, LRU order
+proxy_expiry_heap = []
 proxy_lock = threading.Lock()
 PROXY_TTL = int(os.environ.get('PROXY_TTL', '300'))  # seconds
+PROXY_MAP_CAPACITY = int(os.environ.get('PROXY_MAP_CAPACITY', '5000'))
+PROXY_REDIS_URL = os.environ.get('PROXY_REDIS_URL') or None
+PROXY_REDIS_PREFIX = 'audioflow:proxy:'
+proxy_redis = None
+proxy_map_stats = {'added': 0, 'hits': 0, 'misses': 0, 'expired': 0, 'evicted': 0, 'shared_hits': 0}
+
+def get_proxy_redis():
+    """Return the shared redis client, or None for the in-process map only."""
+    global proxy_redis, PROXY_REDIS_URL
+    if not PROXY_REDIS_URL or redis is None:
+        return None
+    if proxy_redis is None:
+        try:
+            client = redis.Redis.from_url(PROXY_REDIS_URL, socket_timeout=2, decode_responses=True)
+            _tpool_execute(client.ping)
+            proxy_redis = client
+        except Exception as e:
+            print(f"Proxy map: redis unavailable ({e}); using the in-process map only")
+            PROXY_REDIS_URL = None
+            return None
+    return proxy_redis
 
-def cleanup_proxy_map():
-    """Background cleaner for expired proxy entries."""
-    while True:
-        with proxy_lock:
-            now = _time.time()
-            keys = [k for k, v in proxy_url_map.items() if v['expires_at'] <= now]
-            for k in keys:
-                del proxy_url_map[k]
-        _time.sleep(30)
-
-# Start cleaner thread (daemon)
-cleanup_thread = threading.Thread(target=cleanup_proxy_map, daemon=True)
-cleanup_thread.start()
-
-def add_proxy_url(original_url):
-    """Add a resolved URL to the proxy map and return a short id."""
+def expire_proxy_entries(now):
+    """Drop due entries; call with proxy_lock held."""
+    while proxy_expiry_heap and proxy_expiry_heap[0][0] <= now:
+        _, proxy_id = heapq.heappop(proxy_expiry_heap)
+        entry = proxy_url_map.get(proxy_id)
+        if entry is None:
+            continue
+        if entry['expires_at'] > now:
+            heapq.heappush(proxy_expiry_heap, (entry['expires_at'], proxy_id))
+        else:
+            del proxy_url_map[proxy_id]
+            proxy_map_stats['expired'] += 1
+
+def remember_proxy_url(proxy_id, original_url, now, shared_at=0.0, alternates=()):
+    """Insert into the local map; call with proxy_lock held."""
+    expire_proxy_entries(now)
+    proxy_url_map[proxy_id] = {
+        'url': original_url, 'alternates': list(alternates), 'expires_at': now + PROXY_TTL, 'shared_at': shared_at
+    }
+    proxy_url_map.move_to_end(proxy_id)
+    heapq.heappush(proxy_expiry_heap, (now + PROXY_TTL, proxy_id))
+    while len(proxy_url_map) > PROXY_MAP_CAPACITY:
+        proxy_url_map.popitem(last=False)
+        proxy_map_stats['evicted'] += 1
+    # Evicted ids leave stale heap items behind; rebuild once they dominate
+    if len(proxy_expiry_heap) > 2 * len(proxy_url_map) + 64:
+        proxy_expiry_heap[:] = [(e['expires_at'], pid) for pid, e in proxy_url_map.items()]
+        heapq.heapify(proxy_expiry_heap)
+
+def add_proxy_url(original_url, alternates=()):
+    """
+    Add a resolved URL to the proxy map and return a short id. `alternates` are other
+    renditions of the same track (e.g. lower qualities) that hedged opens may fall back to;
+    they are kept in this process only.
+    """
     proxy_id = uuid.uuid4().hex[:12]
-    expires_at = _time.time() + PROXY_TTL
+    now = _time.time()
+    client = get_proxy_redis()
+    if client is not None:
+        try:
+            _tpool_execute(client.setex, PROXY_REDIS_PREFIX + proxy_id, PROXY_TTL, original_url)
+        except Exception as e:
+            print(f"Proxy map: redis write failed for {proxy_id}: {e}")
     with proxy_lock:
-        proxy_url_map[proxy_id] = {'url': original_url, 'expires_at': expires_at}
-    print(f"[DEBUG] Added proxy_id: {proxy_id} for URL: {original_url}")
+        remember_proxy_url(proxy_id, original_url, now, shared_at=now, alternates=alternates)
+        proxy_map_stats['added'] += 1
     return proxy_id
 
-def get_proxy_url(proxy_id):
+def get_proxy_url(proxy_id, refresh=True):
+    """Return the URL for a proxy id (sliding its expiry), or None when unknown or expired."""
+    now = _time.time()
     with proxy_lock:
+        expire_proxy_entries(now)
         entry = proxy_url_map.get(proxy_id)
-        print(f"[DEBUG] Looking up proxy_id: {proxy_id}, found: {entry is not None}")
-        if not entry:
-            print(f"[DEBUG] Available proxy_ids: {list(proxy_url_map.keys())}")
-            return None
-        # refresh expiry on access
-        entry['expires_at'] = _time.time() + PROXY_TTL
-        print(f"[DEBUG] Returning URL: {entry['url']}")
-        return entry['url']
+        if entry is not None:
+            proxy_url_map.move_to_end(proxy_id)
+            proxy_map_stats['hits'] += 1
+            if refresh:
+                entry['expires_at'] = now + PROXY_TTL
+            # Refresh the shared copy at most a few times per TTL, not on every Range request
+            share = refresh and now - entry['shared_at'] > PROXY_TTL / 4
+            if share:
+                entry['shared_at'] = now
+            url = entry['url']
+        else:
+            share, url = False, None
+
+    client = get_proxy_redis()
+    if client is None:
+        if url is None:
+            with proxy_lock:
+                proxy_map_stats['misses'] += 1
+        return url
+    try:
+        if url is not None:
+            if share:
+                _tpool_execute(client.expire, PROXY_REDIS_PREFIX + proxy_id, PROXY_TTL)
+            return url
+        # Registered by another worker
+        url = _tpool_execute(client.get, PROXY_REDIS_PREFIX + proxy_id)
+        if url and refresh:
+            _tpool_execute(client.expire, PROXY_REDIS_PREFIX + proxy_id, PROXY_TTL)
+    except Exception as e:
+        print(f"Proxy map: redis lookup failed for {proxy_id}: {e}")
+        return url
+    with proxy_lock:
+        if url:
+            remember_proxy_url(proxy_id, url, now, shared_at=now)
+            proxy_map_stats['shared_hits'] += 1
+        else:
+            proxy_map_stats['misses'] += 1
+    return url
+
+def get_proxy_alternates(proxy_id):
+    with proxy_lock:
+        entry = proxy_url_map.get(proxy_id)
+        return list(entry['alternates']) if entry else []
+
+def get_proxy_map_stats():
+    with proxy_lock:
+        expire_proxy_entries(_time.time())
+        stats = dict(proxy_map_stats)
+        stats['entries'] = len(proxy_url_map)
+    stats['capacity'] = PROXY_MAP_CAPACITY
+    stats['shared'] = get_proxy_redis() is not None
+    return stats
 
 @app.route('/register_proxy', methods=['POST'])
 def register_proxy():
@@ -1029,86 +3668,1350 @@ def crop_image_to_square_basic(image_data):
         print(f"[DEBUG] Error in basic cropping: {e}")
         return image_data  # Return original if cropping fails
 
-def get_youtube_audio_url(video_id):
-    """Deprecated: server must not resolve YouTube audio URLs. Always return None."""
+def generate_cover_thumbnails(upload_folder, cover_filename):
+    """
+    Write square-cropped WebP and JPEG thumbnails of a cover at every COVER_THUMB_SIZES size.
+    Returns the number of files written (0 when they already exist or the cover is unreadable).
+    """
+    source_path = os.path.join(upload_folder, cover_filename)
+    targets = [
+        (size, fmt, os.path.join(upload_folder, cover_thumb_filename(cover_filename, size, fmt)))
+        for size in sorted(set(COVER_THUMB_SIZES.values()))
+        for fmt in COVER_THUMB_FORMATS
+    ]
+    missing = [t for t in targets if not os.path.exists(t[2])]
+    if not missing or not os.path.exists(source_path):
+        return 0
+
+    try:
+        with open(source_path, 'rb') as f:
+            square = Image.open(io.BytesIO(crop_image_to_square(f.read())))
+            square.load()
+        if square.mode != 'RGB':
+            square = square.convert('RGB')
+    except Exception as e:
+        print(f"Could not read cover {cover_filename} for thumbnails: {e}")
+        return 0
+
+    written = 0
+    for size, fmt, path in missing:
+        thumb = square if square.width <= size else square.resize((size, size), Image.LANCZOS)
+        tmp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+        try:
+            if fmt == 'webp':
+                thumb.save(tmp_path, format='WEBP', quality=80, method=4)
+            else:
+                thumb.save(tmp_path, format='JPEG', quality=85, optimize=True, progressive=True)
+            os.replace(tmp_path, path)
+            written += 1
+        except Exception as e:
+            print(f"Could not write cover thumbnail {os.path.basename(path)}: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    return written
+
+# =================================================================================
+# Cover Palettes
+# =================================================================================
+
+# Dominant color + palette are computed once per cover (or stream image) and sent in
+# payloads, so clients theme immediately instead of sampling pixels in a canvas.
+PALETTE_COLORS = 3
+PALETTE_SAMPLE_SIZE = 64
+PALETTE_CACHE_SIZE = int(os.environ.get('PALETTE_CACHE_SIZE', '512'))
+PALETTE_MAX_IMAGE_BYTES = 5 * 1024 * 1024
+palette_cache = OrderedDict()
+palette_lock = threading.Lock()
+palettes_in_flight = set()
+
+def compute_image_palette(image_data, colors=PALETTE_COLORS):
+    """
+    Return {'dominant': [r, g, b], 'palette': [[r, g, b], ...]} for an image using k-means.
+    Near-white and near-black pixels are ignored like ColorThief does; returns None on failure.
+    """
+    try:
+        import numpy as np
+        img = Image.open(io.BytesIO(image_data))
+        img.draft('RGB', (PALETTE_SAMPLE_SIZE * 2, PALETTE_SAMPLE_SIZE * 2))
+        img = img.convert('RGB')
+        img.thumbnail((PALETTE_SAMPLE_SIZE, PALETTE_SAMPLE_SIZE))
+        pixels = np.asarray(img, dtype=np.float32).reshape(-1, 3)
+
+        brightness = pixels.mean(axis=1)
+        usable = pixels[(brightness < 250) & (brightness > 5)]
+        if len(usable) < colors:
+            usable = pixels
+
+        # Deterministic seeds: the most populated cells of a coarse 8x8x8 color histogram
+        cells = (usable // 32).astype(np.int32)
+        cell_ids = cells[:, 0] * 64 + cells[:, 1] * 8 + cells[:, 2]
+        counts = np.bincount(cell_ids, minlength=512)
+        seeds = np.argsort(counts)[::-1][:colors]
+        seeds = seeds[counts[seeds] > 0]
+        centers = np.stack([usable[cell_ids == s].mean(axis=0) for s in seeds])
+
+        for _ in range(10):
+            distances = ((usable[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2)
+            labels = distances.argmin(axis=1)
+            updated = np.stack([
+                usable[labels == k].mean(axis=0) if np.any(labels == k) else centers[k]
+                for k in range(len(centers))
+            ])
+            if np.allclose(updated, centers, atol=0.5):
+                break
+            centers = updated
+
+        sizes = np.bincount(labels, minlength=len(centers))
+        order = np.argsort(sizes)[::-1]
+        palette = [[int(round(v)) for v in centers[k]] for k in order]
+        return {'dominant': palette[0], 'palette': palette}
+    except Exception as e:
+        print(f"[DEBUG] Palette extraction failed: {e}")
+        return None
+
+def get_cached_palette(key):
+    with palette_lock:
+        palette = palette_cache.get(key)
+        if palette is not None:
+            palette_cache.move_to_end(key)
+        return palette
+
+def cache_palette(key, palette):
+    if not palette:
+        return
+    with palette_lock:
+        palette_cache[key] = palette
+        palette_cache.move_to_end(key)
+        while len(palette_cache) > PALETTE_CACHE_SIZE:
+            palette_cache.popitem(last=False)
+
+def run_image_palette(image_url):
+    """Background task: fetch a stream image once, compute its palette and attach it to queue items."""
+    palette = None
+    try:
+        upstream = _tpool_execute(download_session.get, image_url, timeout=15)
+        if upstream.status_code < 400 and len(upstream.content) <= PALETTE_MAX_IMAGE_BYTES:
+            palette = _tpool_execute(compute_image_palette, upstream.content)
+    except Exception as e:
+        print(f"[DEBUG] Could not fetch image for palette: {e}")
+    finally:
+        with palette_lock:
+            palettes_in_flight.discard(image_url)
+    if not palette:
+        return
+    cache_palette(('url', image_url), palette)
+
+    updates = []
+    with thread_lock:
+        for room_id, room_state in rooms_data.items():
+            for index, item in enumerate(room_state.get('queue', [])):
+                if item.get('image_url') == image_url and not item.get('cover') and item.get('palette') != palette:
+                    item['palette'] = palette
+                    is_current = index == room_state.get('current_index')
+                    if is_current:
+                        room_state['current_palette'] = palette
+                    updates.append((room_id, index, is_current, item))
+
+    for room_id, index, is_current, item in updates:
+        socketio.emit('track_updated', {
+            'index': index,
+            'is_current': is_current,
+            'item': item,
+        }, to=room_id)
+
+def request_image_palette(image_url):
+    """Return the cached palette for a stream image, starting its computation if needed."""
+    if not image_url:
+        return None
+    palette = get_cached_palette(('url', image_url))
+    if palette is not None:
+        return palette
+    with palette_lock:
+        if image_url in palettes_in_flight:
+            return None
+        palettes_in_flight.add(image_url)
+    socketio.start_background_task(run_image_palette, image_url)
+    return None
+
+def get_youtube_audio_url(video_id):
+    """Deprecated: server must not resolve YouTube audio URLs. Always return None."""
+    return None
+
+def stream_remote_range(url):
+    """Stream remote content while supporting Range requests from the client.
+    This function proxies the upstream URL and yields chunks.
+    """
+    # Determine client's range header
+    range_header = request.headers.get('Range')
+    key = get_stream_key(url)
+    probe = get_stream_probe(key)
+    if probe is not None and probe['fetch_url'] is None:
+        answered = serve_stream_probe(probe, range_header, url)
+        if answered is not None:
+            return answered
+    headers = {}
+    if range_header:
+        headers['Range'] = range_header
+
+    # Stream from upstream
+    upstream, _ = _tpool_execute(open_hedged_upstream, url, headers)
+    with stream_relay_lock:
+        count_start_upstream_request(key)
+    # Some upstreams (Invidious instances) may reject Range for tiny probes. If 403/416 and we had Range, retry without Range.
+    if upstream.status_code in (403, 416) and 'Range' in headers:
+        print(f"[DEBUG] Upstream returned {upstream.status_code} for ranged request. Retrying without Range...")
+        upstream.close()
+        upstream, _ = _tpool_execute(open_hedged_upstream, url, {})
+        with stream_relay_lock:
+            count_start_upstream_request(key)
+
+    # Build response headers
+    upstream_headers = {}
+    for h in ['Content-Type', 'Content-Length', 'Accept-Ranges', 'Content-Range']:
+        if h in upstream.headers:
+            upstream_headers[h] = upstream.headers[h]
+
+    # Ensure a sensible Content-Type for audio if missing
+    if 'Content-Type' not in upstream_headers:
+        import mimetypes
+        guessed, _ = mimetypes.guess_type(url)
+        if guessed and guessed.startswith('audio/'):
+            upstream_headers['Content-Type'] = guessed
+        else:
+            # Common fallbacks for youtube streams
+            ct = 'audio/mp4'
+            if '.mp3' in url:
+                ct = 'audio/mpeg'
+            elif '.webm' in url:
+                ct = 'audio/webm'
+            upstream_headers['Content-Type'] = ct
+
+    # Ensure Range support headers
+    if range_header and 'Accept-Ranges' not in upstream_headers:
+        upstream_headers['Accept-Ranges'] = 'bytes'
+
+    # CORS headers so the audio element can use the stream
+    upstream_headers['Access-Control-Allow-Origin'] = '*'
+    upstream_headers['Access-Control-Allow-Headers'] = 'Range, Origin, Accept, Content-Type'
+    upstream_headers['Access-Control-Expose-Headers'] = 'Content-Range, Accept-Ranges, Content-Length, Content-Type'
+    # Light caching to avoid revalidation on chunks
+    upstream_headers.setdefault('Cache-Control', 'public, max-age=600')
+
+    # If upstream forbids access, avoid leaking a 403 to the browser which can confuse UI; map to 502 so frontend retries instance/itag
+    status = upstream.status_code
+    if status == 403:
+        status = 502
+    return capture_stream_probe(key, upstream, iter_upstream_nonblocking(upstream)), status, upstream_headers
+
+
+# ==================================================================
+# Stream relay cache
+# ==================================================================
+
+# Members of a room request the same stream at the same time, each with its own Range
+# requests. The relay fetches every upstream byte once into a sparse cache file per
+# stream (keyed by get_stream_key, so refreshed URL tokens share it) and serves all
+# readers from that file as blocks arrive:
+#   - the file is split into STREAM_RELAY_BLOCK blocks; a block is readable once written
+#   - a fetcher is one upstream GET from some block onward, run in a native thread,
+#     stopping at end of file, at a block that is already cached, or when nobody reads
+#   - a reader needing a block waits for a fetcher that will reach it soon, or starts one
+#   - a fetch that fails at a block (5xx, connection error, early end) is retried with
+#     backoff up to STREAM_RELAY_FETCH_RETRIES times; a 4xx or an exhausted budget sets
+#     the entry's error, which ends its readers and drops it so a later request retries
+# Streams without a known length fall back to stream_remote_range.
+STREAM_RELAY_ENABLED = os.environ.get('STREAM_RELAY_ENABLED', '1').lower() not in ('0', 'false', 'no')
+STREAM_RELAY_DIR = os.path.join(UPLOAD_FOLDER, 'stream_cache')
+STREAM_RELAY_BLOCK = 256 * 1024
+STREAM_RELAY_MAX_BYTES = int(os.environ.get('STREAM_RELAY_MAX_MB', '1024')) * 1024 * 1024
+STREAM_RELAY_JOIN_BLOCKS = 8  # a fetcher at most this far behind a wanted block is waited for
+STREAM_RELAY_WAIT_S = 20  # readers give up when no new block arrives for this long
+STREAM_RELAY_IDLE_S = 60  # fetchers stop when no reader touched the stream for this long
+STREAM_RELAY_RECHECK_S = 0.5  # waiting readers are woken by fetchers; this only covers retry backoffs
+STREAM_RELAY_FETCH_RETRIES = 3
+STREAM_RELAY_RETRY_BACKOFF_S = 0.5  # doubled after every failure at the same block
+
+try:
+    import eventlet.patcher
+    native_threading = eventlet.patcher.original('threading')
+    native_queue = eventlet.patcher.original('queue')
+    native_os = eventlet.patcher.original('os')
+except ImportError:
+    import queue as native_queue
+    native_threading = threading
+    native_os = os
+
+# Upstream responses are opened in native threads (see _tpool_execute), so reading them
+# from a green thread can block the whole hub. A native pump thread reads the body into
+# a bounded queue instead; the response generator drains it cooperatively, and a full
+# queue stalls the pump (backpressure from a slow client instead of unbounded buffering).
+# Under eventlet the pump wakes the generator through a pipe the hub watches (the way
+# eventlet.tpool signals results), so an idle stream costs no polling and no tpool thread.
+UPSTREAM_PUMP_QUEUE_CHUNKS = 16
+upstream_pump_stats = {'active': 0, 'started': 0}
+
+class PumpWakeup:
+    """
+    Lets a native thread wake a green thread: set() writes a byte to a pipe, wait() parks
+    the green thread on the hub until it is readable. Without eventlet it is a native
+    Event. The native side owns the write end and closes it with close_writer(); the green
+    side closes the read end with close_reader().
+    """
+
+    def __init__(self):
+        self.green = socketio.async_mode == 'eventlet'
+        if self.green:
+            self.read_fd, self.write_fd = native_os.pipe()
+            native_os.set_blocking(self.read_fd, False)
+        else:
+            self.event = native_threading.Event()
+
+    def set(self):
+        if not self.green:
+            self.event.set()
+            return
+        try:
+            native_os.write(self.write_fd, b'.')
+        except OSError:
+            pass  # the reader is gone
+
+    def wait(self, timeout=None):
+        """Block until set() was called (or timeout seconds passed) and consume the wakeup."""
+        if not self.green:
+            self.event.wait(timeout)
+            self.event.clear()
+            return
+        from eventlet.hubs import trampoline
+        from eventlet.timeout import Timeout
+        try:
+            trampoline(self.read_fd, read=True, timeout=timeout)
+        except Timeout:
+            return
+        try:
+            while native_os.read(self.read_fd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def close_writer(self):
+        if self.green:
+            native_os.close(self.write_fd)
+
+    def close_reader(self):
+        if self.green:
+            native_os.close(self.read_fd)
+
+def iter_upstream_nonblocking(upstream, chunk_size=65536):
+    """Yield the body of a streamed requests response without blocking the green hub."""
+    chunks = native_queue.Queue(maxsize=UPSTREAM_PUMP_QUEUE_CHUNKS)
+    stopped = native_threading.Event()
+    wakeup = PumpWakeup()
+    done = object()
+
+    def offer(item):
+        while not stopped.is_set():
+            try:
+                chunks.put(item, timeout=1)
+                wakeup.set()
+                return True
+            except native_queue.Full:
+                pass
+        return False
+
+    def pump():
+        try:
+            for chunk in upstream.iter_content(chunk_size=chunk_size):
+                if chunk and not offer(chunk):
+                    return
+            offer(done)
+        except Exception as e:
+            offer(e)
+        finally:
+            wakeup.close_writer()
+            try:
+                upstream.close()
+            except Exception:
+                pass
+
+    with stream_relay_lock:
+        upstream_pump_stats['active'] += 1
+        upstream_pump_stats['started'] += 1
+    native_threading.Thread(target=pump, daemon=True).start()
+    try:
+        while True:
+            if wakeup.green:
+                try:
+                    item = chunks.get_nowait()
+                except native_queue.Empty:
+                    wakeup.wait()
+                    continue
+            else:
+                item = chunks.get()
+            if item is done:
+                return
+            if isinstance(item, Exception):
+                print(f"Upstream read failed: {item}")
+                return
+            yield item
+    finally:
+        # Client went away (or we finished): release a pump blocked on a full queue
+        stopped.set()
+        wakeup.close_reader()
+        with stream_relay_lock:
+            upstream_pump_stats['active'] -= 1
+
+# Event-loop responsiveness, to verify that relays never stall socket traffic: a green
+# task asks to sleep HUB_LATENCY_INTERVAL_S and records how late it wakes up.
+HUB_LATENCY_INTERVAL_S = 0.25
+HUB_LATENCY_WINDOW = 240  # samples (one minute)
+hub_latency_samples = []
+
+def watch_hub_latency():
+    while True:
+        started = time.perf_counter()
+        socketio.sleep(HUB_LATENCY_INTERVAL_S)
+        hub_latency_samples.append(time.perf_counter() - started - HUB_LATENCY_INTERVAL_S)
+        if len(hub_latency_samples) > HUB_LATENCY_WINDOW:
+            del hub_latency_samples[0]
+
+def get_hub_latency_stats():
+    samples = sorted(hub_latency_samples)
+    if not samples:
+        return None
+    return {
+        'samples': len(samples),
+        'p50_ms': round(samples[len(samples) // 2] * 1000, 2),
+        'p99_ms': round(samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1000, 2),
+        'max_ms': round(samples[-1] * 1000, 2),
+    }
+
+# Hedged opens: when an upstream has not answered within its host's hedge delay (or
+# fails with a connection error or a 5xx), a second request races it (an alternate
+# quality when one may be used, else the same URL) and the first usable response wins;
+# the loser is closed. A 4xx is the upstream's answer and is returned without a hedge.
+# The delay follows each host's time to first byte: EWMA + 4 x mean deviation, the
+# way TCP sizes its retransmit timer, clamped to [UPSTREAM_HEDGE_MIN_S, UPSTREAM_HEDGE_MAX_S].
+UPSTREAM_HEDGE_ENABLED = os.environ.get('UPSTREAM_HEDGE_ENABLED', '1').lower() not in ('0', 'false', 'no')
+UPSTREAM_HEDGE_DEFAULT_S = 1.0
+UPSTREAM_HEDGE_MIN_S = 0.25
+UPSTREAM_HEDGE_MAX_S = 3.0
+UPSTREAM_LATENCY_ALPHA = 0.2
+upstream_latency_lock = native_threading.Lock()
+upstream_host_latency = {}  # host -> {'ttfb', 'dev', 'samples', 'failures', 'hedges', 'hedge_wins'}
+
+def get_host_latency(host):
+    """With upstream_latency_lock held: the host's latency record, created empty."""
+    record = upstream_host_latency.get(host)
+    if record is None:
+        record = {'ttfb': None, 'dev': 0.0, 'samples': 0, 'failures': 0, 'hedges': 0, 'hedge_wins': 0}
+        upstream_host_latency[host] = record
+    return record
+
+def record_upstream_latency(host, seconds=None):
+    """Fold a time to first byte (or a failure, when seconds is None) into the host's record."""
+    with upstream_latency_lock:
+        record = get_host_latency(host)
+        if seconds is None:
+            record['failures'] += 1
+            return
+        record['samples'] += 1
+        if record['ttfb'] is None:
+            record['ttfb'], record['dev'] = seconds, seconds / 2
+        else:
+            error = seconds - record['ttfb']
+            record['ttfb'] += UPSTREAM_LATENCY_ALPHA * error
+            record['dev'] += UPSTREAM_LATENCY_ALPHA * (abs(error) - record['dev'])
+
+def get_hedge_delay(host):
+    with upstream_latency_lock:
+        record = upstream_host_latency.get(host)
+        if not record or record['ttfb'] is None:
+            return UPSTREAM_HEDGE_DEFAULT_S
+        delay = record['ttfb'] + 4 * record['dev']
+    return min(UPSTREAM_HEDGE_MAX_S, max(UPSTREAM_HEDGE_MIN_S, delay))
+
+def open_hedged_upstream(url, headers=None, alternates=(), timeout=20):
+    """
+    Blocking (call from a native thread): GET url with stream=True, hedged as described
+    above. Returns (response, url_used); the response may be a 4xx (returned at once) or
+    a 5xx when every attempt failed with one, and the last exception is raised when none
+    answered.
+    """
+    if not UPSTREAM_HEDGE_ENABLED:
+        return stream_session.get(url, headers=headers, stream=True, timeout=timeout, allow_redirects=True), url
+
+    results = native_queue.Queue()
+    host = urlparse(url).netloc
+
+    def attempt(attempt_url, index):
+        started = time.perf_counter()
+        attempt_host = urlparse(attempt_url).netloc
+        try:
+            response = stream_session.get(attempt_url, headers=headers, stream=True, timeout=timeout, allow_redirects=True)
+        except Exception as e:
+            record_upstream_latency(attempt_host)
+            results.put((index, attempt_url, None, e))
+            return
+        record_upstream_latency(attempt_host, time.perf_counter() - started if response.status_code < 400 else None)
+        results.put((index, attempt_url, response, None))
+
+    def launch(attempt_url, index):
+        native_threading.Thread(target=attempt, args=(attempt_url, index), daemon=True).start()
+
+    hedge_url = next((alt for alt in alternates if alt and alt != url), url)
+    launch(url, 0)
+    pending, hedged = 1, False
+    winner = failure = error = None
+    while pending:
+        try:
+            index, used_url, response, exc = results.get(timeout=None if hedged else get_hedge_delay(host))
+        except native_queue.Empty:
+            used_url = None
+        if used_url is not None:
+            pending -= 1
+            if response is not None and response.status_code < 500:
+                winner = (response, used_url)
+                break
+            if response is not None:
+                if failure is not None:
+                    failure[0].close()
+                failure = (response, used_url)
+            error = exc or error
+        if not hedged:
+            # Too slow, or failed transiently: race the hedge instead of backing off
+            hedged = True
+            pending += 1
+            with upstream_latency_lock:
+                get_host_latency(host)['hedges'] += 1
+            launch(hedge_url, 1)
+
+    if pending:
+        def close_losers(count):
+            for _ in range(count):
+                _, _, response, _ = results.get()
+                if response is not None:
+                    response.close()
+        native_threading.Thread(target=close_losers, args=(pending,), daemon=True).start()
+
+    if winner is None:
+        if failure is not None:
+            return failure
+        raise error or requests.RequestException(f'no response from {host}')
+    if failure is not None:
+        failure[0].close()
+    if index == 1 and winner[0].status_code < 400:
+        with upstream_latency_lock:
+            get_host_latency(host)['hedge_wins'] += 1
+    return winner
+
+def get_upstream_latency_stats():
+    with upstream_latency_lock:
+        return {
+            host: {
+                'ttfb_ms': round(record['ttfb'] * 1000, 1) if record['ttfb'] is not None else None,
+                'hedge_delay_ms': round(min(UPSTREAM_HEDGE_MAX_S, max(UPSTREAM_HEDGE_MIN_S, record['ttfb'] + 4 * record['dev'])) * 1000)
+                if record['ttfb'] is not None else round(UPSTREAM_HEDGE_DEFAULT_S * 1000),
+                'samples': record['samples'],
+                'failures': record['failures'],
+                'hedges': record['hedges'],
+                'hedge_wins': record['hedge_wins'],
+            }
+            for host, record in upstream_host_latency.items()
+        }
+
+# Shared with native fetcher threads, so it must be a real lock; holders never block
+stream_relay_lock = native_threading.Lock()
+stream_relays = OrderedDict()  # stream key -> relay entry
+stream_relay_stats = {
+    'upstream_requests': 0,
+    'upstream_bytes': 0,
+    'served_bytes': 0,
+    'evictions': 0,
+}
+
+def get_stream_relay(url, alternates=None):
+    """Return the relay entry for a stream URL, creating it (and remembering the newest URL)."""
+    key = get_stream_key(url)
+    created = False
+    with stream_relay_lock:
+        entry = stream_relays.get(key)
+        if entry is None:
+            created = True
+            entry = {
+                'key': key,
+                'path': os.path.join(STREAM_RELAY_DIR, f"{key.split(':', 1)[1]}.part"),
+                'url': url,
+                'alternates': [],
+                'fetch_url': None,  # set when a hedged first fetch settled on an alternate
+                'size': None,
+                'content_type': None,
+                'error': None,
+                'blocks': set(),
+                'fetchers': {},  # fetcher id -> next block it will write
+                'fetch_failures': {},  # block -> (failures, time before which it is not retried)
+                'waiters': set(),  # PumpWakeups of readers in wait_for_relay
+                'last_used': time.time(),
+                'upstream_requests': 0,
+                'upstream_bytes': 0,
+                'served_bytes': 0,
+            }
+            stream_relays[key] = entry
+        entry['url'] = url
+        if alternates:
+            entry['alternates'] = list(alternates)
+        entry['last_used'] = time.time()
+        stream_relays.move_to_end(key)
+    if created:
+        seed_stream_relay(entry)
+    return entry
+
+def relay_block_length(entry, block):
+    return min(STREAM_RELAY_BLOCK, entry['size'] - block * STREAM_RELAY_BLOCK)
+
+def parse_upstream_total(upstream):
+    """Total length of the upstream resource from Content-Range or an unranged Content-Length."""
+    content_range = upstream.headers.get('Content-Range', '')
+    if '/' in content_range and content_range.rsplit('/', 1)[1].isdigit():
+        return int(content_range.rsplit('/', 1)[1])
+    if upstream.status_code == 200 and upstream.headers.get('Content-Length', '').isdigit():
+        return int(upstream.headers['Content-Length'])
     return None
 
-def stream_remote_range(url):
-    """Stream remote content while supporting Range requests from the client.
-    This function proxies the upstream URL and yields chunks.
+def run_relay_fetch(entry, fetcher_id, start_block, stop_block=None):
     """
-    print(f"[DEBUG] stream_remote_range called with URL: {url}")
-    # Determine client's range header
-    range_header = request.headers.get('Range')
-    headers = {}
-    if range_header:
-        headers['Range'] = range_header
-        print(f"[DEBUG] Client sent Range header: {range_header}")
+    Native thread: stream upstream bytes from start_block into the cache file, one whole
+    block at a time. stop_block (exclusive) bounds prefetches.
+    """
+    block = start_block
+    upstream = None
+    try:
+        with stream_relay_lock:
+            url = entry['fetch_url'] or entry['url']
+            # Another quality is only safe before any bytes are cached for this stream
+            alternates = entry['alternates'] if entry['size'] is None else ()
+        upstream, used_url = open_hedged_upstream(
+            url, headers={'Range': f"bytes={block * STREAM_RELAY_BLOCK}-"}, alternates=alternates
+        )
+        with stream_relay_lock:
+            entry['upstream_requests'] += 1
+            stream_relay_stats['upstream_requests'] += 1
+            count_start_upstream_request(entry['key'])
+        if upstream.status_code >= 400:
+            with stream_relay_lock:
+                note_relay_fetch_failure(entry, block, upstream.status_code, retry=upstream.status_code >= 500)
+            return
+        total = parse_upstream_total(upstream)
+        if upstream.status_code == 200:
+            block = 0  # upstream ignored the Range header
+        with stream_relay_lock:
+            if entry['size'] is None:
+                if total is None:
+                    entry['error'] = 'unsized'
+                    notify_relay_waiters(entry)
+                    return
+                entry['size'] = total
+                entry['content_type'] = upstream.headers.get('Content-Type')
+                if used_url != url:
+                    entry['fetch_url'] = used_url
+                os.makedirs(STREAM_RELAY_DIR, exist_ok=True)
+                with open(entry['path'], 'wb') as f:
+                    f.truncate(total)
+                notify_relay_waiters(entry)
+            entry['fetchers'][fetcher_id] = block
+        block_count = (entry['size'] + STREAM_RELAY_BLOCK - 1) // STREAM_RELAY_BLOCK
+        stop_block = block_count if stop_block is None else min(stop_block, block_count)
+
+        buf = bytearray()
+        with open(entry['path'], 'r+b') as out:
+            for chunk in upstream.iter_content(chunk_size=65536):
+                if not chunk:
+                    continue
+                buf += chunk
+                with stream_relay_lock:
+                    entry['upstream_bytes'] += len(chunk)
+                    stream_relay_stats['upstream_bytes'] += len(chunk)
+                while block < stop_block and len(buf) >= relay_block_length(entry, block):
+                    length = relay_block_length(entry, block)
+                    out.seek(block * STREAM_RELAY_BLOCK)
+                    out.write(buf[:length])
+                    out.flush()
+                    if block == 0 or block == block_count - 1:
+                        cache_stream_probe(
+                            entry['key'], entry['size'], entry['content_type'], entry['fetch_url'],
+                            head=bytes(buf[:length]) if block == 0 else None,
+                            tail=bytes(buf[:length]) if block == block_count - 1 else None,
+                        )
+                    del buf[:length]
+                    with stream_relay_lock:
+                        entry['blocks'].add(block)
+                        entry['fetch_failures'].pop(block, None)
+                        notify_relay_waiters(entry)
+                        block += 1
+                        entry['fetchers'][fetcher_id] = block
+                        done = (
+                            block >= stop_block or block in entry['blocks']
+                            or time.time() - entry['last_used'] > STREAM_RELAY_IDLE_S
+                        )
+                    if done:
+                        return
+        if block < stop_block:
+            with stream_relay_lock:
+                note_relay_fetch_failure(entry, block, 'upstream ended early')
+    except Exception as e:
+        print(f"Stream relay fetch failed for {entry['key'][:20]}: {e}")
+        with stream_relay_lock:
+            note_relay_fetch_failure(entry, block, str(e))
+    finally:
+        with stream_relay_lock:
+            entry['fetchers'].pop(fetcher_id, None)
+            notify_relay_waiters(entry)  # a reader may need to start the next fetcher
+        if upstream is not None:
+            try:
+                upstream.close()
+            except Exception:
+                pass
 
-    # Stream from upstream
-    print(f"[DEBUG] Making request to upstream URL...")
-    # Use the optimized shared session; allow redirects
-    upstream = _tpool_execute(download_session.get, url, headers=headers, stream=True, timeout=20, allow_redirects=True)
-    # Some upstreams (Invidious instances) may reject Range for tiny probes. If 403/416 and we had Range, retry without Range.
-    if upstream.status_code in (403, 416) and 'Range' in headers:
+def note_relay_fetch_failure(entry, block, error, retry=True):
+    """
+    With the lock held: record a failed fetch at `block`. Once it is not retryable or its
+    retries are used up the entry fails, and it is dropped so a later request starts over.
+    """
+    failures = entry['fetch_failures'].get(block, (0, 0))[0] + 1
+    if not retry or failures > STREAM_RELAY_FETCH_RETRIES:
+        entry['error'] = error
+        if stream_relays.get(entry['key']) is entry:
+            stream_relays.pop(entry['key'])
+        notify_relay_waiters(entry)
+        return
+    backoff = STREAM_RELAY_RETRY_BACKOFF_S * 2 ** (failures - 1)
+    entry['fetch_failures'][block] = (failures, time.time() + backoff)
+
+def relay_fetch_backing_off(entry, block):
+    """With the lock held: True while a failed fetch at `block` waits for its retry."""
+    failure = entry['fetch_failures'].get(block)
+    return failure is not None and time.time() < failure[1]
+
+def start_relay_fetch(entry, start_block, stop_block=None):
+    """Start a fetcher; call with stream_relay_lock held so concurrent readers see it at once."""
+    fetcher_id = uuid.uuid4().hex[:8]
+    entry['fetchers'][fetcher_id] = start_block
+    native_threading.Thread(
+        target=run_relay_fetch, args=(entry, fetcher_id, start_block, stop_block), daemon=True
+    ).start()
+
+def ensure_relay_fetch(entry, block):
+    """With the lock held: make sure some fetcher is on its way to `block`."""
+    for position in entry['fetchers'].values():
+        if position <= block <= position + STREAM_RELAY_JOIN_BLOCKS:
+            return
+    if not relay_fetch_backing_off(entry, block):
+        start_relay_fetch(entry, block)
+
+def notify_relay_waiters(entry):
+    """With the lock held: wake the readers waiting on this entry so they re-check it."""
+    for wakeup in entry['waiters']:
+        wakeup.set()
+
+def wait_for_relay(entry, ready):
+    """
+    Cooperatively wait until ready(entry) (called with the lock held) or the relay stalls/fails.
+    Fetchers wake the waiter when a block, the length or an error arrives or a fetcher stops.
+    """
+    wakeup = PumpWakeup()
+    deadline = time.time() + STREAM_RELAY_WAIT_S
+    progress = None
+    try:
+        while True:
+            with stream_relay_lock:
+                entry['last_used'] = time.time()
+                if ready(entry):
+                    return True
+                if entry['error'] is not None:
+                    return False
+                entry['waiters'].add(wakeup)
+                marker = (len(entry['blocks']), entry['upstream_bytes'])
+            if marker != progress:
+                progress = marker
+                deadline = time.time() + STREAM_RELAY_WAIT_S
+            elif time.time() > deadline:
+                return False
+            wakeup.wait(STREAM_RELAY_RECHECK_S)
+    finally:
+        with stream_relay_lock:
+            entry['waiters'].discard(wakeup)
+        wakeup.close_writer()
+        wakeup.close_reader()
+
+def iter_relay_range(entry, start, end):
+    """Yield bytes start..end (inclusive) from the relay cache, fetching blocks as needed."""
+    pos = start
+    with open(entry['path'], 'rb') as f:
+        while pos <= end:
+            block = pos // STREAM_RELAY_BLOCK
+
+            def block_ready(e, block=block):
+                if block in e['blocks']:
+                    return True
+                ensure_relay_fetch(e, block)
+                return False
+
+            if not wait_for_relay(entry, block_ready):
+                return
+            f.seek(pos)
+            data = f.read(min((block + 1) * STREAM_RELAY_BLOCK, end + 1) - pos)
+            if not data:
+                return
+            with stream_relay_lock:
+                entry['served_bytes'] += len(data)
+                stream_relay_stats['served_bytes'] += len(data)
+            pos += len(data)
+            yield data
+
+def parse_range_header(range_header, size):
+    """Return (start, end) for a single-range header, None for no/unsupported Range, or 'invalid'."""
+    match = re.fullmatch(r'\s*bytes=(\d*)-(\d*)\s*', range_header or '')
+    if not match or not (match.group(1) or match.group(2)):
+        return None
+    if match.group(1):
+        start = int(match.group(1))
+        end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+    else:
+        start = max(0, size - int(match.group(2)))
+        end = size - 1
+    if start >= size or start > end:
+        return 'invalid'
+    return start, end
+
+# Probe cache: browsers open a stream with small probes (bytes=0-1, bytes=0-, a tail
+# range for an MP4 moov atom) from every member, and again after a relay is evicted.
+# The first and last relay block of each stream, with its length and type, are kept
+# per stream key (a few hundred KB each), so new relays start pre-seeded and the
+# stream_remote_range fallback answers probe ranges without an upstream request.
+# A track start is a request from byte 0 with no other start of that stream in the
+# last STREAM_START_WINDOW_S; upstream requests inside that window are counted
+# against it (see get_stream_relay_stats()['probes']).
+STREAM_PROBE_CACHE_SIZE = int(os.environ.get('STREAM_PROBE_CACHE_SIZE', '64'))
+STREAM_START_WINDOW_S = 10
+stream_probe_cache = OrderedDict()  # stream key -> {'size', 'content_type', 'fetch_url', 'head', 'tail'}
+stream_start_times = OrderedDict()  # stream key -> time of its latest track start
+stream_probe_stats = {'hits': 0, 'track_starts': 0, 'start_upstream_requests': 0}
+
+def probe_tail_start(size):
+    """Offset of the last relay block, which the probe cache keeps as the tail."""
+    return (size - 1) // STREAM_RELAY_BLOCK * STREAM_RELAY_BLOCK
+
+def get_stream_probe(key):
+    with stream_relay_lock:
+        probe = stream_probe_cache.get(key)
+        if probe is not None:
+            stream_probe_cache.move_to_end(key)
+        return probe
+
+def cache_stream_probe(key, size, content_type, fetch_url=None, head=None, tail=None):
+    """Remember a stream's length/type and, when given, its head or tail block."""
+    with stream_relay_lock:
+        probe = stream_probe_cache.get(key)
+        if probe is None or probe['size'] != size or probe['fetch_url'] != fetch_url:
+            probe = {'size': size, 'content_type': content_type, 'fetch_url': fetch_url, 'head': None, 'tail': None}
+            stream_probe_cache[key] = probe
+        if head is not None:
+            probe['head'] = bytes(head)
+        if tail is not None:
+            probe['tail'] = bytes(tail)
+        stream_probe_cache.move_to_end(key)
+        while len(stream_probe_cache) > STREAM_PROBE_CACHE_SIZE:
+            stream_probe_cache.popitem(last=False)
+
+def seed_stream_relay(entry):
+    """Pre-fill a new relay from the probe cache, so its length and probe ranges need no upstream request."""
+    probe = get_stream_probe(entry['key'])
+    if probe is None or (probe['head'] is None and probe['tail'] is None):
+        return
+    with stream_relay_lock:
+        if entry['size'] is not None or entry['fetchers']:
+            return
+        # Readers wait on this placeholder instead of starting a fetcher that would truncate the file
+        entry['fetchers']['seed'] = 0
+    size = probe['size']
+    try:
+        os.makedirs(STREAM_RELAY_DIR, exist_ok=True)
+        with open(entry['path'], 'wb') as f:
+            f.truncate(size)
+            if probe['head'] is not None:
+                f.write(probe['head'])
+            if probe['tail'] is not None:
+                f.seek(probe_tail_start(size))
+                f.write(probe['tail'])
+    except OSError as e:
+        print(f"Could not seed stream relay {entry['key'][:20]}: {e}")
+        with stream_relay_lock:
+            entry['fetchers'].pop('seed', None)
+            notify_relay_waiters(entry)
+        return
+    with stream_relay_lock:
+        entry['size'] = size
+        entry['content_type'] = probe['content_type']
+        entry['fetch_url'] = probe['fetch_url']
+        if probe['head'] is not None:
+            entry['blocks'].add(0)
+        if probe['tail'] is not None:
+            entry['blocks'].add(probe_tail_start(size) // STREAM_RELAY_BLOCK)
+        entry['fetchers'].pop('seed', None)
+        notify_relay_waiters(entry)
+
+def stream_response_headers(content_type, url):
+    return {
+        'Content-Type': content_type or mimetypes.guess_type(urlparse(url).path)[0] or 'audio/mp4',
+        'Accept-Ranges': 'bytes',
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Allow-Headers': 'Range, Origin, Accept, Content-Type',
+        'Access-Control-Expose-Headers': 'Content-Range, Accept-Ranges, Content-Length, Content-Type',
+        'Cache-Control': 'public, max-age=600',
+    }
+
+def serve_stream_probe(probe, range_header, url):
+    """Answer a range that lies inside the cached head or tail; None when upstream is needed."""
+    size = probe['size']
+    byte_range = parse_range_header(range_header, size)
+    if byte_range is None or byte_range == 'invalid':
+        return None
+    start, end = byte_range
+    tail_start = probe_tail_start(size)
+    if probe['head'] is not None and end < len(probe['head']):
+        data = probe['head'][start:end + 1]
+    elif probe['tail'] is not None and start >= tail_start:
+        data = probe['tail'][start - tail_start:end + 1 - tail_start]
+    else:
+        return None
+    with stream_relay_lock:
+        stream_probe_stats['hits'] += 1
+    headers = stream_response_headers(probe['content_type'], url)
+    headers['Content-Range'] = f"bytes {start}-{end}/{size}"
+    headers['Content-Length'] = str(len(data))
+    return iter((data,)), 206, headers
+
+def capture_stream_probe(key, upstream, body):
+    """Pass a fallback response body through, keeping its head and tail block for the probe cache."""
+    total = parse_upstream_total(upstream)
+    match = re.match(r'bytes (\d+)-(\d+)/', upstream.headers.get('Content-Range', ''))
+    if upstream.status_code == 200:
+        start, end = 0, (total - 1 if total else None)
+    elif upstream.status_code == 206 and match:
+        start, end = int(match.group(1)), int(match.group(2))
+    else:
+        return body
+    if not total:
+        return body
+    content_type = upstream.headers.get('Content-Type')
+    tail_start = probe_tail_start(total)
+    wanted = []
+    if start == 0:
+        wanted.append(('head', 0, min(total, STREAM_RELAY_BLOCK)))
+    if start <= tail_start and end == total - 1:
+        wanted.append(('tail', tail_start, total))
+    if not wanted:
+        return body
+
+    def tee():
+        parts = {name: bytearray() for name, _, _ in wanted}
+        pos = start
+        for chunk in body:
+            for name, low, high in wanted:
+                first, last = max(low, pos), min(high, pos + len(chunk))
+                if first < last:
+                    parts[name] += chunk[first - pos:last - pos]
+                    if len(parts[name]) == high - low:
+                        cache_stream_probe(key, total, content_type, **{name: parts[name]})
+            pos += len(chunk)
+            yield chunk
+
+    return tee()
+
+def note_stream_request(url, range_header):
+    """Count a track start when a stream is requested from byte 0 (see Probe cache)."""
+    requested = re.match(r'\s*bytes=(\d+)-', range_header or '')
+    if requested and int(requested.group(1)) != 0:
+        return
+    key = get_stream_key(url)
+    now = time.time()
+    with stream_relay_lock:
+        started = stream_start_times.get(key)
+        if started is not None and now - started <= STREAM_START_WINDOW_S:
+            return
+        stream_start_times[key] = now
+        stream_start_times.move_to_end(key)
+        while len(stream_start_times) > STREAM_PROBE_CACHE_SIZE * 4:
+            stream_start_times.popitem(last=False)
+        stream_probe_stats['track_starts'] += 1
+
+def count_start_upstream_request(key):
+    """With stream_relay_lock held: attribute an upstream request to a recent track start."""
+    started = stream_start_times.get(key)
+    if started is not None and time.time() - started <= STREAM_START_WINDOW_S:
+        stream_probe_stats['start_upstream_requests'] += 1
+
+def evict_stream_relays():
+    """Drop least recently used idle relays until the cache fits STREAM_RELAY_MAX_BYTES."""
+    with stream_relay_lock:
+        used = sum(len(e['blocks']) * STREAM_RELAY_BLOCK for e in stream_relays.values())
+        evicted = []
+        for key, entry in list(stream_relays.items()):
+            if used <= STREAM_RELAY_MAX_BYTES:
+                break
+            if entry['fetchers'] or time.time() - entry['last_used'] < STREAM_RELAY_WAIT_S:
+                continue
+            used -= len(entry['blocks']) * STREAM_RELAY_BLOCK
+            del stream_relays[key]
+            evicted.append(entry['path'])
+            stream_relay_stats['evictions'] += 1
+    for path in evicted:
         try:
-            print(f"[DEBUG] Upstream returned {upstream.status_code} for ranged request. Retrying without Range...")
-            upstream.close()
-        except Exception:
+            os.remove(path)
+        except OSError:
             pass
-        hdr_no_range = {k: v for k, v in headers.items() if k.lower() != 'range'}
-        upstream = _tpool_execute(download_session.get, url, headers=hdr_no_range, stream=True, timeout=20, allow_redirects=True)
-    print(f"[DEBUG] Upstream response status: {upstream.status_code}")
-    print(f"[DEBUG] Upstream response headers: {dict(upstream.headers)}")
 
-    # Build response headers
-    upstream_headers = {}
-    for h in ['Content-Type', 'Content-Length', 'Accept-Ranges', 'Content-Range']:
-        if h in upstream.headers:
-            upstream_headers[h] = upstream.headers[h]
+def wait_for_relay_size(entry, first_block=0):
+    """Wait until the stream's length is known, starting a fetch at first_block if none runs."""
+    def size_known(e):
+        if e['size'] is not None:
+            return True
+        if not e['fetchers'] and not relay_fetch_backing_off(e, first_block):
+            start_relay_fetch(e, first_block)
+        return False
 
-    # Ensure a sensible Content-Type for audio if missing
-    if 'Content-Type' not in upstream_headers:
-        import mimetypes
-        guessed, _ = mimetypes.guess_type(url)
-        if guessed and guessed.startswith('audio/'):
-            upstream_headers['Content-Type'] = guessed
-        else:
-            # Common fallbacks for youtube streams
-            ct = 'audio/mp4'
-            if '.mp3' in url:
-                ct = 'audio/mpeg'
-            elif '.webm' in url:
-                ct = 'audio/webm'
-            upstream_headers['Content-Type'] = ct
+    return wait_for_relay(entry, size_known)
 
-    # Ensure Range support headers
-    if range_header and 'Accept-Ranges' not in upstream_headers:
-        upstream_headers['Accept-Ranges'] = 'bytes'
+def read_stream_for_analysis(proxy_id):
+    """
+    Background task: copy what loudness analysis needs of a stream out of the relay into a
+    temporary file, at the original offsets: the first LOUDNESS_STREAM_MAX_S at the highest
+    stream bitrate, and the last block in case an MP4 keeps its index there. The blocks are
+    fetched once and stay cached for playback. Returns the path, or None when the relay
+    cannot serve the stream (turned off, unknown length, failed or expired proxy id).
+    """
+    url = get_proxy_url(proxy_id)
+    if not url or not STREAM_RELAY_ENABLED:
+        return None
+    entry = get_stream_relay(url, get_proxy_alternates(proxy_id))
+    if not wait_for_relay_size(entry):
+        return None
 
-    # CORS headers so the audio element can use the stream
-    upstream_headers['Access-Control-Allow-Origin'] = '*'
-    upstream_headers['Access-Control-Allow-Headers'] = 'Range, Origin, Accept, Content-Type'
-    upstream_headers['Access-Control-Expose-Headers'] = 'Content-Range, Accept-Ranges, Content-Length, Content-Type'
-    # Light caching to avoid revalidation on chunks
-    upstream_headers.setdefault('Cache-Control', 'public, max-age=600')
+    size = entry['size']
+    head_end = min(size, int(LOUDNESS_STREAM_MAX_S * STREAM_WARM_KBPS * 125)) - 1
+    ranges = [(0, head_end)]
+    if probe_tail_start(size) > head_end:
+        ranges.append((probe_tail_start(size), size - 1))
+
+    os.makedirs(STREAM_RELAY_DIR, exist_ok=True)
+    path = os.path.join(STREAM_RELAY_DIR, f"{entry['key'].split(':', 1)[1]}.{uuid.uuid4().hex[:8]}.tmp")
+    complete = True
+    with open(path, 'wb') as f:
+        f.truncate(size)
+        for start, end in ranges:
+            f.seek(start)
+            for data in iter_relay_range(entry, start, end):
+                f.write(data)
+            if f.tell() != end + 1:
+                complete = False  # the relay stalled or failed
+                break
+    if not complete:
+        os.remove(path)
+        return None
+    return path
+
+def relay_stream_response(url, alternates=None):
+    """
+    Serve a proxied stream through the relay cache. Returns (body, status, headers),
+    or None when the relay is off or the upstream length is unknown (use stream_remote_range).
+    """
+    if not STREAM_RELAY_ENABLED:
+        return None
+    evict_stream_relays()
+    entry = get_stream_relay(url, alternates)
+    range_header = request.headers.get('Range')
+    requested = re.match(r'\s*bytes=(\d+)-', range_header or '')
+    first_block = int(requested.group(1)) // STREAM_RELAY_BLOCK if requested else 0
+
+    if not wait_for_relay_size(entry, first_block):
+        with stream_relay_lock:
+            error = entry['error']
+            if error is not None and stream_relays.get(entry['key']) is entry:
+                # Let a later request retry the upstream from scratch
+                stream_relays.pop(entry['key'])
+        if error == 'unsized':
+            return None
+        status = error if isinstance(error, int) else 502
+        return iter(()), 502 if status == 403 else status, {'Access-Control-Allow-Origin': '*'}
+
+    size = entry['size']
+    headers = stream_response_headers(entry['content_type'], url)
+    byte_range = parse_range_header(range_header, size)
+    if byte_range == 'invalid':
+        headers['Content-Range'] = f"bytes */{size}"
+        return iter(()), 416, headers
+    if byte_range is None:
+        start, end, status = 0, size - 1, 200
+    else:
+        (start, end), status = byte_range, 206
+        headers['Content-Range'] = f"bytes {start}-{end}/{size}"
+    headers['Content-Length'] = str(end - start + 1)
+    return iter_relay_range(entry, start, end), status, headers
+
+def get_stream_relay_stats():
+    """Relay totals plus upstream vs served bytes for each room's current stream."""
+    with stream_relay_lock:
+        stats = dict(stream_relay_stats)
+        stats['streams'] = len(stream_relays)
+        stats['cached_bytes'] = sum(len(e['blocks']) * STREAM_RELAY_BLOCK for e in stream_relays.values())
+        per_stream = {
+            key: {
+                'size': e['size'],
+                'upstream_requests': e['upstream_requests'],
+                'upstream_bytes': e['upstream_bytes'],
+                'served_bytes': e['served_bytes'],
+            }
+            for key, e in stream_relays.items()
+        }
+    stats['enabled'] = STREAM_RELAY_ENABLED
+    stats['active_pumps'] = upstream_pump_stats['active']
+    stats['active_fetchers'] = sum(len(e['fetchers']) for e in list(stream_relays.values()))
+    stats['hub_latency'] = get_hub_latency_stats()
+    stats['upstream_hosts'] = get_upstream_latency_stats()
+    with stream_relay_lock:
+        probes = dict(stream_probe_stats, entries=len(stream_probe_cache))
+    probes['upstream_requests_per_start'] = (
+        round(probes['start_upstream_requests'] / probes['track_starts'], 2) if probes['track_starts'] else None
+    )
+    stats['probes'] = probes
+    stats['fanout'] = round(stats['served_bytes'] / stats['upstream_bytes'], 2) if stats['upstream_bytes'] else None
+
+    rooms = {}
+    with thread_lock:
+        for room_id, room_state in rooms_data.items():
+            item = get_current_audio_item(room_state)
+            if item and item.get('stream_key') in per_stream:
+                rooms[room_id] = dict(per_stream[item['stream_key']], title=item.get('title'))
+    stats['rooms'] = rooms
+    stats['warm_up'] = dict(stream_warm_stats)
+    return stats
+
+# Warm-up: when a track becomes current (or a stream is queued right behind it), the
+# next STREAM_WARM_ITEMS stream items get their first STREAM_WARM_SECONDS fetched into
+# the relay, so DNS, TLS and time-to-first-byte are paid before anyone presses play.
+# Queued proxy ids are also kept alive, since a queue can outlast PROXY_TTL.
+STREAM_WARM_ITEMS = int(os.environ.get('STREAM_WARM_ITEMS', '2'))
+STREAM_WARM_SECONDS = int(os.environ.get('STREAM_WARM_SECONDS', '15'))
+STREAM_WARM_KBPS = 320  # highest stream quality; lower bitrates just get a longer head start
+STREAM_KEEPALIVE_INTERVAL_S = max(30, PROXY_TTL // 3)
+stream_warm_stats = {'prefetches': 0, 'already_warm': 0, 'expired_ids': 0, 'refreshed_ids': 0}
+
+def get_upcoming_stream_proxy_ids(room_state, limit):
+    """Proxy ids of the next `limit` stream items after the current one."""
+    queue = room_state.get('queue', [])
+    current_index = room_state.get('current_index', -1)
+    start = current_index + 1 if isinstance(current_index, int) and current_index >= 0 else 0
+    proxy_ids = []
+    for item in queue[start:]:
+        if len(proxy_ids) >= limit:
+            break
+        if item.get('is_stream') and item.get('proxy_id'):
+            proxy_ids.append(item['proxy_id'])
+    return proxy_ids
+
+def run_stream_warm(proxy_ids):
+    """Background task: prefetch the head of each stream into the relay cache."""
+    stop_block = -(-STREAM_WARM_SECONDS * STREAM_WARM_KBPS * 125 // STREAM_RELAY_BLOCK)
+    for proxy_id in proxy_ids:
+        url = get_proxy_url(proxy_id)  # also slides the id's expiry
+        if not url:
+            stream_warm_stats['expired_ids'] += 1
+            continue
+        entry = get_stream_relay(url, get_proxy_alternates(proxy_id))
+        with stream_relay_lock:
+            missing = [b for b in range(stop_block) if b not in entry['blocks']]
+            if entry['error'] is not None or entry['fetchers'] or not missing:
+                stream_warm_stats['already_warm'] += 1
+                continue
+            if relay_fetch_backing_off(entry, missing[0]):
+                continue
+            start_relay_fetch(entry, missing[0], stop_block)
+            stream_warm_stats['prefetches'] += 1
+
+def warm_room_streams(room_id):
+    """Start warming a room's upcoming streams; safe to call with thread_lock held."""
+    if not STREAM_RELAY_ENABLED or STREAM_WARM_ITEMS <= 0:
+        return
+    proxy_ids = get_upcoming_stream_proxy_ids(rooms_data.get(room_id, {}), STREAM_WARM_ITEMS)
+    if proxy_ids:
+        socketio.start_background_task(run_stream_warm, proxy_ids)
+
+def watch_queued_streams():
+    """Refresh the proxy ids of every queued stream well before they expire."""
+    while True:
+        socketio.sleep(STREAM_KEEPALIVE_INTERVAL_S)
+        with thread_lock:
+            proxy_ids = {
+                item['proxy_id']
+                for room_state in rooms_data.values()
+                for item in room_state.get('queue', [])
+                if item.get('is_stream') and item.get('proxy_id')
+            }
+        for proxy_id in proxy_ids:
+            if get_proxy_url(proxy_id):
+                stream_warm_stats['refreshed_ids'] += 1
+            else:
+                stream_warm_stats['expired_ids'] += 1
+
+
+# ==================================================================
+# Stream Pinning
+# ==================================================================
 
-    def generate():
+# A queued stream can be pinned: it is downloaded once (download_with_range_requests)
+# into the content-addressed store and its queue items become ordinary uploads, served
+# from disk with the usual derivatives. Pins are remembered per stream key in
+# UPLOAD_FOLDER/stream_pins.json, so adding the same song again later skips the stream.
+stream_pins = None  # stream key -> stored filename, loaded on first use
+stream_pin_lock = threading.Lock()
+stream_pins_in_flight = set()
+stream_pin_stats = {'pinned': 0, 'failed': 0, 'reused': 0}
+
+def get_stream_pins_path():
+    return os.path.join(app.config['UPLOAD_FOLDER'], 'stream_pins.json')
+
+def load_stream_pins():
+    """With stream_pin_lock held: the pin index, read from disk on first use."""
+    global stream_pins
+    if stream_pins is None:
         try:
-            for chunk in upstream.iter_content(chunk_size=65536):
-                if chunk:
-                    yield chunk
-        finally:
-            try:
-                upstream.close()
-            except:
-                pass
+            with open(get_stream_pins_path(), 'r', encoding='utf-8') as f:
+                stream_pins = json.load(f)
+        except (OSError, ValueError):
+            stream_pins = {}
+    return stream_pins
+
+def save_stream_pin(stream_key, filename):
+    with stream_pin_lock:
+        pins = load_stream_pins()
+        pins[stream_key] = filename
+        snapshot = dict(pins)
+    tmp_path = f"{get_stream_pins_path()}.{uuid.uuid4().hex[:8]}.tmp"
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_path, get_stream_pins_path())
+    except OSError as e:
+        print(f"Could not persist stream pins: {e}")
+
+def get_stream_pin(stream_key):
+    """Return the stored file info for a pinned stream, or None (also when the file is gone)."""
+    with stream_pin_lock:
+        filename = load_stream_pins().get(stream_key)
+    if not filename:
+        return None
+    path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    if not os.path.exists(path) and not _tpool_execute(storage_exists_remote, filename):
+        return None
+    content_hash = filename.split('.', 1)[0]
+    record = get_media_record(content_hash) or {}
+    size = record.get('size') or (os.path.getsize(path) if os.path.exists(path) else 0)
+    return {'filename': filename, 'content_hash': content_hash, 'size': size, 'deduplicated': True}
+
+def pin_queue_items(stream_key, stored):
+    """Turn every queued item of a stream into a stored upload and start its processing."""
+    pinned = []
+    with thread_lock:
+        for room_id, room_state in rooms_data.items():
+            for index, item in enumerate(room_state.get('queue', [])):
+                if item.get('stream_key') != stream_key or not item.get('is_stream'):
+                    continue
+                item.update({
+                    'filename': stored['filename'],
+                    'content_hash': stored['content_hash'],
+                    'proxy_id': None,
+                    'is_stream': False,
+                    'pinned': True,
+                    'pin_status': 'pinned',
+                })
+                if index == room_state.get('current_index'):
+                    # Members keep playing the stream; later loads and joins use the file
+                    room_state.update({
+                        'current_file': stored['filename'],
+                        'current_proxy_id': None,
+                        'current_is_stream': False,
+                    })
+                pinned.append((room_id, item))
+    for room_id, item in pinned:
+        request_media_processing(stored, room_id, item, client_fields=('title', 'artist', 'album'))
+    return len(pinned)
+
+def set_pin_status(stream_key, status):
+    updates = []
+    with thread_lock:
+        for room_id, room_state in rooms_data.items():
+            for index, item in enumerate(room_state.get('queue', [])):
+                if item.get('stream_key') == stream_key and item.get('is_stream'):
+                    item['pin_status'] = status
+                    updates.append((room_id, index, index == room_state.get('current_index'), item))
+    for room_id, index, is_current, item in updates:
+        socketio.emit('track_updated', {
+            'index': index,
+            'is_current': is_current,
+            'item': item,
+        }, to=room_id)
+
+def run_stream_pin(room_id, stream_key, url):
+    """Background task: download a stream into the store and pin its queue items."""
+    upload_folder = app.config['UPLOAD_FOLDER']
+    ext = os.path.splitext(urlparse(url).path)[1].lower().lstrip('.')
+    if ext == 'mp4':
+        ext = 'm4a'
+    if ext not in ALLOWED_EXTENSIONS:
+        ext = 'm4a'
+    os.makedirs(upload_folder, exist_ok=True)
+    tmp_path = os.path.join(upload_folder, f".incoming_{uuid.uuid4().hex}")
+    stored = None
+    try:
+        if _tpool_execute(download_with_range_requests, url, tmp_path, room_id):
+            content_hash, size = _tpool_execute(hash_stored_file, tmp_path)
+            stored = commit_stored_file(tmp_path, ext, content_hash, size)
+    except Exception as e:
+        print(f"[Room {room_id}] - Pinning stream failed: {e}")
+    finally:
+        with stream_pin_lock:
+            stream_pins_in_flight.discard(stream_key)
+            stream_pin_stats['failed' if stored is None else 'pinned'] += 1
+        if stored is None and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    if stored is None:
+        set_pin_status(stream_key, 'failed')
+        return
+    save_stream_pin(stream_key, stored['filename'])
+    pin_queue_items(stream_key, stored)
+
+def request_stream_pin(room_id, audio_item):
+    """Start pinning a queued stream item; returns False when it cannot be pinned."""
+    stream_key = audio_item.get('stream_key')
+    url = get_proxy_url(audio_item.get('proxy_id')) if audio_item.get('proxy_id') else None
+    if not audio_item.get('is_stream') or not stream_key or not url:
+        return False
+    stored = get_stream_pin(stream_key)
+    if stored is not None:
+        pin_queue_items(stream_key, stored)
+        return True
+    with stream_pin_lock:
+        if stream_key in stream_pins_in_flight:
+            return True
+        stream_pins_in_flight.add(stream_key)
+    set_pin_status(stream_key, 'pinning')
+    socketio.start_background_task(run_stream_pin, room_id, stream_key, url)
+    return True
 
-    # If upstream forbids access, avoid leaking a 403 to the browser which can confuse UI; map to 502 so frontend retries instance/itag
-    status = upstream.status_code
-    if status == 403:
-        status = 502
-    return generate(), status, upstream_headers
+def get_stream_pin_stats():
+    with stream_pin_lock:
+        stats = dict(stream_pin_stats, in_flight=len(stream_pins_in_flight), pins=len(load_stream_pins()))
+    return stats
 
 
 # ==================================================================
@@ -1418,7 +5321,13 @@ def resolve_jiosaavn():
             return jsonify({'success': False, 'error': 'Could not derive media url'}), 500
         proxy_id = None
         if register_flag:
-            proxy_id = add_proxy_url(media_url)
+            # Lower qualities after the selected one, for hedged opens to fall back to
+            alternates = []
+            for q in ordered[ordered.index(selected_quality) + 1:]:
+                candidate = _pick_jiosaavn_media(song, [q])
+                if candidate and candidate.startswith('http') and candidate != media_url and candidate not in alternates:
+                    alternates.append(candidate)
+            proxy_id = add_proxy_url(media_url, alternates)
         meta = {
             'title': song.get('title'),
             'artist': (song.get('more_info', {}).get('primary_artists') or 
@@ -1429,7 +5338,8 @@ def resolve_jiosaavn():
             'album': song.get('album'),
             'image': _upgrade_image_quality(song.get('image')),
             'language': song.get('language'),
-            'year': song.get('year')
+            'year': song.get('year'),
+            'duration': parse_duration_s(song.get('duration') or song.get('more_info', {}).get('duration'))
         }
         return jsonify({'success': True, 'media_url': media_url, 'proxy_id': proxy_id, 'quality': selected_quality, 'metadata': meta})
     except Exception as e:
@@ -1583,19 +5493,18 @@ def universal_result():
 @app.route('/stream_proxy/<proxy_id>')
 def stream_proxy(proxy_id):
     """Stream the proxied URL associated with proxy_id. Supports Range proxying."""
-    print(f"[DEBUG] stream_proxy called with proxy_id: {proxy_id}")
     url = get_proxy_url(proxy_id)
-    print(f"[DEBUG] get_proxy_url returned: {url}")
     if not url:
-        print(f"[DEBUG] No URL found for proxy_id: {proxy_id}")
         return jsonify({'success': False, 'error': 'Invalid or expired proxy id'}), 404
 
     try:
-        print(f"[DEBUG] Attempting to stream URL: {url}")
+        note_stream_request(url, request.headers.get('Range'))
+        relayed = relay_stream_response(url, get_proxy_alternates(proxy_id))
+        if relayed is not None:
+            gen, status, headers = relayed
+            return Response(gen, status=status, headers=headers)
         gen, status, headers = stream_remote_range(url)
-        print(f"[DEBUG] stream_remote_range returned status: {status}")
         # Return a streamed response
-        from flask import Response
         return Response(gen, status=status, headers=headers)
     except Exception as e:
         print(f"Error streaming proxy url: {e}")
@@ -1622,17 +5531,6 @@ def image_proxy():
             guessed, _ = mimetypes.guess_type(img_url)
             ct = guessed or 'image/jpeg'
 
-        def generate():
-            try:
-                for chunk in r.iter_content(chunk_size=16384):
-                    if chunk:
-                        yield chunk
-            finally:
-                try:
-                    r.close()
-                except:
-                    pass
-
         headers = {
             'Content-Type': ct,
             'Cache-Control': 'public, max-age=1800',
@@ -1643,7 +5541,7 @@ def image_proxy():
         if 'Content-Length' in r.headers:
             headers['Content-Length'] = r.headers['Content-Length']
 
-        return Response(generate(), status=200, headers=headers)
+        return Response(iter_upstream_nonblocking(r, chunk_size=16384), status=200, headers=headers)
     except Exception as e:
         print(f"[DEBUG] image_proxy error: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -1657,6 +5555,7 @@ def add_to_queue():
     proxy_id = data.get('proxy_id')
     metadata = data.get('metadata', {})
     video_id = data.get('video_id')
+    pin = bool(data.get('pin'))
 
     if not room or room not in rooms_data:
         return jsonify({'success': False, 'error': 'Invalid or expired room'}), 400
@@ -1673,32 +5572,54 @@ def add_to_queue():
         artist = metadata.get('artist') or 'Unknown Artist'
         album = metadata.get('album', '')
         image_url = metadata.get('image')
+        duration = parse_duration_s(metadata.get('duration'))
+        palette = request_image_palette(image_url)
+        stream_key = get_stream_key(url)
+        # A pinned stream is queued as its stored file right away and measured from disk
+        stored = get_stream_pin(stream_key)
+        if stored is not None:
+            with stream_pin_lock:
+                stream_pin_stats['reused'] += 1
+            filename, item_proxy_id = stored['filename'], None
+            gain_db = request_loudness_analysis(
+                stored['content_hash'], os.path.join(app.config['UPLOAD_FOLDER'], stored['filename'])
+            )
+        else:
+            filename, item_proxy_id = None, proxy_id
+            gain_db = request_loudness_analysis(stream_key, proxy_id)
 
         with thread_lock:
             audio_item = {
-                'filename': None,
+                'filename': filename,
                 'filename_display': f"{title} - {artist}",
                 'cover': None,
                 'upload_time': time.time(),
                 'title': title,
                 'artist': artist,
                 'album': album,
-                'proxy_id': proxy_id,
-                'is_stream': True,
+                'proxy_id': item_proxy_id,
+                'is_stream': stored is None,
                 'image_url': image_url,
                 'video_id': video_id,
                 'stems': None,
-                'is_stem_track': False
+                'is_stem_track': False,
+                'duration': duration,
+                'palette': palette,
+                'stream_key': stream_key,
+                'gain_db': gain_db
             }
+            if stored is not None:
+                audio_item.update({'content_hash': stored['content_hash'], 'pinned': True, 'pin_status': 'pinned'})
             if 'queue' not in rooms_data[room]:
                 rooms_data[room]['queue'] = []
             if 'current_index' not in rooms_data[room]:
                 rooms_data[room]['current_index'] = -1
             rooms_data[room]['queue'].append(audio_item)
+            warm_room_streams(room)  # no-op unless it landed among the next few items
             if rooms_data[room]['current_file'] is None:
                 rooms_data[room]['current_index'] = len(rooms_data[room]['queue']) - 1
                 rooms_data[room].update({
-                    'current_file': None,
+                    'current_file': filename,
                     'current_file_display': audio_item['filename_display'],
                     'current_cover': None,
                     'current_title': title,
@@ -1707,23 +5628,27 @@ def add_to_queue():
                     'is_playing': False,
                     'last_progress_s': 0,
                     'last_updated_at': time.time(),
-                    'current_proxy_id': proxy_id,
-                    'current_is_stream': True,
+                    'current_proxy_id': item_proxy_id,
+                    'current_is_stream': stored is None,
                     'current_image_url': image_url
                 })
+                begin_track_instance(rooms_data[room], room)
                 emit_data = {
-                    'filename': None,
+                    'filename': filename,
                     'filename_display': audio_item['filename_display'],
                     'cover': None,
                     'title': title,
                     'artist': artist,
                     'album': album,
-                    'proxy_id': proxy_id,
-                    'is_stream': True,
+                    'proxy_id': item_proxy_id,
+                    'is_stream': stored is None,
                     'image_url': image_url,
                     'video_id': video_id,
                     'stems': None,
-                    'is_stem_track': False
+                    'is_stem_track': False,
+                    'duration': duration,
+                    'palette': palette,
+                    'gain_db': gain_db
                 }
                 emit_new_file_to_room(room, emit_data)
                 socketio.emit('pause', {'time': 0}, to=room)
@@ -1731,11 +5656,15 @@ def add_to_queue():
                 'queue': rooms_data[room]['queue'],
                 'current_index': rooms_data[room]['current_index']
             }, to=room)
+        if stored is not None:
+            request_media_processing(stored, room, audio_item, client_fields=('title', 'artist', 'album'))
+        elif pin:
+            request_stream_pin(room, audio_item)
         return jsonify({
             'success': True,
             'message': 'Song added to queue for streaming',
             'display_name': audio_item['filename_display'],
-            'filename': None
+            'filename': filename
         })
     except Exception as e:
         print(f"ERROR adding song to queue for room '{room}': {str(e)}")
@@ -1745,39 +5674,117 @@ def add_to_queue():
         }), 500
 
 
+@app.route('/upload_session', methods=['POST'])
+def start_upload_session():
+    """Open a resumable upload.
+
+    Body JSON: { "room": "...", "filename": "song.flac", "size": 123456 }
+    Returns: { success, session_id, chunk_size, chunk_count, received: [] }
+    """
+    data = request.get_json(silent=True) or {}
+    room = data.get('room')
+    original_name = data.get('filename')
+
+    if not room or room not in rooms_data:
+        return jsonify({'success': False, 'error': 'Invalid or expired room'}), 400
+    if not original_name or not allowed_file(original_name):
+        return jsonify({'success': False, 'error': 'File not allowed or not selected'}), 400
+    try:
+        size = int(data.get('size'))
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'error': 'size is required'}), 400
+    if size <= 0 or size > UPLOAD_SESSION_MAX_BYTES:
+        return jsonify({'success': False, 'error': 'File is empty or too large'}), 400
+
+    session = create_upload_session(room, original_name, size)
+    print(f"[Room {room}] - Upload session {session['id']} opened: {original_name} ({size} bytes)")
+    return jsonify(describe_upload_session(session))
+
+@app.route('/upload_session/<session_id>', methods=['GET'])
+def get_upload_session_status(session_id):
+    """Report which chunks of a resumable upload have been received."""
+    session = get_upload_session(session_id)
+    if not session:
+        return jsonify({'success': False, 'error': 'Upload session not found'}), 404
+    return jsonify(describe_upload_session(session))
+
+@app.route('/upload_session/<session_id>/chunk', methods=['PUT'])
+def put_upload_chunk(session_id):
+    """Write one chunk; ?offset=<bytes>, optional X-Chunk-SHA256 header with the chunk's hex digest."""
+    session = get_upload_session(session_id)
+    if not session:
+        return jsonify({'success': False, 'error': 'Upload session not found'}), 404
+    if session['stored'] is not None:
+        return jsonify({'success': False, 'error': 'Upload already finalized'}), 409
+    try:
+        offset = int(request.args.get('offset', ''))
+    except ValueError:
+        return jsonify({'success': False, 'error': 'offset is required'}), 400
+
+    error = write_upload_chunk(session, offset, request.get_data(cache=False),
+                               request.headers.get('X-Chunk-SHA256'))
+    if error:
+        return jsonify({'success': False, 'error': error}), 400
+    return jsonify({'success': True, 'index': offset // session['chunk_size']})
+
+@app.route('/upload_session/<session_id>/finalize', methods=['POST'])
+def finalize_upload(session_id):
+    """Assemble a completed upload into the store; enqueue it afterwards via /upload or /upload_stems."""
+    session = get_upload_session(session_id)
+    if not session:
+        return jsonify({'success': False, 'error': 'Upload session not found'}), 404
+
+    try:
+        stored = finalize_upload_session(session)
+    except Exception as e:
+        print(f"ERROR finalizing upload session {session_id}: {str(e)}")
+        return jsonify({'success': False, 'error': f'Finalize failed: {str(e)}'}), 500
+    if stored is None:
+        status = describe_upload_session(session)
+        status.update({'success': False, 'error': 'Upload is missing chunks'})
+        return jsonify(status), 409
+
+    print(f"[Room {session['room']}] - Upload session {session_id} finalized: {stored['filename']}")
+    return jsonify({'success': True, 'upload_id': session_id, 'filename': stored['filename']})
+
 @app.route('/upload', methods=['POST'])
 def upload():
-    """Handle audio file uploads with optimized performance."""
+    """Handle audio file uploads with optimized performance.
+
+    Accepts either a multipart `audio` file or the `upload_id` of a finalized resumable upload.
+    """
     room = request.form.get('room')
     
     if not room or room not in rooms_data:
         return jsonify({'success': False, 'error': 'Invalid or expired room'}), 400
-        
-    if 'audio' not in request.files:
-        return jsonify({'success': False, 'error': 'No file part in the request'}), 400
 
-    file = request.files['audio']
-    if not file.filename or file.filename == '' or not allowed_file(file.filename):
-        return jsonify({'success': False, 'error': 'File not allowed or not selected'}), 400
+    upload_id = request.form.get('upload_id')
+    if upload_id:
+        stored, original_filename = claim_finalized_upload(upload_id, room)
+        if stored is None:
+            return jsonify({'success': False, 'error': 'Upload not found or not finalized'}), 400
+    else:
+        if 'audio' not in request.files:
+            return jsonify({'success': False, 'error': 'No file part in the request'}), 400
 
-    try:
+        file = request.files['audio']
+        if not file.filename or file.filename == '' or not allowed_file(file.filename):
+            return jsonify({'success': False, 'error': 'File not allowed or not selected'}), 400
+        stored = None
         original_filename = file.filename
+
+    try:
         if not original_filename:
             return jsonify({'success': False, 'error': 'Invalid filename'}), 400
 
-        filename = unicode_secure_filename(original_filename)
-        
-        if not filename:  # If filename is still empty, generate a random one
-            filename = f"audio_{uuid.uuid4().hex[:8]}.mp3"
-            
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        
-        # Ensure upload directory exists
-        os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-        
-        # Save file
-        file.save(file_path)
-        print(f"[Room {room}] - File saved: {filename}")
+        # Save file under its content hash (identical uploads share one copy)
+        if stored is None:
+            stored = store_upload(file, original_filename)
+        filename = stored['filename']
+        if stored['deduplicated']:
+            print(f"[Room {room}] - Duplicate upload, reusing: {filename}")
+        else:
+            print(f"[Room {room}] - File saved: {filename}")
 
         # Prefer client-provided metadata if present, else extract from file
         client_title = request.form.get('title')
@@ -1786,23 +5793,15 @@ def upload():
         client_image_url = request.form.get('image_url')
         client_video_id = request.form.get('video_id')
 
-        # Extract metadata from file as fallback
-        metadata = extract_metadata(file_path)
-        print(f"[Room {room}] - Metadata extracted: {metadata}")
-
-        final_cover_filename = None
-        # Extract cover art
-        cover_data, cover_ext = extract_cover_art(file_path)
-
-        if cover_data:
-            cover_filename = f"{os.path.splitext(filename)[0]}_cover.{cover_ext}"
-            cover_path = os.path.join(app.config['UPLOAD_FOLDER'], cover_filename)
-            with open(cover_path, 'wb') as imgf:
-                imgf.write(cover_data)
-            final_cover_filename = cover_filename
-            print(f"[Room {room}] - Cover art extracted.")
-        else:
-            print(f"[Room {room}] - No cover art found.")
+        # Reuse metadata and cover art already extracted for these bytes; otherwise the
+        # item is queued as "processing" and upgraded in the background.
+        record = get_media_record(stored['content_hash'])
+        metadata = (record or {}).get('metadata') or {}
+        duration = (record or {}).get('duration')
+        final_cover_filename = (record or {}).get('cover')
+        palette = (record or {}).get('palette') if final_cover_filename else request_image_palette(client_image_url)
+        status = 'ready' if record is not None else 'processing'
+        print(f"[Room {room}] - Media record: {'cached' if record is not None else 'processing in background'}")
             
         with thread_lock:
             # Create audio item for queue
@@ -1827,6 +5826,8 @@ def upload():
                 'filename': filename,
                 'filename_display': display_name,
                 'cover': final_cover_filename,
+                'cover_thumbs': cover_thumb_refs(final_cover_filename),
+                'palette': palette,
                 'upload_time': time.time(),
                 'title': parsed_title,
                 'artist': parsed_artist,
@@ -1835,7 +5836,14 @@ def upload():
                 'image_url': client_image_url,
                 'video_id': client_video_id,
                 'stems': None,
-                'is_stem_track': False
+                'is_stem_track': False,
+                'duration': duration,
+                'content_hash': stored['content_hash'],
+                'status': status,
+                'renditions': (record or {}).get('renditions'),
+                'waveform': (record or {}).get('waveform'),
+                'hls': (record or {}).get('hls'),
+                'gain_db': ((record or {}).get('loudness') or {}).get('gain_db')
             }
             
             # Initialize queue if it doesn't exist
@@ -1864,12 +5872,15 @@ def upload():
                     'current_is_stream': False,
                     'current_image_url': client_image_url
                 })
+                begin_track_instance(rooms_data[room], room)
                 
                 # Send both filenames to client for the new current song
                 emit_data = {
                     'filename': filename, 
                     'filename_display': display_name,
                     'cover': final_cover_filename,
+                    'cover_thumbs': audio_item.get('cover_thumbs'),
+                    'palette': palette,
                     'title': parsed_title,
                     'artist': parsed_artist,
                     'album': audio_item.get('album'),
@@ -1877,7 +5888,10 @@ def upload():
                     'image_url': client_image_url,
                     'video_id': client_video_id,
                     'stems': None,
-                    'is_stem_track': False
+                    'is_stem_track': False,
+                    'duration': duration,
+                    'status': status,
+                    'renditions': audio_item.get('renditions')
                 }
                 emit_new_file_to_room(room, emit_data)
                 socketio.emit('pause', {'time': 0}, to=room)
@@ -1888,7 +5902,14 @@ def upload():
                 'current_index': rooms_data[room]['current_index']
             }, to=room)
         
-        return jsonify({'success': True, 'filename': filename, 'filename_display': original_filename})
+        if record is None:
+            client_fields = [field for field, value in (
+                ('title', client_title), ('artist', client_artist), ('album', client_album)) if value]
+            request_media_processing(stored, room, audio_item, client_fields=client_fields)
+        else:
+            request_media_derivatives(stored['content_hash'], record)
+
+        return jsonify({'success': True, 'filename': filename, 'filename_display': original_filename, 'status': status})
 
     except Exception as e:
         print(f"ERROR during file upload for room '{room}': {str(e)}")
@@ -1906,57 +5927,57 @@ def upload_stems():
     if not room or room not in rooms_data:
         return jsonify({'success': False, 'error': 'Invalid or expired room'}), 400
 
+    # Each stem is either a multipart file or the upload_id of a finalized resumable upload
     vocals_file = request.files.get('vocals')
     instrumental_file = request.files.get('instrumental')
+    vocals_upload_id = request.form.get('vocals_upload_id')
+    instrumental_upload_id = request.form.get('instrumental_upload_id')
 
-    if not vocals_file or not vocals_file.filename:
+    if not vocals_upload_id and (not vocals_file or not vocals_file.filename):
         return jsonify({'success': False, 'error': 'Vocals file is required'}), 400
-    if not instrumental_file or not instrumental_file.filename:
+    if not instrumental_upload_id and (not instrumental_file or not instrumental_file.filename):
         return jsonify({'success': False, 'error': 'Instrumental file is required'}), 400
 
-    if not allowed_file(vocals_file.filename):
+    if not vocals_upload_id and not allowed_file(vocals_file.filename):
         return jsonify({'success': False, 'error': 'Vocals file type is not allowed'}), 400
-    if not allowed_file(instrumental_file.filename):
+    if not instrumental_upload_id and not allowed_file(instrumental_file.filename):
         return jsonify({'success': False, 'error': 'Instrumental file type is not allowed'}), 400
 
-    def save_stem_file(file_obj, role_tag):
-        original_name = file_obj.filename or f"{role_tag}_{uuid.uuid4().hex[:8]}.mp3"
-        safe_name = unicode_secure_filename(original_name)
-        if not safe_name:
-            safe_name = f"{role_tag}_{uuid.uuid4().hex[:8]}.mp3"
+    # Validate every resumable stem before taking any, so a bad instrumental id leaves the vocals session usable
+    upload_ids = [upload_id for upload_id in (vocals_upload_id, instrumental_upload_id) if upload_id]
+    claimed = claim_finalized_uploads(upload_ids, room) if upload_ids else []
+    if claimed is None:
+        return jsonify({'success': False, 'error': 'Stem upload not found or not finalized'}), 400
+    claimed_uploads = dict(zip(upload_ids, claimed))
 
-        root, ext = os.path.splitext(safe_name)
-        ext = ext.lower() if ext else '.mp3'
-        candidate = unicode_secure_filename(f"{root}_{role_tag}{ext}") or f"{role_tag}_{uuid.uuid4().hex[:8]}{ext}"
-
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], candidate)
-        while os.path.exists(file_path):
-            candidate = unicode_secure_filename(f"{root}_{role_tag}_{uuid.uuid4().hex[:6]}{ext}") or f"{role_tag}_{uuid.uuid4().hex[:8]}{ext}"
-            file_path = os.path.join(app.config['UPLOAD_FOLDER'], candidate)
-
-        file_obj.save(file_path)
-
-        metadata = extract_metadata(file_path)
-        cover_filename = None
-        cover_data, cover_ext = extract_cover_art(file_path)
-        if cover_data:
-            cover_filename = f"{os.path.splitext(candidate)[0]}_cover.{cover_ext}"
-            cover_path = os.path.join(app.config['UPLOAD_FOLDER'], cover_filename)
-            with open(cover_path, 'wb') as imgf:
-                imgf.write(cover_data)
+    def save_stem_file(file_obj, role_tag, upload_id=None):
+        if upload_id:
+            stored, original_name = claimed_uploads[upload_id]
+        else:
+            original_name = file_obj.filename or f"{role_tag}_{uuid.uuid4().hex[:8]}.mp3"
+            stored = store_upload(file_obj, original_name)
+        record = get_media_record(stored['content_hash']) or {}
 
         return {
-            'filename': candidate,
-            'cover': cover_filename,
-            'metadata': metadata,
+            'filename': stored['filename'],
+            'cover': record.get('cover'),
+            'metadata': record.get('metadata') or {},
+            'duration': record.get('duration'),
             'original_filename': original_name,
+            'stored': stored,
+            'status': 'ready' if record else 'processing',
+            'renditions': record.get('renditions'),
+            'palette': record.get('palette'),
+            'waveform': record.get('waveform'),
+            'hls': record.get('hls'),
+            'gain_db': (record.get('loudness') or {}).get('gain_db'),
         }
 
     try:
         os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
-        vocals_data = save_stem_file(vocals_file, AUDIO_ROLE_VOCALS)
-        instrumental_data = save_stem_file(instrumental_file, AUDIO_ROLE_INSTRUMENTAL)
+        vocals_data = save_stem_file(vocals_file, AUDIO_ROLE_VOCALS, vocals_upload_id)
+        instrumental_data = save_stem_file(instrumental_file, AUDIO_ROLE_INSTRUMENTAL, instrumental_upload_id)
 
         client_title = request.form.get('title')
         client_artist = request.form.get('artist')
@@ -1974,6 +5995,12 @@ def upload_stems():
 
         display_name = f"{parsed_title} (Stems)"
         primary_cover = vocals_data['cover'] or instrumental_data['cover']
+        primary_palette = vocals_data['palette'] if vocals_data['cover'] else instrumental_data['palette']
+        stem_durations = [d for d in (vocals_data['duration'], instrumental_data['duration']) if d]
+        duration = max(stem_durations) if stem_durations else None
+        status = 'processing' if 'processing' in (vocals_data['status'], instrumental_data['status']) else 'ready'
+        premix_key = get_premix_key(vocals_data['stored']['content_hash'], instrumental_data['stored']['content_hash'])
+        premix = request_stem_premix(premix_key, vocals_data['filename'], instrumental_data['filename'])
 
         with thread_lock:
             audio_item = {
@@ -1981,6 +6008,8 @@ def upload_stems():
                 'filename': vocals_data['filename'],
                 'filename_display': display_name,
                 'cover': primary_cover,
+                'cover_thumbs': cover_thumb_refs(primary_cover),
+                'palette': primary_palette,
                 'upload_time': time.time(),
                 'title': parsed_title,
                 'artist': parsed_artist,
@@ -1989,14 +6018,32 @@ def upload_stems():
                 'image_url': None,
                 'video_id': None,
                 'is_stem_track': True,
+                'duration': duration,
+                'status': status,
+                'premix_key': premix_key,
+                'premix': premix,
                 'stems': {
                     AUDIO_ROLE_VOCALS: {
                         'filename': vocals_data['filename'],
-                        'cover': vocals_data['cover']
+                        'cover': vocals_data['cover'],
+                        'palette': vocals_data['palette'],
+                        'content_hash': vocals_data['stored']['content_hash'],
+                        'status': vocals_data['status'],
+                        'renditions': vocals_data['renditions'],
+                        'waveform': vocals_data['waveform'],
+                        'hls': vocals_data['hls'],
+                        'gain_db': vocals_data['gain_db']
                     },
                     AUDIO_ROLE_INSTRUMENTAL: {
                         'filename': instrumental_data['filename'],
-                        'cover': instrumental_data['cover']
+                        'cover': instrumental_data['cover'],
+                        'palette': instrumental_data['palette'],
+                        'content_hash': instrumental_data['stored']['content_hash'],
+                        'status': instrumental_data['status'],
+                        'renditions': instrumental_data['renditions'],
+                        'waveform': instrumental_data['waveform'],
+                        'hls': instrumental_data['hls'],
+                        'gain_db': instrumental_data['gain_db']
                     }
                 }
             }
@@ -2024,6 +6071,7 @@ def upload_stems():
                     'current_is_stream': False,
                     'current_image_url': None
                 })
+                begin_track_instance(rooms_data[room], room)
 
                 emit_data = audio_item_to_emit_data(audio_item)
                 emit_new_file_to_room(room, emit_data)
@@ -2034,12 +6082,23 @@ def upload_stems():
                 'current_index': rooms_data[room]['current_index']
             }, to=room)
 
+        client_fields = [field for field, value in (
+            ('title', client_title), ('artist', client_artist), ('album', client_album)) if value]
+        for role, stem_data in ((AUDIO_ROLE_VOCALS, vocals_data), (AUDIO_ROLE_INSTRUMENTAL, instrumental_data)):
+            if stem_data['status'] == 'processing':
+                request_media_processing(stem_data['stored'], room, audio_item,
+                                         stem_role=role, client_fields=client_fields)
+            else:
+                request_media_derivatives(stem_data['stored']['content_hash'],
+                                          get_media_record(stem_data['stored']['content_hash']))
+
         return jsonify({
             'success': True,
             'message': 'Stem track uploaded successfully',
             'title': parsed_title,
             'vocals_filename': vocals_data['filename'],
-            'instrumental_filename': instrumental_data['filename']
+            'instrumental_filename': instrumental_data['filename'],
+            'status': status
         })
 
     except Exception as e:
@@ -2109,6 +6168,7 @@ def play_from_queue(room_id, index):
             'current_is_stream': audio_item.get('is_stream', False),
             'current_image_url': audio_item.get('image_url')
         })
+        begin_track_instance(rooms_data[room_id], room_id)
     
     # Emit new song to all clients (role-aware for stem tracks)
     emit_data = audio_item_to_emit_data(audio_item)
@@ -2185,6 +6245,7 @@ def remove_from_queue(room_id, index):
                     'is_playing': False,
                     'last_progress_s': 0,
                 })
+                begin_track_instance(rooms_data[room_id], room_id)
                 emit_new_file_to_room(room_id, audio_item_to_emit_data(audio_item))
             else:
                 # Play the previous song (index decreased by 1)
@@ -2201,10 +6262,14 @@ def remove_from_queue(room_id, index):
                     'is_playing': False,
                     'last_progress_s': 0,
                 })
+                begin_track_instance(rooms_data[room_id], room_id)
                 emit_new_file_to_room(room_id, audio_item_to_emit_data(audio_item))
         elif index < current_index:
             # Adjust current_index down by 1
             rooms_data[room_id]['current_index'] = current_index - 1
+
+        # Indices shifted, so a pre-picked shuffle target may now point at another song
+        reset_upcoming_track(room_id)
     
     # Update queue status
     socketio.emit('queue_update', {
@@ -2214,6 +6279,24 @@ def remove_from_queue(room_id, index):
     
     return jsonify({'success': True})
 
+@app.route('/queue/<string:room_id>/pin/<int:index>', methods=['POST'])
+def pin_queue_item(room_id, index):
+    """Download a queued stream to local storage so it is served from disk from now on."""
+    if room_id not in rooms_data:
+        return jsonify({'error': 'Room not found'}), 404
+
+    with thread_lock:
+        queue = rooms_data[room_id].get('queue', [])
+        if index < 0 or index >= len(queue):
+            return jsonify({'error': 'Invalid queue index'}), 400
+        audio_item = queue[index]
+
+    if not audio_item.get('is_stream'):
+        return jsonify({'success': True, 'pin_status': 'pinned' if audio_item.get('pinned') else 'local'})
+    if not request_stream_pin(room_id, audio_item):
+        return jsonify({'error': 'Stream can no longer be resolved'}), 400
+    return jsonify({'success': True, 'pin_status': audio_item.get('pin_status') or 'pinning'})
+
 @app.route('/queue/<string:room_id>/reorder', methods=['POST'])
 def reorder_queue(room_id):
     """Reorder songs in the queue."""
@@ -2250,6 +6333,8 @@ def reorder_queue(room_id):
         elif to_index <= current_index < from_index:
             # If we moved an item from after current to before current
             rooms_data[room_id]['current_index'] = current_index + 1
+
+        reset_upcoming_track(room_id)
     
     # Update queue status
     socketio.emit('queue_update', {
@@ -2284,7 +6369,13 @@ def create_room():
         'current_is_stream': False,
         'current_image_url': None,
         'is_shuffling': False,  # Shuffle state
-        'isLooping': False  # Loop state synchronized across devices
+        'isLooping': False,  # Loop state synchronized across devices
+        'track_instance_id': 0,  # Bumped every time a track (re)starts as current
+        'preload_sent_for': None,  # track_instance_id whose preload_next hint was already sent
+        'pending_next_index': None,  # Shuffle target announced ahead of time via preload_next
+        'transition_mode': TRANSITION_MODE_OFF,  # off, gapless or crossfade between queue items
+        'crossfade_s': DEFAULT_CROSSFADE_S,
+        'scheduled_transition': None  # Next track start pinned to a shared server timestamp
     }
     print(f"New room created: {room_id}")
     return redirect(url_for('player_room', room_id=room_id))
@@ -2456,6 +6547,7 @@ def on_disconnect():
                         # Reset shuffle and loop states
                         rooms_data[room_id]['is_shuffling'] = False
                         rooms_data[room_id]['isLooping'] = False
+                        rooms_data[room_id]['scheduled_transition'] = None
 
 @socketio.on('remove_from_queue')
 def handle_remove_from_queue(data):
@@ -2512,6 +6604,7 @@ def handle_remove_from_queue(data):
                     'current_is_stream': audio_item.get('is_stream', False),
                     'current_image_url': audio_item.get('image_url')
                 })
+                begin_track_instance(rooms_data[room_id], room_id)
                 
                 emit_data = audio_item_to_emit_data(audio_item)
                 emit_data['is_playing'] = True
@@ -2535,6 +6628,8 @@ def handle_remove_from_queue(data):
         elif index < current_index:
             # Adjust current index since we removed a song before it
             rooms_data[room_id]['current_index'] = current_index - 1
+
+        reset_upcoming_track(room_id)
     
     # Emit updated queue to all clients in the room
     socketio.emit('queue_update', {
@@ -2556,6 +6651,7 @@ def handle_play(data):
             room_state['is_playing'] = True
             room_state['last_progress_s'] = data.get('time', 0)
             room_state['last_updated_at'] = time.time()
+            cancel_scheduled_transition(room)
         
         target_timestamp = time.time() + 0.3 # 300ms buffer
         socketio.emit('scheduled_play', {
@@ -2569,6 +6665,7 @@ def handle_pause(data):
     if room in rooms_data:
         with thread_lock:
             room_state = rooms_data[room]
+            cancel_scheduled_transition(room)
             if room_state['is_playing']:
                 time_since_update = time.time() - room_state['last_updated_at']
                 final_progress = room_state['last_progress_s'] + time_since_update
@@ -2587,6 +6684,7 @@ def handle_seek(data):
             was_playing = room_state['is_playing']
             room_state['last_progress_s'] = new_time
             room_state['last_updated_at'] = time.time()
+            cancel_scheduled_transition(room_id)
         
         if was_playing:
             target_timestamp = time.time() + 0.3 # 300ms buffer
@@ -2607,6 +6705,15 @@ def handle_sync(data):
             'target_timestamp': target_timestamp
         }, to=room)
 
+def uploaded_filename_from_source(source):
+    """Return the /uploads filename a member's player source points at, if any."""
+    if not isinstance(source, str):
+        return None
+    path = urlparse(source).path
+    if not path.startswith('/uploads/'):
+        return None
+    return urllib.parse.unquote(path[len('/uploads/'):]) or None
+
 @socketio.on('member_playback_heartbeat')
 def handle_member_playback_heartbeat(data):
     """Store per-member local playback telemetry used for drift display."""
@@ -2637,6 +6744,19 @@ def handle_member_playback_heartbeat(data):
         member['reported_has_media'] = bool(data.get('has_media', False))
         member['reported_at_s'] = time.time()
 
+        # Rendition plays are counted once per member per track instance; range requests,
+        # seeks and reconnects re-fetch the same bytes and must not count again
+        played_filename = uploaded_filename_from_source(data.get('source'))
+        play_key = (room_state.get('track_instance_id'), played_filename)
+        count_rendition = bool(
+            played_filename and member['reported_has_media'] and member.get('rendition_play_key') != play_key
+        )
+        if count_rendition:
+            member['rendition_play_key'] = play_key
+
+    if count_rendition:
+        record_rendition_served(played_filename)
+
 @socketio.on('next_song')
 def handle_next_song(data):
     """Play the next song in the queue, considering shuffle mode."""
@@ -2646,40 +6766,20 @@ def handle_next_song(data):
     if room not in rooms_data:
         return
 
+    # End-of-track requests from older clients carry the instance they finished; dedupe them.
+    if data.get('track_instance_id') is not None:
+        advance_room_track(room, data.get('track_instance_id'))
+        return
+
     with thread_lock:
         queue = rooms_data[room].get('queue', [])
-        current_index = rooms_data[room].get('current_index', -1)
-        is_shuffling = rooms_data[room].get('is_shuffling', False)
 
         if len(queue) == 0:
             return
 
-        # Determine next index based on shuffle mode
-        if is_shuffling and len(queue) > 1:
-            import random
-            available_indices = [i for i in range(len(queue)) if i != current_index]
-            next_index = random.choice(available_indices) if available_indices else 0
-        else:
-            next_index = current_index + 1
-            if next_index >= len(queue):
-                next_index = 0
-
-        audio_item = queue[next_index]
-        rooms_data[room].update({
-            'current_file': audio_item.get('filename'),
-            'current_file_display': audio_item.get('filename_display'),
-            'current_cover': audio_item.get('cover'),
-            'current_title': audio_item.get('title'),
-            'current_artist': audio_item.get('artist'),
-            'current_album': audio_item.get('album'),
-            'current_index': next_index,
-            'is_playing': auto_play,
-            'last_progress_s': 0,
-            'last_updated_at': time.time(),
-            'current_proxy_id': audio_item.get('proxy_id'),
-            'current_is_stream': audio_item.get('is_stream', False),
-            'current_image_url': audio_item.get('image_url')
-        })
+        # Determine next index based on shuffle mode (reuses the target announced by preload_next)
+        next_index = peek_next_queue_index(rooms_data[room])
+        audio_item = set_current_queue_item(rooms_data[room], room, next_index, is_playing=auto_play)
 
     emit_data = audio_item_to_emit_data(audio_item)
     emit_new_file_to_room(room, emit_data)
@@ -2696,6 +6796,16 @@ def handle_next_song(data):
         'current_index': next_index
     }, to=room)
 
+@socketio.on('track_ended')
+def handle_track_ended(data):
+    """A client's player reached the end of the track; advance once per track instance."""
+    room = data.get('room')
+    track_instance_id = data.get('track_instance_id')
+    if room not in rooms_data or track_instance_id is None:
+        # Without an instance id the event cannot be deduplicated; the server timer covers it.
+        return
+    advance_room_track(room, track_instance_id)
+
 @socketio.on('previous_song')
 def handle_previous_song(data):
     """Play the previous song in the queue."""
@@ -2732,6 +6842,7 @@ def handle_previous_song(data):
             'current_is_stream': audio_item.get('is_stream', False),
             'current_image_url': audio_item.get('image_url')
         })
+        begin_track_instance(rooms_data[room], room)
 
     emit_data = audio_item_to_emit_data(audio_item)
     emit_new_file_to_room(room, emit_data)
@@ -2780,6 +6891,7 @@ def handle_select_song(data):
             'current_is_stream': audio_item.get('is_stream', False),
             'current_image_url': audio_item.get('image_url')
         })
+        begin_track_instance(rooms_data[room], room)
 
     emit_data = audio_item_to_emit_data(audio_item)
     emit_new_file_to_room(room, emit_data)
@@ -2830,11 +6942,13 @@ def handle_loop_restart(data):
         rooms_data[room]['last_progress_s'] = 0
         rooms_data[room]['is_playing'] = True
         rooms_data[room]['last_updated_at'] = time.time()
+        begin_track_instance(rooms_data[room], room)
+        track_instance_id = rooms_data[room]['track_instance_id']
     
     print(f"[Room {room}] Loop restart triggered")
     
     # Broadcast loop restart to all devices
-    socketio.emit('loop_restart', {}, to=room)
+    socketio.emit('loop_restart', {'track_instance_id': track_instance_id}, to=room)
 
 @socketio.on('shuffle_toggle')
 def handle_shuffle_toggle(data):
@@ -2847,6 +6961,7 @@ def handle_shuffle_toggle(data):
         
     with thread_lock:
         rooms_data[room]['is_shuffling'] = is_shuffling
+        reset_upcoming_track(room)
         
     print(f"[Room {room}] Shuffle state changed to: {is_shuffling}")
     
@@ -2855,6 +6970,33 @@ def handle_shuffle_toggle(data):
         'isShuffling': is_shuffling
     }, to=room)
 
+@socketio.on('set_transition_mode')
+def handle_set_transition_mode(data):
+    """Set the room's track transition (off, gapless, crossfade) and synchronize across devices."""
+    room = data.get('room')
+    mode = normalize_transition_mode(data.get('mode'))
+
+    if room not in rooms_data:
+        return
+
+    with thread_lock:
+        room_state = rooms_data[room]
+        room_state['transition_mode'] = mode
+        if data.get('crossfade_s') is not None:
+            try:
+                room_state['crossfade_s'] = min(MAX_CROSSFADE_S, max(1.0, float(data.get('crossfade_s'))))
+            except (TypeError, ValueError):
+                pass
+        cancel_scheduled_transition(room)
+        crossfade_s = room_state.get('crossfade_s', DEFAULT_CROSSFADE_S)
+
+    print(f"[Room {room}] Transition mode changed to: {mode} ({crossfade_s}s)")
+
+    socketio.emit('transition_mode_update', {
+        'mode': mode,
+        'crossfade_s': crossfade_s
+    }, to=room)
+
 @socketio.on('shuffle_next')
 def handle_shuffle_next(data):
     """Play a random song from the queue when shuffle is enabled."""
@@ -2863,6 +7005,10 @@ def handle_shuffle_next(data):
     
     if room not in rooms_data:
         return
+
+    if data.get('track_instance_id') is not None:
+        advance_room_track(room, data.get('track_instance_id'))
+        return
         
     with thread_lock:
         queue = rooms_data[room].get('queue', [])
@@ -2871,13 +7017,13 @@ def handle_shuffle_next(data):
         if len(queue) <= 1:
             return  # Can't shuffle with 0 or 1 songs
             
-        # Generate a random index different from current
-        import random
-        available_indices = [i for i in range(len(queue)) if i != current_index]
-        if not available_indices:
-            return
-            
-        random_index = random.choice(available_indices)
+        # Use the shuffle target already announced via preload_next when there is one
+        random_index = rooms_data[room].get('pending_next_index')
+        if not isinstance(random_index, int) or not 0 <= random_index < len(queue) or random_index == current_index:
+            available_indices = [i for i in range(len(queue)) if i != current_index]
+            if not available_indices:
+                return
+            random_index = random.choice(available_indices)
         
         # Update current song
         audio_item = queue[random_index]
@@ -2893,6 +7039,7 @@ def handle_shuffle_next(data):
             'last_progress_s': 0,
             'last_updated_at': time.time(),
         })
+        begin_track_instance(rooms_data[room], room)
     
     print(f"[Room {room}] Shuffle: Playing random song at index {random_index}")
     
@@ -3174,6 +7321,7 @@ def handle_reorder_queue(data):
         with thread_lock:
             # Update the queue with the new order
             rooms_data[room]['queue'] = new_order
+            reset_upcoming_track(room)
             
             # Emit the updated queue to all clients in the room
             socketio.emit('queue_update', {
@@ -3187,6 +7335,11 @@ def handle_reorder_queue(data):
 
 # Now that sync_rooms_periodically is defined above, this line will work correctly.
 socketio.start_background_task(target=sync_rooms_periodically)
+socketio.start_background_task(target=watch_track_timelines)
+socketio.start_background_task(target=watch_hub_latency)
+socketio.start_background_task(target=watch_queued_streams)
+if STORAGE_QUOTA_BYTES:
+    socketio.start_background_task(target=watch_media_storage)
 
 if __name__ == "__main__":
     import webbrowser
@@ -0,0 +1,93 @@
+"""
+/uploads benchmark: throughput of concurrent Range readers, the way audio elements read
+while members seek.
+
+  server   this process: app.py under eventlet (RENDER=1) on an eventlet.wsgi listener,
+           serving one content-addressed upload of SIZE_MB from a temporary folder
+  clients  a subprocess with N threads, each on its own keep-alive connection, asking
+           for random 256 KB - 1 MB ranges for the given number of seconds
+
+Usage: python benchmarks/range_readers.py [readers=32] [seconds=10]
+"""
+import hashlib
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SIZE_MB = 64
+RANGE_BYTES = (256 * 1024, 1024 * 1024)
+
+
+def percentile(samples, fraction):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))] * 1000
+
+
+def run_clients(url, size, seconds, readers):
+    import requests
+
+    latencies, received = [], [0]
+    lock = threading.Lock()
+    deadline = time.time() + seconds
+
+    def read_ranges(seed):
+        rng = random.Random(seed)
+        session = requests.Session()
+        while time.time() < deadline:
+            length = rng.randint(*RANGE_BYTES)
+            start = rng.randrange(0, size - length)
+            started = time.perf_counter()
+            response = session.get(url, headers={'Range': f"bytes={start}-{start + length - 1}"})
+            elapsed = time.perf_counter() - started
+            if response.status_code != 206 or len(response.content) != length:
+                raise RuntimeError(f"bad response {response.status_code} ({len(response.content)} bytes)")
+            with lock:
+                latencies.append(elapsed)
+                received[0] += length
+
+    threads = [threading.Thread(target=read_ranges, args=(i,)) for i in range(readers)]
+    started = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - started
+    print(f"readers {readers}: {len(latencies) / elapsed:.0f} req/s, {received[0] / 1e6 / elapsed:.0f} MB/s, "
+          f"latency p50 {percentile(latencies, 0.5):.1f} ms, p99 {percentile(latencies, 0.99):.1f} ms")
+
+
+def main(readers, seconds):
+    os.environ['RENDER'] = '1'
+    sys.path.insert(0, ROOT)
+    import eventlet
+    import eventlet.wsgi
+    import app
+
+    folder = tempfile.mkdtemp(prefix='range_readers_')
+    data = os.urandom(SIZE_MB * 1024 * 1024)
+    filename = f"{hashlib.sha256(data).hexdigest()}.m4a"
+    with open(os.path.join(folder, filename), 'wb') as f:
+        f.write(data)
+    app.app.config['UPLOAD_FOLDER'] = folder
+
+    listener = eventlet.listen(('127.0.0.1', 0))
+    eventlet.spawn(eventlet.wsgi.server, listener, app.app, log=open(os.devnull, 'w'))
+    url = f"http://127.0.0.1:{listener.getsockname()[1]}/uploads/{filename}"
+    clients = eventlet.patcher.original('subprocess').Popen(
+        [sys.executable, __file__, '--clients', url, str(len(data)), str(seconds), str(readers)]
+    )
+    while clients.poll() is None:
+        eventlet.sleep(0.1)
+    os.remove(os.path.join(folder, filename))
+    os.rmdir(folder)
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--clients']:
+        run_clients(sys.argv[2], int(sys.argv[3]), float(sys.argv[4]), int(sys.argv[5]))
+    else:
+        main(int(sys.argv[1]) if len(sys.argv) > 1 else 32, float(sys.argv[2]) if len(sys.argv) > 2 else 10)
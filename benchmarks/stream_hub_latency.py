@@ -0,0 +1,140 @@
+"""
+Proxied stream benchmark: Socket.IO event latency on an eventlet worker while N proxied
+streams are pumped through iter_upstream_nonblocking (the relay cache is turned off so
+every stream takes the stream_remote_range path).
+
+  upstream   a plain (unpatched) HTTP server in a subprocess, each GET sending 16 KB
+             every 20 ms without a Content-Length
+  server     this process: app.py under eventlet (RENDER=1) on an eventlet.wsgi listener
+  clients    a subprocess with N stream readers and one Socket.IO client timing
+             client_ping -> server_pong round trips, idle first and then with N streams
+
+The server's CPU time for the whole run is printed last.
+
+Usage: python benchmarks/stream_hub_latency.py [streams=50] [seconds=10]
+"""
+import os
+import subprocess
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CHUNK = 16 * 1024
+CHUNK_INTERVAL_S = 0.02
+PING_INTERVAL_S = 0.05
+
+
+def run_upstream(seconds):
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header('Content-Type', 'audio/mpeg')
+            self.end_headers()
+            deadline = time.time() + seconds
+            try:
+                while time.time() < deadline:
+                    self.wfile.write(b'\0' * CHUNK)
+                    time.sleep(CHUNK_INTERVAL_S)
+            except OSError:
+                pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    print(server.server_port, flush=True)
+    server.serve_forever()
+
+
+def percentile(samples, fraction):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))] * 1000
+
+
+def run_clients(base_url, seconds, proxy_ids):
+    import requests
+    import socketio
+
+    rtts = []
+    sent = {}
+    client = socketio.Client()
+
+    @client.on('server_pong')
+    def on_pong(data):
+        started = sent.pop('t', None)
+        if started is not None:
+            rtts.append(time.perf_counter() - started)
+
+    client.connect(base_url, transports=['polling'])
+
+    def measure(duration):
+        del rtts[:]
+        deadline = time.time() + duration
+        while time.time() < deadline:
+            sent['t'] = time.perf_counter()
+            client.emit('client_ping')
+            time.sleep(PING_INTERVAL_S)
+        return list(rtts)
+
+    idle = measure(3)
+    received = [0] * len(proxy_ids)
+
+    def read_stream(index, proxy_id):
+        with requests.get(f"{base_url}/stream_proxy/{proxy_id}", stream=True, timeout=30) as response:
+            for chunk in response.iter_content(65536):
+                received[index] += len(chunk)
+
+    readers = [threading.Thread(target=read_stream, args=(i, p), daemon=True) for i, p in enumerate(proxy_ids)]
+    started = time.time()
+    for reader in readers:
+        reader.start()
+    time.sleep(1)
+    busy = measure(seconds - 2)
+    for reader in readers:
+        reader.join(timeout=seconds)
+    elapsed = time.time() - started
+    client.disconnect()
+
+    for label, samples in (('idle', idle), (f'{len(proxy_ids)} streams', busy)):
+        print(f"{label:<12}pings {len(samples):>4}  p50 {percentile(samples, 0.5):7.2f} ms"
+              f"  p99 {percentile(samples, 0.99):7.2f} ms")
+    print(f"streamed {sum(received) / 1e6:.1f} MB ({sum(received) / 1e6 / elapsed:.1f} MB/s)")
+
+
+def main(streams, seconds):
+    os.environ['RENDER'] = '1'
+    os.environ['STREAM_RELAY_ENABLED'] = '0'
+    sys.path.insert(0, ROOT)
+    import eventlet
+    import eventlet.wsgi
+    import app
+
+    upstream = subprocess.Popen([sys.executable, __file__, '--upstream', str(seconds)],
+                                stdout=subprocess.PIPE, text=True)
+    upstream_url = f"http://127.0.0.1:{upstream.stdout.readline().strip()}/track.mp3"
+    proxy_ids = [app.add_proxy_url(f"{upstream_url}?n={i}") for i in range(streams)]
+
+    listener = eventlet.listen(('127.0.0.1', 0))
+    eventlet.spawn(eventlet.wsgi.server, listener, app.app, log=open(os.devnull, 'w'))
+    base_url = f"http://127.0.0.1:{listener.getsockname()[1]}"
+    clients = eventlet.patcher.original('subprocess').Popen(
+        [sys.executable, __file__, '--clients', base_url, str(seconds), *proxy_ids]
+    )
+    cpu_started = time.process_time()
+    while clients.poll() is None:
+        eventlet.sleep(0.1)
+    upstream.kill()
+    print(f"server CPU {time.process_time() - cpu_started:.1f} s")
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--upstream']:
+        run_upstream(float(sys.argv[2]))
+    elif sys.argv[1:2] == ['--clients']:
+        run_clients(sys.argv[2], float(sys.argv[3]), sys.argv[4:])
+    else:
+        main(int(sys.argv[1]) if len(sys.argv) > 1 else 50, float(sys.argv[2]) if len(sys.argv) > 2 else 10)
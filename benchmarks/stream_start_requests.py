@@ -0,0 +1,103 @@
+"""
+Stream start benchmark: upstream GETs per track start through /stream_proxy.
+
+Every start has M members open the stream the way browsers do: a bytes=0-1 probe, a
+bytes=0- request read for 512 KB, and a tail range for an MP4 moov atom. Between starts
+the relay cache is emptied, as it is after an eviction, so only the first start of a
+stream may pay for the head and tail. The upstream is a local HTTP server with Range
+support, throttled to about 3 MB/s per connection, that counts GETs; when the tree reports probes.upstream_requests_per_start it is
+printed next to the counted number.
+
+Usage: python benchmarks/stream_start_requests.py [members=5] [starts=10]
+"""
+import os
+import shutil
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app  # noqa: E402
+
+SIZE = 6 * 1024 * 1024
+TAIL = 64 * 1024
+HEAD_READ = 512 * 1024
+CHUNK = 64 * 1024
+CHUNK_INTERVAL_S = 0.02
+upstream_gets = [0]
+
+
+class Upstream(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    body = bytes(range(256)) * (SIZE // 256)
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        upstream_gets[0] += 1
+        start, end = 0, SIZE - 1
+        header = self.headers.get('Range', '')
+        if header.startswith('bytes='):
+            first, _, last = header[6:].partition('-')
+            start = int(first) if first else SIZE - int(last)
+            end = min(int(last), SIZE - 1) if first and last else SIZE - 1
+        self.send_response(206 if header else 200)
+        self.send_header('Content-Type', 'audio/mp4')
+        self.send_header('Content-Length', str(end - start + 1))
+        if header:
+            self.send_header('Content-Range', f"bytes {start}-{end}/{SIZE}")
+        self.end_headers()
+        try:
+            # A remote CDN, not loopback: about 3 MB/s per connection
+            for offset in range(start, end + 1, CHUNK):
+                self.wfile.write(self.body[offset:min(offset + CHUNK, end + 1)])
+                time.sleep(CHUNK_INTERVAL_S)
+        except OSError:
+            pass
+
+
+def open_as_member(client, proxy_id):
+    client.get(f"/stream_proxy/{proxy_id}", headers={'Range': 'bytes=0-1'}).close()
+    response = client.get(f"/stream_proxy/{proxy_id}", headers={'Range': 'bytes=0-'}, buffered=False)
+    read = 0
+    for chunk in response.response:
+        read += len(chunk)
+        if read >= HEAD_READ:
+            break
+    response.close()
+    client.get(f"/stream_proxy/{proxy_id}", headers={'Range': f"bytes={SIZE - TAIL}-"}).close()
+
+
+def main(members, starts):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Upstream)
+    server.handle_error = lambda request, address: None  # relay fetchers hang up mid-body
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    proxy_id = app.add_proxy_url(f"http://127.0.0.1:{server.server_port}/track.m4a")
+
+    for start in range(starts):
+        with app.stream_relay_lock:
+            app.stream_relays.clear()
+        shutil.rmtree(app.STREAM_RELAY_DIR, ignore_errors=True)
+        if hasattr(app, 'stream_start_times'):
+            app.stream_start_times.clear()  # every round is a new start of the same stream
+        threads = [
+            threading.Thread(target=open_as_member, args=(app.app.test_client(), proxy_id))
+            for _ in range(members)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    probes = app.get_stream_relay_stats().get('probes') or {}
+    print(f"members {members}, starts {starts}: upstream GETs {upstream_gets[0]}, "
+          f"{upstream_gets[0] / starts:.2f} per start")
+    if probes:
+        print(f"probes.upstream_requests_per_start {probes['upstream_requests_per_start']}")
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5, int(sys.argv[2]) if len(sys.argv) > 2 else 10)
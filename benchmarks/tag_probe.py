@@ -0,0 +1,50 @@
+"""
+Tag probe benchmark: per-file cost of reading tags + cover + stream info.
+
+  two_pass     the old route cost: extract_metadata and extract_cover_art each parsed the file
+  probe_cold   probe_audio_file with an empty cache (one parse)
+  probe_cached probe_audio_file on a cache hit (/metadata, /lyrics, re-uploads)
+
+Usage: python benchmarks/tag_probe.py track.mp3 track.flac track.m4a [...]
+"""
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app  # noqa: E402
+
+ROUNDS = 50
+
+
+def timed(func, rounds=ROUNDS):
+    samples = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+def two_pass(path):
+    app.read_tag_metadata(app.MutagenFile(path))
+    app.read_cover_art(app.MutagenFile(path))
+
+
+def probe_cold(path):
+    app.probe_cache.clear()
+    app.probe_audio_file(path)
+
+
+def main(paths):
+    print(f"{'file':<16}{'size MB':>9}{'two_pass ms':>13}{'probe_cold ms':>15}{'probe_cached ms':>17}")
+    for path in paths:
+        app.probe_audio_file(path)
+        cached = timed(lambda: app.probe_audio_file(path), rounds=ROUNDS * 20)
+        print(f"{os.path.basename(path):<16}{os.path.getsize(path) / 1e6:>9.1f}"
+              f"{timed(lambda: two_pass(path)):>13.2f}{timed(lambda: probe_cold(path)):>15.2f}{cached:>17.4f}")
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -14,13 +14,24 @@ const AudioFlowVisualizer = (function() {
     let source = null;
     let splitter = null;
     let outputMerger = null;
+    let trackGain = null;
+    let trackGainDb = 0;
     let secondaryMediaElement = null;
     let secondarySource = null;
     let secondarySplitter = null;
     let secondaryRoutingEnabled = false;
+    // Crossfade elements: one source+splitter each, mixed into their own merger and a gain
+    // carrying the incoming track's loudness, so they follow the same channel routing
+    let transitionSources = [];
+    let transitionSplitters = [];
+    let transitionMerger = null;
+    let transitionGain = null;
+    let transitionIsMonoVariant = false;
     let animationId = null;
     let visualizerInterval = null;
     let channelMode = 'stereo';
+    // Set when the primary player holds a server-side mono channel variant
+    let primaryIsMonoVariant = false;
 
     // DOM elements (will be set during init)
     let player = null;
@@ -54,17 +65,20 @@ const AudioFlowVisualizer = (function() {
             return;
         }
 
-        const connectSplitByMode = (splitNode) => {
+        const connectSplitByMode = (splitNode, merger, monoVariant) => {
             if (!splitNode) return;
-            if (channelMode === 'left') {
+            if (monoVariant && channelMode !== 'stereo') {
+                // Mono variant: its only channel already is the assigned side
+                splitNode.connect(merger, 0, channelMode === 'left' ? 0 : 1);
+            } else if (channelMode === 'left') {
                 // True left-only output: left channel to left ear, right ear silent.
-                splitNode.connect(outputMerger, 0, 0);
+                splitNode.connect(merger, 0, 0);
             } else if (channelMode === 'right') {
                 // True right-only output: right channel to right ear, left ear silent.
-                splitNode.connect(outputMerger, 1, 1);
+                splitNode.connect(merger, 1, 1);
             } else {
-                splitNode.connect(outputMerger, 0, 0);
-                splitNode.connect(outputMerger, 1, 1);
+                splitNode.connect(merger, 0, 0);
+                splitNode.connect(merger, 1, 1);
             }
         };
 
@@ -85,17 +99,74 @@ const AudioFlowVisualizer = (function() {
         }
 
         try {
-            outputMerger.disconnect(audioContext.destination);
+            outputMerger.disconnect(trackGain);
         } catch (e) {
-            // No existing merger->destination link.
+            // No existing merger->gain link.
         }
 
-        connectSplitByMode(splitter);
+        connectSplitByMode(splitter, outputMerger, primaryIsMonoVariant);
         if (secondaryRoutingEnabled) {
-            connectSplitByMode(secondarySplitter);
+            connectSplitByMode(secondarySplitter, outputMerger, false);
         }
 
-        outputMerger.connect(audioContext.destination);
+        outputMerger.connect(trackGain);
+
+        transitionSplitters.forEach(transitionSplitter => {
+            try {
+                transitionSplitter.disconnect(transitionMerger);
+            } catch (e) {
+                // Not routed yet.
+            }
+            connectSplitByMode(transitionSplitter, transitionMerger, transitionIsMonoVariant);
+        });
+    }
+
+    // Route crossfade elements through the graph like the main player. Returns false when the
+    // main player isn't routed yet either, in which case the elements play directly.
+    function attachTransitionPlayers(mediaElements, gainDb, monoVariant) {
+        detachTransitionPlayers();
+        if (!audioContext || !source || !mediaElements || mediaElements.length === 0) {
+            return false;
+        }
+
+        try {
+            transitionMerger = audioContext.createChannelMerger(2);
+            transitionGain = audioContext.createGain();
+            transitionGain.gain.value = dbToGain(Number.isFinite(gainDb) ? gainDb : 0);
+            transitionMerger.connect(transitionGain);
+            transitionGain.connect(audioContext.destination);
+            mediaElements.forEach(mediaElement => {
+                const transitionSource = audioContext.createMediaElementSource(mediaElement);
+                const transitionSplitter = audioContext.createChannelSplitter(2);
+                transitionSource.connect(transitionSplitter);
+                transitionSources.push(transitionSource);
+                transitionSplitters.push(transitionSplitter);
+            });
+        } catch (e) {
+            console.warn('[AudioFlow] Could not attach transition players to audio graph:', e);
+            detachTransitionPlayers();
+            return false;
+        }
+
+        transitionIsMonoVariant = !!monoVariant;
+        applyChannelRouting(channelMode);
+        return true;
+    }
+
+    function detachTransitionPlayers() {
+        [...transitionSources, ...transitionSplitters, transitionMerger, transitionGain].forEach(node => {
+            if (!node) return;
+            try {
+                node.disconnect();
+            } catch (e) {
+                // Ignore disconnect errors.
+            }
+        });
+        transitionSources = [];
+        transitionSplitters = [];
+        transitionMerger = null;
+        transitionGain = null;
+        transitionIsMonoVariant = false;
     }
 
     function setSecondaryOutputPlayer(mediaElement) {
@@ -166,6 +237,19 @@ const AudioFlowVisualizer = (function() {
         setSecondaryOutputPlayer(null);
     }
 
+    function dbToGain(db) {
+        return Math.pow(10, db / 20);
+    }
+
+    // Loudness normalization: the server measures each track and sends gain_db.
+    // Ramped so switching tracks (or a late analysis result) doesn't click.
+    function setTrackGain(db) {
+        trackGainDb = Number.isFinite(db) ? db : 0;
+        if (trackGain && audioContext) {
+            trackGain.gain.setTargetAtTime(dbToGain(trackGainDb), audioContext.currentTime, 0.05);
+        }
+    }
+
     function initAudioContext() {
         if (!audioContext) {
             try {
@@ -192,6 +276,9 @@ const AudioFlowVisualizer = (function() {
                 
                 splitter = audioContext.createChannelSplitter(2);
                 outputMerger = audioContext.createChannelMerger(2);
+                trackGain = audioContext.createGain();
+                trackGain.gain.value = dbToGain(trackGainDb);
+                trackGain.connect(audioContext.destination);
                 
                 const bufferLength = analyser.frequencyBinCount;
                 dataArray = new Uint8Array(bufferLength);
@@ -396,11 +483,13 @@ const AudioFlowVisualizer = (function() {
         document.addEventListener('keydown', enable);
     }
 
-    function setChannelMode(mode) {
+    function setChannelMode(mode, monoVariant) {
         const normalized = normalizeChannelMode(mode);
-        if (normalized === channelMode && source) {
+        const mono = !!monoVariant;
+        if (normalized === channelMode && mono === primaryIsMonoVariant && source) {
             return;
         }
+        primaryIsMonoVariant = mono;
         applyChannelRouting(normalized);
     }
 
@@ -420,7 +509,10 @@ const AudioFlowVisualizer = (function() {
         setChannelMode,
         getChannelMode,
         setSecondaryOutputPlayer,
-        clearSecondaryOutputPlayer
+        clearSecondaryOutputPlayer,
+        attachTransitionPlayers,
+        detachTransitionPlayers,
+        setTrackGain
     };
 })();
 
@@ -16,6 +16,7 @@ document.addEventListener('DOMContentLoaded', () => {
     const player = document.getElementById('player');
     let secondaryPlayer = null;
     let isDualMixActive = false;
+    let serverPalette = null;
     const audioInput = document.getElementById('audio-input');
     const vocalsInput = document.getElementById('vocals-input');
     const instrumentalInput = document.getElementById('instrumental-input');
@@ -56,6 +57,7 @@ document.addEventListener('DOMContentLoaded', () => {
     const loopIcon = document.getElementById('loop-icon');
     const shuffleBtn = document.getElementById('shuffle-btn');
     const shuffleIcon = document.getElementById('shuffle-icon');
+    const transitionBtn = document.getElementById('transition-btn');
     const currentTimeDisplay = document.getElementById('current-time');
     const totalTimeDisplay = document.getElementById('total-time');
     const progressBar = document.querySelector('.progress-bar');
@@ -114,6 +116,7 @@ document.addEventListener('DOMContentLoaded', () => {
             loopIcon,
             shuffleBtn,
             shuffleIcon,
+            transitionBtn,
             currentTimeDisplay,
             totalTimeDisplay,
             progressBar,
@@ -227,10 +230,22 @@ document.addEventListener('DOMContentLoaded', () => {
 
     // --- Global Functions (for backwards compatibility) ---
 
-    function buildUploadSource(filename) {
+    function buildUploadSource(filename, renditions, hls) {
+        const Utils = window.AudioFlowUtils;
+        if (Utils && Utils.buildUploadUrl) {
+            return Utils.buildUploadUrl(filename, renditions, hls);
+        }
         return `/uploads/${encodeURIComponent(filename)}`;
     }
 
+    function buildCoverSource(cover, coverThumbs, view) {
+        const Utils = window.AudioFlowUtils;
+        if (Utils && Utils.coverUrl) {
+            return Utils.coverUrl(cover, coverThumbs, view);
+        }
+        return `/uploads/${cover}`;
+    }
+
     function ensureSecondaryPlayer() {
         if (secondaryPlayer && secondaryPlayer.isConnected) {
             return secondaryPlayer;
@@ -333,7 +348,10 @@ document.addEventListener('DOMContentLoaded', () => {
         ).toLowerCase();
 
         if (Visualizer && typeof Visualizer.setChannelMode === 'function') {
-            Visualizer.setChannelMode(assignedChannelMode);
+            Visualizer.setChannelMode(assignedChannelMode, !!(trackOptions && trackOptions.channel_variant));
+        }
+        if (Visualizer && typeof Visualizer.setTrackGain === 'function') {
+            Visualizer.setTrackGain(trackOptions && trackOptions.gain_db != null ? Number(trackOptions.gain_db) : 0);
         }
 
         const dualMixRequested = shouldUseDualMix(trackOptions);
@@ -344,7 +362,12 @@ document.addEventListener('DOMContentLoaded', () => {
         const mixCovers = trackOptions && typeof trackOptions.mix_covers === 'object' ? trackOptions.mix_covers : null;
         const selectedVariant = trackOptions && trackOptions.selected_audio_variant;
         const effectiveCover = cover || (mixCovers ? mixCovers[selectedVariant] || mixCovers.vocals || mixCovers.instrumental : null);
+        // Thumbnails are only advertised for the payload's own cover
+        const coverThumbs = effectiveCover === cover && trackOptions ? trackOptions.cover_thumbs : null;
+        serverPalette = effectiveCover === cover && trackOptions && trackOptions.palette ? trackOptions.palette : null;
         const sourceFilename = primaryStemFilename || filename;
+        const mixRenditions = dualMixRequested && trackOptions.mix_renditions ? trackOptions.mix_renditions : null;
+        const sourceRenditions = mixRenditions ? mixRenditions.vocals : (trackOptions && trackOptions.renditions);
         
         // Handle no file case
         if (!sourceFilename && !proxyId) {
@@ -419,7 +442,7 @@ document.addEventListener('DOMContentLoaded', () => {
             player.currentProxyId = proxyId;
             clearSecondaryPlayer();
         } else {
-            player.src = buildUploadSource(sourceFilename);
+            player.src = buildUploadSource(sourceFilename, sourceRenditions, mixRenditions ? null : trackOptions && trackOptions.hls);
             delete player.currentProxyId;
 
             if (
@@ -428,7 +451,7 @@ document.addEventListener('DOMContentLoaded', () => {
                 secondaryStemFilename !== sourceFilename
             ) {
                 const secondary = ensureSecondaryPlayer();
-                secondary.src = buildUploadSource(secondaryStemFilename);
+                secondary.src = buildUploadSource(secondaryStemFilename, mixRenditions && mixRenditions.instrumental);
                 secondary.load();
                 isDualMixActive = true;
                 if (Visualizer && typeof Visualizer.setSecondaryOutputPlayer === 'function') {
@@ -444,7 +467,7 @@ document.addEventListener('DOMContentLoaded', () => {
         const playerThumbnail = document.getElementById('player-thumbnail');
         if (playerThumbnail) {
             if (effectiveCover) {
-                playerThumbnail.src = `/uploads/${effectiveCover}`;
+                playerThumbnail.src = buildCoverSource(effectiveCover, coverThumbs, 'queue');
                 playerThumbnail.style.display = 'block';
             } else if (imageUrl) {
                 playerThumbnail.src = imageUrl;
@@ -458,21 +481,25 @@ document.addEventListener('DOMContentLoaded', () => {
         fileNameDisplay.classList.remove('playing');
         if (Fullscreen) Fullscreen.hideCoverDancingBars();
         if (Theme) Theme.resetTheme();
+        if (serverPalette && Theme && !Theme.applyServerPalette(serverPalette)) {
+            serverPalette = null;
+        }
 
         // Load cover art
         if (effectiveCover) {
             if (coverArtPlaceholder) {
                 coverArtPlaceholder.style.display = 'none';
             }
-            coverArt.src = `/uploads/${effectiveCover}`;
+            coverArt.src = buildCoverSource(effectiveCover, coverThumbs, 'player');
             coverArt.style.display = 'block';
             coverArt.onload = handleCoverLoad;
         } else if (imageUrl) {
             if (coverArtPlaceholder) {
                 coverArtPlaceholder.style.display = 'none';
             }
+            // Pixels only need to be readable (via the proxy) when there is no server palette
             const proxiedImageUrl = `/image_proxy?url=${encodeURIComponent(imageUrl)}`;
-            coverArt.src = proxiedImageUrl;
+            coverArt.src = serverPalette ? imageUrl : proxiedImageUrl;
             coverArt.style.display = 'block';
             coverArt.onload = handleCoverLoad;
         } else {
@@ -485,18 +512,68 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     };
 
+    // Refresh title/artist/cover of the loaded track in place (no audio reload)
+    window.updateTrackInfo = function(title, artist, cover, coverThumbs, palette) {
+        if (title) {
+            songTitleElement.textContent = title;
+            songTitleElement.title = title;
+        }
+
+        if (artist) {
+            songArtistElement.textContent = artist;
+            songArtistElement.title = artist;
+            songArtistElement.style.display = 'block';
+        }
+
+        if (title && fileNameDisplay.classList.contains('playing')) {
+            document.title = artist ? `${title} - ${artist}` : title;
+        }
+
+        if (palette && Theme && Theme.applyServerPalette(palette)) {
+            serverPalette = palette;
+            applyCoverGlow(palette.dominant);
+        }
+
+        if (!cover) return;
+        const coverSrc = buildCoverSource(cover, coverThumbs, 'player');
+        if (coverArt.getAttribute('src') === coverSrc) return;
+
+        const playerThumbnail = document.getElementById('player-thumbnail');
+        if (playerThumbnail) {
+            playerThumbnail.src = buildCoverSource(cover, coverThumbs, 'queue');
+            playerThumbnail.style.display = 'block';
+        }
+        if (coverArtPlaceholder) {
+            coverArtPlaceholder.style.display = 'none';
+            coverArtPlaceholder.classList.remove('visible');
+        }
+        coverArt.src = coverSrc;
+        coverArt.style.display = 'block';
+        coverArt.onload = handleCoverLoad;
+    };
+
+    function applyCoverGlow(dominantColor) {
+        const [r, g, b] = dominantColor;
+        coverArt.style.boxShadow = `0 0 15px rgba(${r},${g},${b},0.6), 0 0 35px rgba(${r},${g},${b},0.4)`;
+    }
+
     function handleCoverLoad() {
         try {
-            const dominantColor = colorThief.getColor(coverArt);
-            const palette = colorThief.getPalette(coverArt, 3);
-            
-            if (Theme) {
-                Theme.setCurrentColors(dominantColor, palette);
-                Theme.applyTheme(dominantColor, palette);
+            let dominantColor;
+            if (serverPalette) {
+                // Theme was already applied from the payload in loadAudio
+                dominantColor = serverPalette.dominant;
+            } else {
+                dominantColor = colorThief.getColor(coverArt);
+                const palette = colorThief.getPalette(coverArt, 3);
+
+                if (Theme) {
+                    Theme.setCurrentColors(dominantColor, palette);
+                    Theme.applyTheme(dominantColor, palette);
+                }
             }
             
-            const [r, g, b] = dominantColor;
-            coverArt.style.boxShadow = `0 0 15px rgba(${r},${g},${b},0.6), 0 0 35px rgba(${r},${g},${b},0.4)`;
+            applyCoverGlow(dominantColor);
             
             // Setup 3D tilt
             const Utils = window.AudioFlowUtils;
@@ -559,6 +636,13 @@ document.addEventListener('DOMContentLoaded', () => {
     }
 
     // Player events
+    // The track instance this element is playing, taken when playback starts: after a
+    // crossfade the outgoing track can still end once the room has moved to the next one.
+    let playbackTrackInstanceId = null;
+    player.addEventListener('playing', () => {
+        playbackTrackInstanceId = SocketHandlers ? SocketHandlers.getCurrentTrackInstanceId() : null;
+    });
+
     player.addEventListener('play', () => {
         startSecondaryPlayback();
         if (SocketHandlers && SocketHandlers.isReceiving()) return;
@@ -578,6 +662,8 @@ document.addEventListener('DOMContentLoaded', () => {
         pauseSecondaryPlayback();
         if (SocketHandlers && SocketHandlers.isReceiving()) return;
         if (player.seeking) return;
+        // Reaching the end is reported via track_ended; pausing the room here would stop the advance.
+        if (player.ended) return;
         player.playbackRate = 1.0;
         fileNameDisplay.classList.remove('playing');
         if (Fullscreen) Fullscreen.hideCoverDancingBars();
@@ -589,27 +675,17 @@ document.addEventListener('DOMContentLoaded', () => {
     player.addEventListener('ended', () => {
         pauseSecondaryPlayback();
         const isLooping = Player ? Player.getLooping() : false;
-        const isShuffling = Player ? Player.getShuffling() : false;
-        
-        if (isLooping) {
-            socket.emit('loop_restart', { room: roomId });
-            player.currentTime = 0;
-            player.play();
-            return;
-        }
+        // The server advances (or loops) once per track instance, however many members report the end.
+        socket.emit('track_ended', { room: roomId, track_instance_id: playbackTrackInstanceId });
+
+        if (isLooping) return;
 
         fileNameDisplay.classList.remove('playing');
         if (Fullscreen) Fullscreen.hideCoverDancingBars();
 
         const queue = Queue ? Queue.getQueue() : [];
-        if (queue.length > 1) {
-            if (isShuffling) {
-                if (Fullscreen) Fullscreen.setManualDirection('next');
-                socket.emit('shuffle_next', { room: roomId, auto_play: true });
-            } else {
-                if (Fullscreen) Fullscreen.setManualDirection('next');
-                socket.emit('next_song', { room: roomId, auto_play: true });
-            }
+        if (queue.length > 1 && Fullscreen) {
+            Fullscreen.setManualDirection('next');
         }
     });
 
@@ -13,6 +13,7 @@ const AudioFlowPlayer = (function() {
     let loopIcon = null;
     let shuffleBtn = null;
     let shuffleIcon = null;
+    let transitionBtn = null;
     let currentTimeDisplay = null;
     let totalTimeDisplay = null;
     let progressBar = null;
@@ -32,6 +33,9 @@ const AudioFlowPlayer = (function() {
     let lastVolume = window.AudioFlowConfig ? window.AudioFlowConfig.DEFAULT_VOLUME : 0.7;
     let isLooping = false;
     let isShuffling = false;
+    let transitionMode = 'off';
+    let crossfadeSeconds = 6;
+    const TRANSITION_MODES = ['off', 'gapless', 'crossfade'];
 
     function init(elements, socketInstance, room) {
         player = elements.player;
@@ -43,6 +47,7 @@ const AudioFlowPlayer = (function() {
         loopIcon = elements.loopIcon;
         shuffleBtn = elements.shuffleBtn;
         shuffleIcon = elements.shuffleIcon;
+        transitionBtn = elements.transitionBtn;
         currentTimeDisplay = elements.currentTimeDisplay;
         totalTimeDisplay = elements.totalTimeDisplay;
         progressBar = elements.progressBar;
@@ -170,6 +175,34 @@ const AudioFlowPlayer = (function() {
         }
     }
 
+    function cycleTransitionMode() {
+        const nextIndex = (TRANSITION_MODES.indexOf(transitionMode) + 1) % TRANSITION_MODES.length;
+        transitionMode = TRANSITION_MODES[nextIndex];
+        updateTransitionButton();
+        console.log('Transition mode:', transitionMode);
+
+        if (socket && roomId) {
+            socket.emit('set_transition_mode', { room: roomId, mode: transitionMode, crossfade_s: crossfadeSeconds });
+        }
+    }
+
+    function updateTransitionButton() {
+        if (!transitionBtn) return;
+
+        const labels = {
+            off: 'Transition: Off',
+            gapless: 'Transition: Gapless',
+            crossfade: `Transition: Crossfade (${crossfadeSeconds}s)`
+        };
+        transitionBtn.title = labels[transitionMode] || labels.off;
+
+        if (transitionMode !== 'off') {
+            transitionBtn.classList.add('transition-active');
+        } else {
+            transitionBtn.classList.remove('transition-active');
+        }
+    }
+
     function setupProgressDragging() {
         if (!progressBar) return;
         
@@ -304,6 +337,7 @@ const AudioFlowPlayer = (function() {
         updatePlayPauseButton();
         updateLoopButton();
         updateShuffleButton();
+        updateTransitionButton();
         updateProgressBar();
 
         if (playPauseBtn) {
@@ -366,6 +400,10 @@ const AudioFlowPlayer = (function() {
             shuffleBtn.addEventListener('click', toggleShuffle);
         }
 
+        if (transitionBtn) {
+            transitionBtn.addEventListener('click', cycleTransitionMode);
+        }
+
         setupProgressDragging();
         setupVolumeDragging();
 
@@ -388,6 +426,18 @@ const AudioFlowPlayer = (function() {
         updateShuffleButton();
     }
 
+    function setTransitionMode(mode, crossfadeS) {
+        transitionMode = TRANSITION_MODES.includes(mode) ? mode : 'off';
+        if (typeof crossfadeS === 'number' && crossfadeS > 0) {
+            crossfadeSeconds = crossfadeS;
+        }
+        updateTransitionButton();
+    }
+
+    function getTransitionMode() {
+        return transitionMode;
+    }
+
     function getLooping() {
         return isLooping;
     }
@@ -420,6 +470,8 @@ const AudioFlowPlayer = (function() {
         updateShuffleButton,
         setLooping,
         setShuffling,
+        setTransitionMode,
+        getTransitionMode,
         getLooping,
         getShuffling,
         updateNextPrevButtons,
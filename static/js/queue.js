@@ -56,6 +56,14 @@ const AudioFlowQueue = (function() {
         isQueueDragging = value;
     }
 
+    function coverUrl(item, view) {
+        const Utils = window.AudioFlowUtils;
+        if (Utils && Utils.coverUrl) {
+            return Utils.coverUrl(item.cover, item.cover_thumbs, view);
+        }
+        return `/uploads/${item.cover}`;
+    }
+
     function updateQueueCount() {
         if (queueCount) {
             const count = currentQueue.length;
@@ -102,7 +110,7 @@ const AudioFlowQueue = (function() {
             
             let coverSrc = '';
             if (item.cover) {
-                coverSrc = `/uploads/${item.cover}`;
+                coverSrc = coverUrl(item, 'grid');
             } else if (item.image_url) {
                 coverSrc = item.image_url;
             }
@@ -112,6 +120,14 @@ const AudioFlowQueue = (function() {
                    <div class="music-grid-item-placeholder" style="display:none;"><i class="fas fa-music"></i></div>` 
                 : '<div class="music-grid-item-placeholder"><i class="fas fa-music"></i></div>';
             
+            let pinControl = '';
+            if (item.is_stream) {
+                const pinning = item.pin_status === 'pinning';
+                pinControl = `<div class="music-grid-hover-pin ${pinning ? 'pinning' : ''}" data-index="${index}" title="${pinning ? 'Saving to server' : 'Keep on server'}"><i class="fas ${pinning ? 'fa-spinner fa-spin' : 'fa-thumbtack'}"></i></div>`;
+            } else if (item.pinned) {
+                pinControl = '<div class="music-grid-hover-pin pinned" title="Saved on server"><i class="fas fa-thumbtack"></i></div>';
+            }
+
             const playingVisualizer = `
                 <div class="music-grid-playing-visualizer">
                     <div class="visualizer-bar"></div>
@@ -128,6 +144,7 @@ const AudioFlowQueue = (function() {
                         ${isCurrentSong ? playingVisualizer : ''}
                         <div class="music-grid-hover-play"><i class="fas fa-play"></i></div>
                         <div class="music-grid-hover-delete" data-index="${index}"><i class="fas fa-trash"></i></div>
+                        ${pinControl}
                     </div>
                     <div class="music-grid-title">${item.title || item.filename_display || item.filename}</div>
                 </div>
@@ -159,6 +176,14 @@ const AudioFlowQueue = (function() {
                 });
             }
             
+            const pinBtn = item.querySelector('.music-grid-hover-pin[data-index]');
+            if (pinBtn) {
+                pinBtn.addEventListener('click', (e) => {
+                    e.stopPropagation();
+                    pinQueueItem(parseInt(pinBtn.dataset.index));
+                });
+            }
+
             item.addEventListener('click', () => {
                 const index = parseInt(item.dataset.index);
                 loadFromQueue(index);
@@ -180,7 +205,7 @@ const AudioFlowQueue = (function() {
             
             let coverSrc = '';
             if (item.cover) {
-                coverSrc = `/uploads/${item.cover}`;
+                coverSrc = coverUrl(item, 'queue');
             } else if (item.image_url) {
                 coverSrc = item.image_url;
             }
@@ -210,7 +235,7 @@ const AudioFlowQueue = (function() {
                     </div>
                     <div class="queue-item-info">
                         <div class="queue-item-title">${item.filename_display || item.filename}</div>
-                        <div class="queue-item-status">${item.artist || ''}</div>
+                        <div class="queue-item-status">${item.status === 'processing' ? 'Processing…' : (item.artist || '')}</div>
                     </div>
                     <div class="queue-item-actions">
                         <button class="queue-item-btn remove-btn danger" data-index="${index}" title="Remove" draggable="false">
@@ -505,6 +530,22 @@ const AudioFlowQueue = (function() {
         });
     }
 
+    function pinQueueItem(index) {
+        if (index < 0 || index >= currentQueue.length) return;
+
+        // Progress arrives through track_updated (pin_status) like other item changes
+        fetch(`/queue/${roomId}/pin/${index}`, { method: 'POST' })
+        .then(response => response.json())
+        .then(data => {
+            if (!data.success) {
+                console.error('Failed to pin queue item:', data.error);
+            }
+        })
+        .catch(error => {
+            console.error('Error pinning queue item:', error);
+        });
+    }
+
     function sendReorderRequest(fromIndex, toIndex) {
         fetch(`/queue/${roomId}/reorder`, {
             method: 'POST',
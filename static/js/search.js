@@ -180,7 +180,8 @@ const AudioFlowSearch = (function() {
                 artist: song.artist,
                 album: song.album,
                 image: song.image,
-                image_url: song.image
+                image_url: song.image,
+                duration: song.duration || (resolved.data.metadata && resolved.data.metadata.duration)
             };
             
             const addResp = await fetch('/add_to_queue', {
@@ -15,6 +15,11 @@ const AudioFlowSocketHandlers = (function() {
     let lastQueueIndex = -1;
     let manualDirection = null;
     let lastChangeDirection = 'next';
+    let preloadPlayers = [];
+    let currentTrackInstanceId = null;
+    let transitionPlayers = [];
+    let transitionTimers = [];
+    let transitionSavedVolume = null;
 
     // DOM elements (will be set during init)
     let elements = {};
@@ -48,6 +53,12 @@ const AudioFlowSocketHandlers = (function() {
         socket.on('loop_state_update', handleLoopStateUpdate);
         socket.on('loop_restart', handleLoopRestart);
         socket.on('shuffle_state_update', handleShuffleStateUpdate);
+        socket.on('preload_next', handlePreloadNext);
+        socket.on('scheduled_transition', handleScheduledTransition);
+        socket.on('transition_cancelled', handleTransitionCancelled);
+        socket.on('transition_committed', handleTransitionCommitted);
+        socket.on('transition_mode_update', handleTransitionModeUpdate);
+        socket.on('track_updated', handleTrackUpdated);
     }
 
     function syncClock() {
@@ -161,7 +172,8 @@ const AudioFlowSocketHandlers = (function() {
             room: roomId,
             current_time: currentTime,
             is_playing: isPlaying,
-            has_media: hasMedia
+            has_media: hasMedia,
+            source: hasMedia ? source : null
         });
     }
 
@@ -208,6 +220,7 @@ const AudioFlowSocketHandlers = (function() {
     }
 
     function handlePause(data) {
+        clearTransition();
         isReceivingUpdate = true;
         player.pause();
         player.playbackRate = 1.0;
@@ -268,6 +281,7 @@ const AudioFlowSocketHandlers = (function() {
 
     function handleNewFile(data) {
         console.log('[DEBUG] Received new_file event with data:', data);
+        clearTransition();
         
         const Fullscreen = window.AudioFlowFullscreen;
         
@@ -284,6 +298,8 @@ const AudioFlowSocketHandlers = (function() {
         }
 
         currentSongFile = incomingKey;
+        currentTrackInstanceId = data.track_instance_id !== undefined ? data.track_instance_id : null;
+        clearPreloadPlayers();
 
         // Update player track info
         const newTitle = data.title || (data.filename_display || data.filename || 'Unknown').replace(/_/g, ' ').replace(/\.(mp3|wav|ogg|flac|m4a)$/i, '');
@@ -328,6 +344,197 @@ const AudioFlowSocketHandlers = (function() {
         }
     }
 
+    function clearPreloadPlayers() {
+        preloadPlayers.forEach(preloader => {
+            preloader.removeAttribute('src');
+            preloader.load();
+        });
+        preloadPlayers = [];
+    }
+
+    function collectMediaUrls(data) {
+        // Same rendition choice as loadAudio, so warmed/crossfaded bytes are the ones played
+        const Utils = window.AudioFlowUtils;
+        const pick = (url, renditions, hls) => {
+            const chosen = Utils && Utils.pickRendition ? Utils.pickRendition(renditions) : null;
+            if (chosen) return `/uploads/${encodeURIComponent(chosen)}`;
+            return hls && Utils && Utils.canPlayHls && Utils.canPlayHls() ? hls : url;
+        };
+
+        const urls = [];
+        if (data.mix_urls && typeof data.mix_urls === 'object') {
+            Object.keys(data.mix_urls).forEach(role => {
+                const url = data.mix_urls[role];
+                if (url) urls.push(pick(url, data.mix_renditions && data.mix_renditions[role]));
+            });
+        } else if (data.url) {
+            urls.push(pick(data.url, data.renditions, data.hls));
+        }
+        return urls;
+    }
+
+    function handlePreloadNext(data) {
+        console.log('[DEBUG] Received preload_next:', data);
+        clearPreloadPlayers();
+
+        const urls = collectMediaUrls(data);
+
+        // Detached, muted elements fill the browser cache so the upcoming new_file starts warm
+        urls.forEach(url => {
+            const preloader = new Audio();
+            preloader.preload = 'auto';
+            preloader.muted = true;
+            preloader.src = url;
+            preloader.load();
+            preloadPlayers.push(preloader);
+        });
+
+        const Utils = window.AudioFlowUtils;
+        if (data.cover) {
+            new Image().src = Utils && Utils.coverUrl ? Utils.coverUrl(data.cover, data.cover_thumbs, 'player') : `/uploads/${data.cover}`;
+        } else if (data.image_url) {
+            new Image().src = data.palette ? data.image_url : `/image_proxy?url=${encodeURIComponent(data.image_url)}`;
+        }
+    }
+
+    function stopTransitionPlayers(transitionElements) {
+        transitionElements.forEach(transitionPlayer => {
+            transitionPlayer.pause();
+            transitionPlayer.removeAttribute('src');
+            transitionPlayer.load();
+        });
+        const Visualizer = window.AudioFlowVisualizer;
+        if (transitionElements.length > 0 && Visualizer && typeof Visualizer.detachTransitionPlayers === 'function') {
+            Visualizer.detachTransitionPlayers();
+        }
+    }
+
+    function clearTransition(restoreVolume = true) {
+        transitionTimers.forEach(timer => clearTimeout(timer));
+        transitionTimers = [];
+        stopTransitionPlayers(transitionPlayers);
+        transitionPlayers = [];
+        if (restoreVolume && transitionSavedVolume !== null) {
+            player.volume = transitionSavedVolume;
+        }
+        transitionSavedVolume = null;
+    }
+
+    function rampVolume(durationMs, onStep, onDone) {
+        const startedAt = Date.now();
+        const tick = () => {
+            const progress = durationMs > 0 ? Math.min(1, (Date.now() - startedAt) / durationMs) : 1;
+            onStep(progress);
+            if (progress < 1) {
+                transitionTimers.push(setTimeout(tick, 50));
+            } else if (onDone) {
+                onDone();
+            }
+        };
+        tick();
+    }
+
+    function handOffTransition(data) {
+        // Move the incoming track onto the main player. The transition element keeps playing until
+        // the main player actually plays; only then is its position read and the element stopped.
+        const lead = transitionPlayers[0];
+        const volume = transitionSavedVolume !== null ? transitionSavedVolume : player.volume;
+        // The server may not have committed yet; the incoming track is the instance after from_track_instance_id
+        const committedInstanceId = Number.isInteger(data.from_track_instance_id)
+            ? data.from_track_instance_id + 1
+            : currentTrackInstanceId;
+
+        isReceivingUpdate = true;
+        lastChangeDirection = 'next';
+        const outgoing = transitionPlayers;
+        transitionPlayers = [];
+        handleNewFile(data.track);
+        if (committedInstanceId !== null) {
+            currentTrackInstanceId = committedInstanceId;
+        }
+        transitionSavedVolume = null;
+        // Silent until it plays, so the two elements never sound the same audio twice
+        player.volume = 0;
+        if (lead) {
+            player.currentTime = lead.currentTime;
+        }
+
+        player.addEventListener('playing', () => {
+            if (lead && Math.abs(player.currentTime - lead.currentTime) > 0.05) {
+                player.currentTime = lead.currentTime;
+            }
+            stopTransitionPlayers(outgoing);
+            player.volume = volume;
+        }, { once: true });
+
+        player.play().catch(err => {
+            console.warn('Transition hand-off play was prevented:', err);
+            stopTransitionPlayers(outgoing);
+            player.volume = volume;
+        });
+        if (elements.fileNameDisplay) {
+            elements.fileNameDisplay.classList.add('playing');
+        }
+        setTimeout(() => { isReceivingUpdate = false; }, 300);
+    }
+
+    function handleScheduledTransition(data) {
+        console.log('[DEBUG] Received scheduled_transition:', data);
+        clearTransition();
+
+        const urls = collectMediaUrls(data);
+        if (urls.length === 0) return;
+
+        transitionPlayers = urls.map(url => {
+            const transitionPlayer = new Audio();
+            transitionPlayer.preload = 'auto';
+            transitionPlayer.src = url;
+            transitionPlayer.volume = 0;
+            transitionPlayer.load();
+            return transitionPlayer;
+        });
+        // Same gain and channel routing as the main player, with the incoming track's loudness
+        const Visualizer = window.AudioFlowVisualizer;
+        if (Visualizer && typeof Visualizer.attachTransitionPlayers === 'function') {
+            const track = data.track || {};
+            const gainDb = !track.is_stem_track && track.gain_db != null ? Number(track.gain_db) : 0;
+            Visualizer.attachTransitionPlayers(transitionPlayers, gainDb, !!track.channel_variant);
+        }
+
+        const fadeMs = Math.max(0, (data.fade_s || 0) * 1000);
+        const targetTimestamp = (data.target_timestamp * 1000) + serverTimeOffset;
+        const delay = Math.max(0, targetTimestamp - Date.now());
+
+        transitionTimers.push(setTimeout(() => {
+            transitionSavedVolume = player.volume;
+            const targetVolume = transitionSavedVolume;
+            transitionPlayers.forEach(transitionPlayer => {
+                transitionPlayer.play().catch(err => console.warn('Transition play was prevented:', err));
+            });
+            rampVolume(fadeMs, (progress) => {
+                transitionPlayers.forEach(transitionPlayer => { transitionPlayer.volume = targetVolume * progress; });
+                if (fadeMs > 0) {
+                    player.volume = targetVolume * (1 - progress);
+                }
+            }, () => handOffTransition(data));
+        }, delay));
+    }
+
+    function handleTransitionCancelled() {
+        clearTransition();
+    }
+
+    function handleTransitionCommitted(data) {
+        currentTrackInstanceId = data.track_instance_id;
+    }
+
+    function handleTransitionModeUpdate(data) {
+        const Player = window.AudioFlowPlayer;
+        if (Player && typeof Player.setTransitionMode === 'function') {
+            Player.setTransitionMode(data.mode, data.crossfade_s);
+        }
+    }
+
     function handleRoomState(data) {
         console.log('[DEBUG] Received room_state event with data:', data);
         
@@ -343,6 +550,12 @@ const AudioFlowSocketHandlers = (function() {
         if (data.hasOwnProperty('is_shuffling') && Player) {
             Player.setShuffling(data.is_shuffling);
         }
+
+        currentTrackInstanceId = data.track_instance_id !== undefined ? data.track_instance_id : null;
+
+        if (data.hasOwnProperty('transition_mode') && Player && typeof Player.setTransitionMode === 'function') {
+            Player.setTransitionMode(data.transition_mode, data.crossfade_s);
+        }
         
         if (data.current_file || data.current_proxy_id) {
             const incomingKey = data.current_file || data.current_proxy_id || data.current_video_id || null;
@@ -374,7 +587,14 @@ const AudioFlowSocketHandlers = (function() {
                         selected_audio_variant: data.current_selected_audio_variant,
                         is_stem_track: data.current_is_stem_track,
                         mix_filenames: data.current_mix_filenames,
-                        mix_covers: data.current_mix_covers
+                        mix_covers: data.current_mix_covers,
+                        renditions: data.current_renditions,
+                        mix_renditions: data.current_mix_renditions,
+                        cover_thumbs: data.current_cover_thumbs,
+                        palette: data.current_palette,
+                        gain_db: data.current_gain_db,
+                        channel_variant: data.current_channel_variant,
+                        hls: data.current_hls
                     }
                 );
             }
@@ -581,6 +801,53 @@ const AudioFlowSocketHandlers = (function() {
         }
     }
 
+    function handleTrackUpdated(data) {
+        console.log('[DEBUG] Received track_updated:', data);
+
+        const Queue = window.AudioFlowQueue;
+        const Player = window.AudioFlowPlayer;
+        const item = data && data.item;
+        const index = data ? data.index : -1;
+        if (!item || typeof index !== 'number' || index < 0) return;
+
+        // Patch the queue entry in place; the queue order is unchanged
+        if (window.currentQueueData && window.currentQueueData.queue && window.currentQueueData.queue[index]) {
+            window.currentQueueData.queue[index] = item;
+        }
+        if (Queue) {
+            const queue = Queue.getQueue();
+            if (queue[index]) {
+                queue[index] = item;
+            }
+            Queue.updateQueueDisplay();
+            Queue.updateMusicGrid();
+        }
+        if (Player) {
+            Player.updateNextPrevButtons();
+        }
+
+        if (!data.is_current) return;
+
+        const newTitle = item.title || item.filename_display;
+        if (newTitle && elements.playerTrackTitle) {
+            elements.playerTrackTitle.textContent = newTitle;
+            elements.playerTrackTitle.title = newTitle;
+        }
+        if (item.artist && elements.playerTrackArtist) {
+            elements.playerTrackArtist.textContent = item.artist;
+            elements.playerTrackArtist.title = item.artist;
+            elements.playerTrackArtist.style.display = 'block';
+        }
+        if (typeof window.updateTrackInfo === 'function') {
+            window.updateTrackInfo(newTitle, item.artist, item.cover, item.cover_thumbs, item.palette);
+        }
+        // Stem gains are per role and arrive with the next play_file instead
+        const Visualizer = window.AudioFlowVisualizer;
+        if (!item.is_stem_track && item.gain_db != null && Visualizer && typeof Visualizer.setTrackGain === 'function') {
+            Visualizer.setTrackGain(Number(item.gain_db));
+        }
+    }
+
     function handleError(data) {
         alert(data.message);
         window.location.href = '/';
@@ -596,6 +863,9 @@ const AudioFlowSocketHandlers = (function() {
 
     function handleLoopRestart(data) {
         console.log('Loop restart triggered by another device');
+        if (data && data.track_instance_id !== undefined) {
+            currentTrackInstanceId = data.track_instance_id;
+        }
         isReceivingUpdate = true;
         player.currentTime = 0;
         
@@ -666,6 +936,10 @@ const AudioFlowSocketHandlers = (function() {
         currentSongFile = file;
     }
 
+    function getCurrentTrackInstanceId() {
+        return currentTrackInstanceId;
+    }
+
     // Public API
     return {
         init,
@@ -676,7 +950,8 @@ const AudioFlowSocketHandlers = (function() {
         setReceiving,
         getServerTimeOffset,
         getCurrentSongFile,
-        setCurrentSongFile
+        setCurrentSongFile,
+        getCurrentTrackInstanceId
     };
 })();
 
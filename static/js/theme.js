@@ -407,12 +407,22 @@ const AudioFlowTheme = (function() {
         }
     }
 
+    // Apply a palette precomputed by the server ({ dominant, palette }); false if unusable
+    function applyServerPalette(colors) {
+        if (!colors || !Array.isArray(colors.dominant) || colors.dominant.length !== 3) return false;
+        const palette = Array.isArray(colors.palette) && colors.palette.length ? colors.palette : [colors.dominant];
+        setCurrentColors(colors.dominant, palette);
+        applyTheme(colors.dominant, palette);
+        return true;
+    }
+
     // Public API
     return {
         init,
         setCurrentColors,
         getCurrentColors,
         applyTheme,
+        applyServerPalette,
         resetTheme,
         updateThemeForPlayingState,
         ensureFullscreenContrast
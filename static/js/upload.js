@@ -29,7 +29,11 @@ const AudioFlowUpload = (function() {
         'audio/ogg', 'audio/flac', 'audio/x-flac', 'audio/mp4', 'audio/x-m4a',
         'audio/aac', 'audio/x-aac', 'audio/x-ms-wma', 'audio/aiff', 'audio/x-aiff'
     ];
-    const MAX_FILE_SIZE = 100 * 1024 * 1024; // 100MB max
+    const MAX_FILE_SIZE = 1024 * 1024 * 1024; // 1GB max (resumable uploads)
+    const MAX_FILE_SIZE_LABEL = '1GB';
+    const CHUNK_PARALLELISM = 3;
+    const CHUNK_MAX_RETRIES = 5;
+    const SESSION_STORAGE_PREFIX = 'audioflow-upload:';
 
     function init(elements, room) {
         uploadBtn = elements.uploadBtn;
@@ -81,16 +85,13 @@ const AudioFlowUpload = (function() {
                     songArtistElement.textContent = "";
                 }
                 
-                const formData = new FormData();
-                formData.append('audio', file);
-                formData.append('room', roomId);
-
-                console.log('[DEBUG] Starting upload request to /upload');
-                fetch('/upload', { method: 'POST', body: formData })
-                    .then(response => {
-                        console.log('[DEBUG] Upload response status:', response.status);
-                        return response.json();
-                    })
+                console.log('[DEBUG] Starting resumable upload');
+                uploadResumable(file, (percent) => {
+                    if (songArtistElement) {
+                        songArtistElement.textContent = `${percent}% uploaded`;
+                    }
+                })
+                    .then(uploadId => enqueueUpload('/upload', { upload_id: uploadId }))
                     .then(data => {
                         console.log('[DEBUG] Upload response data:', data);
                         if (fileNameDisplay) {
@@ -227,7 +228,7 @@ const AudioFlowUpload = (function() {
             return `${label} file is not a supported audio format.`;
         }
         if (file.size > MAX_FILE_SIZE) {
-            return `${label} file exceeds 100MB limit.`;
+            return `${label} file exceeds ${MAX_FILE_SIZE_LABEL} limit.`;
         }
         if (file.size === 0) {
             return `${label} file is empty.`;
@@ -249,18 +250,30 @@ const AudioFlowUpload = (function() {
         }
 
         try {
-            const formData = new FormData();
-            formData.append('room', roomId);
-            formData.append('vocals', vocalsFile);
-            formData.append('instrumental', instrumentalFile);
-
-            const response = await fetch('/upload_stems', {
-                method: 'POST',
-                body: formData
+            const totalBytes = vocalsFile.size + instrumentalFile.size;
+            const stemProgress = { vocals: 0, instrumental: 0 };
+            const reportStemProgress = (role, file) => (percent) => {
+                stemProgress[role] = file.size * percent / 100;
+                if (songArtistElement) {
+                    const overall = Math.round((stemProgress.vocals + stemProgress.instrumental) / totalBytes * 100);
+                    songArtistElement.textContent = `${overall}% uploaded`;
+                }
+            };
+
+            const [vocalsUploadId, instrumentalUploadId] = await Promise.all([
+                uploadResumable(vocalsFile, reportStemProgress('vocals', vocalsFile)),
+                uploadResumable(instrumentalFile, reportStemProgress('instrumental', instrumentalFile))
+            ]);
+            if (songArtistElement) {
+                songArtistElement.textContent = 'Preparing synchronized stem track...';
+            }
+
+            const data = await enqueueUpload('/upload_stems', {
+                vocals_upload_id: vocalsUploadId,
+                instrumental_upload_id: instrumentalUploadId
             });
-            const data = await response.json();
 
-            if (!response.ok || !data.success) {
+            if (!data.success) {
                 throw new Error(data.error || 'Stem upload failed');
             }
 
@@ -454,7 +467,7 @@ const AudioFlowUpload = (function() {
                 if (!isAudioFile(file)) {
                     errors.push(`"${file.name}" is not a supported audio format`);
                 } else if (file.size > MAX_FILE_SIZE) {
-                    errors.push(`"${file.name}" exceeds 100MB limit`);
+                    errors.push(`"${file.name}" exceeds ${MAX_FILE_SIZE_LABEL} limit`);
                 } else if (file.size === 0) {
                     errors.push(`"${file.name}" is empty`);
                 } else {
@@ -501,84 +514,167 @@ const AudioFlowUpload = (function() {
     }
 
     function uploadFileWithProgress(file) {
-        return new Promise((resolve, reject) => {
-            console.log('[DEBUG] Uploading file:', file.name, 'Size:', (file.size / 1024 / 1024).toFixed(2) + 'MB');
-            
-            if (fileNameDisplay) {
-                fileNameDisplay.classList.add('uploading');
-            }
-            
-            const truncatedName = truncateFilename(file.name, 30);
-            const remaining = uploadQueue.length;
-            const queueText = remaining > 0 ? ` (${remaining} more in queue)` : '';
-            
-            if (songTitleElement) {
-                songTitleElement.textContent = `Uploading: ${truncatedName}${queueText}`;
-            }
+        console.log('[DEBUG] Uploading file:', file.name, 'Size:', (file.size / 1024 / 1024).toFixed(2) + 'MB');
+
+        if (fileNameDisplay) {
+            fileNameDisplay.classList.add('uploading');
+        }
+
+        const truncatedName = truncateFilename(file.name, 30);
+        const remaining = uploadQueue.length;
+        const queueText = remaining > 0 ? ` (${remaining} more in queue)` : '';
+
+        if (songTitleElement) {
+            songTitleElement.textContent = `Uploading: ${truncatedName}${queueText}`;
+        }
+        if (songArtistElement) {
+            songArtistElement.textContent = "";
+        }
+
+        return uploadResumable(file, (percent) => {
             if (songArtistElement) {
-                songArtistElement.textContent = "";
+                songArtistElement.textContent = `${percent}% uploaded`;
             }
-            
-            const formData = new FormData();
-            formData.append('audio', file);
-            formData.append('room', roomId);
-
-            const xhr = new XMLHttpRequest();
-            
-            // Track upload progress
-            xhr.upload.addEventListener('progress', (e) => {
-                if (e.lengthComputable) {
-                    const percent = Math.round((e.loaded / e.total) * 100);
-                    if (songArtistElement) {
-                        songArtistElement.textContent = `${percent}% uploaded`;
-                    }
-                }
-            });
-            
-            xhr.addEventListener('load', () => {
-                if (fileNameDisplay) {
-                    fileNameDisplay.classList.remove('uploading');
-                }
-                
-                if (xhr.status >= 200 && xhr.status < 300) {
-                    try {
-                        const data = JSON.parse(xhr.responseText);
-                        if (data.success) {
-                            console.log('[DEBUG] Upload successful:', file.name);
-                            resolve(data);
-                        } else {
-                            console.error('[ERROR] Upload failed:', data.error);
-                            reject(new Error(data.error));
-                        }
-                    } catch (e) {
-                        console.error('[ERROR] Invalid response:', e);
-                        reject(e);
-                    }
-                } else {
-                    console.error('[ERROR] Upload HTTP error:', xhr.status);
-                    reject(new Error('HTTP ' + xhr.status));
+        })
+            .then(uploadId => enqueueUpload('/upload', { upload_id: uploadId }))
+            .then(data => {
+                if (!data.success) {
+                    console.error('[ERROR] Upload failed:', data.error);
+                    throw new Error(data.error);
                 }
-            });
-            
-            xhr.addEventListener('error', () => {
+                console.log('[DEBUG] Upload successful:', file.name);
+                return data;
+            })
+            .finally(() => {
                 if (fileNameDisplay) {
                     fileNameDisplay.classList.remove('uploading');
                 }
-                console.error('[ERROR] Upload network error');
-                reject(new Error('Network error'));
             });
-            
-            xhr.addEventListener('abort', () => {
-                if (fileNameDisplay) {
-                    fileNameDisplay.classList.remove('uploading');
+    }
+
+    // Resumable uploads: open a session, PUT chunks in parallel with their offsets
+    // and SHA-256, then finalize. Session ids are kept in localStorage so a dropped
+    // connection (or a reload) resumes with the chunks the server already has.
+
+    function getSessionStorageKey(file) {
+        return `${SESSION_STORAGE_PREFIX}${roomId}:${file.name}:${file.size}:${file.lastModified}`;
+    }
+
+    async function openUploadSession(file) {
+        const storageKey = getSessionStorageKey(file);
+        const savedSessionId = localStorage.getItem(storageKey);
+
+        if (savedSessionId) {
+            try {
+                const response = await fetch(`/upload_session/${savedSessionId}`);
+                if (response.ok) {
+                    const session = await response.json();
+                    console.log('[DEBUG] Resuming upload session:', savedSessionId, `${session.received.length}/${session.chunk_count} chunks`);
+                    return session;
                 }
-                console.log('[DEBUG] Upload aborted:', file.name);
-                reject(new Error('Aborted'));
-            });
-            
-            xhr.open('POST', '/upload');
-            xhr.send(formData);
+            } catch (e) {
+                console.warn('[Upload] Could not resume session, starting over:', e);
+            }
+            localStorage.removeItem(storageKey);
+        }
+
+        const response = await fetch('/upload_session', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ room: roomId, filename: file.name, size: file.size })
         });
+        const session = await response.json();
+        if (!response.ok || !session.success) {
+            throw new Error(session.error || 'Could not start upload');
+        }
+        localStorage.setItem(storageKey, session.session_id);
+        return session;
+    }
+
+    async function sha256Hex(buffer) {
+        // crypto.subtle only exists in secure contexts; the checksum is optional server-side
+        if (!window.crypto || !window.crypto.subtle) return null;
+        const digest = await window.crypto.subtle.digest('SHA-256', buffer);
+        return Array.from(new Uint8Array(digest)).map(b => b.toString(16).padStart(2, '0')).join('');
+    }
+
+    async function putChunk(sessionId, file, offset, chunkSize) {
+        const buffer = await file.slice(offset, Math.min(offset + chunkSize, file.size)).arrayBuffer();
+        const checksum = await sha256Hex(buffer);
+        const headers = { 'Content-Type': 'application/octet-stream' };
+        if (checksum) headers['X-Chunk-SHA256'] = checksum;
+
+        for (let attempt = 0; ; attempt++) {
+            try {
+                const response = await fetch(`/upload_session/${sessionId}/chunk?offset=${offset}`, {
+                    method: 'PUT',
+                    headers,
+                    body: buffer
+                });
+                if (response.ok) return;
+                // Client errors other than a corrupted chunk will not fix themselves on retry
+                const data = await response.json().catch(() => ({}));
+                if (response.status < 500 && data.error !== 'Chunk checksum mismatch') {
+                    throw Object.assign(new Error(data.error || 'HTTP ' + response.status), { fatal: true });
+                }
+                if (attempt >= CHUNK_MAX_RETRIES) throw new Error(data.error || 'HTTP ' + response.status);
+            } catch (e) {
+                if (e.fatal || attempt >= CHUNK_MAX_RETRIES) throw e;
+            }
+            await new Promise(resolve => setTimeout(resolve, Math.min(8000, 500 * Math.pow(2, attempt))));
+        }
+    }
+
+    async function uploadResumable(file, onProgress) {
+        const storageKey = getSessionStorageKey(file);
+        const session = await openUploadSession(file);
+        const chunkSize = session.chunk_size;
+        const received = new Set(session.received);
+        const pending = [];
+        for (let index = 0; index < session.chunk_count; index++) {
+            if (!received.has(index)) pending.push(index);
+        }
+
+        let done = received.size;
+        const report = () => {
+            if (onProgress) onProgress(Math.round(done / session.chunk_count * 100));
+        };
+        report();
+
+        const worker = async () => {
+            while (pending.length > 0) {
+                const index = pending.shift();
+                await putChunk(session.session_id, file, index * chunkSize, chunkSize);
+                done++;
+                report();
+            }
+        };
+        try {
+            await Promise.all(Array.from({ length: Math.min(CHUNK_PARALLELISM, pending.length) }, worker));
+        } catch (e) {
+            // Keep the stored session id so a retry resumes, unless the session is gone
+            if (/not found/i.test(e.message || '')) localStorage.removeItem(storageKey);
+            throw e;
+        }
+
+        const response = await fetch(`/upload_session/${session.session_id}/finalize`, { method: 'POST' });
+        const data = await response.json();
+        if (!response.ok || !data.success) {
+            if (response.status === 404) localStorage.removeItem(storageKey);
+            throw new Error(data.error || 'Upload finalize failed');
+        }
+        localStorage.removeItem(storageKey);
+        return data.upload_id;
+    }
+
+    async function enqueueUpload(url, fields) {
+        const formData = new FormData();
+        formData.append('room', roomId);
+        Object.keys(fields).forEach(key => formData.append(key, fields[key]));
+
+        const response = await fetch(url, { method: 'POST', body: formData });
+        console.log('[DEBUG] Upload response status:', response.status);
+        return response.json();
     }
 
     function setQueueDragging(value) {
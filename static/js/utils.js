@@ -235,6 +235,65 @@ const AudioFlowUtils = {
         const mins = Math.floor(seconds / 60);
         const secs = Math.round(seconds % 60);
         return `${mins}:${secs.toString().padStart(2, '0')}`;
+    },
+
+    // Pick a bitrate rendition (source first, lower rungs after) for the measured bandwidth.
+    // Returns the filename to fetch, or null to keep the source.
+    pickRendition(renditions) {
+        if (!Array.isArray(renditions) || renditions.length < 2) return null;
+        const connection = navigator.connection || navigator.mozConnection || navigator.webkitConnection;
+        if (!connection) return null;
+
+        const probe = document.createElement('audio');
+        const playable = renditions.filter(r => r.codec === 'source' || (r.mime && probe.canPlayType(r.mime)));
+        if (playable.length < 2) return null;
+
+        // Leave half of the downlink as headroom; Save-Data asks for the smallest rung
+        const budgetKbps = connection.saveData ? 0 : (connection.downlink || 0) * 1000 * 0.5;
+        const source = playable[0];
+        if (source.codec === 'source' && (!source.bitrate_kbps || source.bitrate_kbps <= budgetKbps)) {
+            return null;
+        }
+
+        const rungs = playable.filter(r => r.codec !== 'source').sort((a, b) => b.bitrate_kbps - a.bitrate_kbps);
+        const fitting = rungs.find(r => r.bitrate_kbps <= budgetKbps);
+        return (fitting || rungs[rungs.length - 1]).filename;
+    },
+
+    // Whether the browser decodes WebP (checked once)
+    supportsWebp() {
+        if (this._webpSupported === undefined) {
+            const canvas = document.createElement('canvas');
+            canvas.width = canvas.height = 1;
+            this._webpSupported = canvas.toDataURL('image/webp').indexOf('data:image/webp') === 0;
+        }
+        return this._webpSupported;
+    },
+
+    // Cover URL sized for a view ('queue', 'grid', 'player'); falls back to the original cover
+    coverUrl(cover, coverThumbs, view) {
+        if (coverThumbs && coverThumbs[view]) {
+            return `/covers/${encodeURIComponent(coverThumbs[view])}.${this.supportsWebp() ? 'webp' : 'jpg'}`;
+        }
+        return cover ? `/uploads/${cover}` : '';
+    },
+
+    // Whether the audio element plays HLS playlists natively (checked once)
+    canPlayHls() {
+        if (this._hlsSupported === undefined) {
+            this._hlsSupported = !!document.createElement('audio').canPlayType('application/vnd.apple.mpegurl');
+        }
+        return this._hlsSupported;
+    },
+
+    // URL for an uploaded file: a smaller rendition when the connection calls for it,
+    // otherwise the HLS playlist where it plays natively, otherwise the file itself
+    buildUploadUrl(filename, renditions, hls) {
+        const chosen = this.pickRendition(renditions);
+        if (!chosen && hls && this.canPlayHls()) {
+            return hls;
+        }
+        return `/uploads/${encodeURIComponent(chosen || filename)}`;
     }
 };
 
@@ -0,0 +1,134 @@
+"""Auto-advance: a room moves past a track exactly once per track instance."""
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app  # noqa: E402
+
+MEMBERS = 3
+DUPLICATES = 5
+
+
+def queue_item(name, duration):
+    return {
+        'filename': f"{name}.mp3",
+        'filename_display': name,
+        'title': name,
+        'artist': 'Test',
+        'album': '',
+        'cover': None,
+        'proxy_id': None,
+        'is_stream': False,
+        'duration': duration,
+    }
+
+
+@pytest.fixture
+def room():
+    """A playing room with three queued tracks and MEMBERS joined socket clients."""
+    response = app.app.test_client().post('/create_room')
+    room_id = response.headers['Location'].rstrip('/').rsplit('/', 1)[1]
+    with app.thread_lock:
+        room_state = app.rooms_data[room_id]
+        room_state['queue'] = [queue_item('one', 600), queue_item('two', 600), queue_item('three', 600)]
+        app.set_current_queue_item(room_state, room_id, 0, is_playing=True)
+
+    clients = [app.socketio.test_client(app.app) for _ in range(MEMBERS)]
+    for client in clients:
+        client.emit('join', {'room': room_id, 'deviceInfo': {}})
+        client.get_received()
+    yield room_id, clients
+
+    for client in clients:
+        client.disconnect()
+    app.rooms_data.pop(room_id, None)
+
+
+def received_events(client, name):
+    return [event for event in client.get_received() if event['name'] == name]
+
+
+def test_duplicate_end_events_advance_once(room):
+    room_id, clients = room
+    instance_id = app.rooms_data[room_id]['track_instance_id']
+
+    for _ in range(DUPLICATES):
+        for client in clients:
+            client.emit('track_ended', {'room': room_id, 'track_instance_id': instance_id})
+            client.emit('next_song', {'room': room_id, 'track_instance_id': instance_id})
+
+    room_state = app.rooms_data[room_id]
+    assert room_state['current_index'] == 1
+    assert room_state['track_instance_id'] == instance_id + 1
+    for client in clients:
+        new_files = received_events(client, 'new_file')
+        assert len(new_files) == 1
+        assert new_files[0]['args'][0]['filename'] == 'two.mp3'
+
+
+def test_server_timer_advances_once_on_known_duration(room):
+    room_id, clients = room
+    duration_s = 1.0
+    with app.thread_lock:
+        room_state = app.rooms_data[room_id]
+        room_state['queue'][0]['duration'] = duration_s
+        room_state['last_progress_s'] = 0
+        room_state['last_updated_at'] = time.time()
+        instance_id = room_state['track_instance_id']
+
+    deadline = time.time() + duration_s + app.AUTO_ADVANCE_GRACE_S + 4 * app.TRACK_WATCH_INTERVAL_S
+    while time.time() < deadline and app.rooms_data[room_id]['current_index'] == 0:
+        time.sleep(0.05)
+    time.sleep(3 * app.TRACK_WATCH_INTERVAL_S)  # room for a second, wrong advance
+
+    room_state = app.rooms_data[room_id]
+    assert room_state['current_index'] == 1
+    assert room_state['track_instance_id'] == instance_id + 1
+    for client in clients:
+        assert len(received_events(client, 'new_file')) == 1
+
+
+def schedule_transition(room_id):
+    """Pin a gapless transition from the current track to the next one, as the watcher does."""
+    with app.thread_lock:
+        room_state = app.rooms_data[room_id]
+        room_state['transition_mode'] = app.TRANSITION_MODE_GAPLESS
+        transition = app.schedule_room_transition(room_state, 1.0, time.time())
+    assert transition is not None
+    return transition
+
+
+@pytest.mark.parametrize('change', ['remove', 'reorder'])
+def test_queue_change_cancels_scheduled_transition(room, change):
+    room_id, clients = room
+    transition = schedule_transition(room_id)
+    instance_id = app.rooms_data[room_id]['track_instance_id']
+    if change == 'remove':
+        clients[0].emit('remove_from_queue', {'room': room_id, 'index': transition['next_index']})
+    else:
+        queue = app.rooms_data[room_id]['queue']
+        clients[0].emit('reorder_queue', {'room': room_id, 'new_order': [queue[0], queue[2], queue[1]]})
+
+    room_state = app.rooms_data[room_id]
+    assert room_state['scheduled_transition'] is None
+    assert room_state['preload_sent_for'] is None
+    for client in clients:
+        assert len(received_events(client, 'transition_cancelled')) == 1
+
+    assert app.advance_room_track(room_id, instance_id, source='server')
+    assert room_state['current_index'] == 1
+
+
+def test_stale_transition_index_does_not_break_advance(room):
+    room_id, clients = room
+    schedule_transition(room_id)
+    instance_id = app.rooms_data[room_id]['track_instance_id']
+    with app.thread_lock:
+        app.rooms_data[room_id]['queue'].pop()  # bypasses the queue handlers
+        app.rooms_data[room_id]['scheduled_transition']['next_index'] = 5
+
+    assert app.advance_room_track(room_id, instance_id, source='server')
+    assert app.rooms_data[room_id]['current_index'] == 1
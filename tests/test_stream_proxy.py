@@ -0,0 +1,99 @@
+"""Stream proxy: Range fallback and loudness analysis through the relay."""
+import os
+import subprocess
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app  # noqa: E402
+
+BODY = bytes(range(256)) * 64
+
+
+@pytest.fixture
+def upstream():
+    """
+    A local upstream serving Handler.body with Range support, or answering ranged GETs
+    with the status in Handler.reject when it is set. Every GET's Range header is recorded.
+    """
+    seen = []
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        body = BODY
+        reject = None
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            header = self.headers.get('Range')
+            seen.append(header)
+            if header and Handler.reject:
+                self.send_response(Handler.reject)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            body = Handler.body
+            start, end = 0, len(body) - 1
+            if header:
+                first, _, last = header[len('bytes='):].partition('-')
+                start = int(first) if first else len(body) - int(last)
+                end = min(int(last), len(body) - 1) if first and last else len(body) - 1
+            self.send_response(206 if header else 200)
+            self.send_header('Content-Type', 'audio/mpeg')
+            self.send_header('Content-Length', str(end - start + 1))
+            if header:
+                self.send_header('Content-Range', f"bytes {start}-{end}/{len(body)}")
+            self.end_headers()
+            try:
+                self.wfile.write(body[start:end + 1])
+            except OSError:
+                pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.handle_error = lambda request, address: None  # relay fetchers hang up mid-body
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server, Handler, seen
+    server.shutdown()
+
+
+@pytest.mark.parametrize('reject', [403, 416])
+def test_rejected_range_is_retried_without_range(upstream, monkeypatch, reject):
+    server, handler, seen = upstream
+    handler.reject = reject
+    monkeypatch.setattr(app, 'STREAM_RELAY_ENABLED', False)
+    proxy_id = app.add_proxy_url(f"http://127.0.0.1:{server.server_port}/track-{reject}.mp3")
+
+    response = app.app.test_client().get(f"/stream_proxy/{proxy_id}", headers={'Range': 'bytes=0-1'})
+
+    assert response.status_code == 200
+    assert response.data == BODY
+    assert seen == ['bytes=0-1', None]
+
+
+@pytest.mark.skipif(not app.FFMPEG_BIN, reason='ffmpeg is required to decode streams')
+def test_stream_loudness_is_measured_from_the_relay(upstream, tmp_path):
+    server, handler, seen = upstream
+    tone = tmp_path / 'tone.mp3'
+    subprocess.run(
+        [app.FFMPEG_BIN, '-v', 'error', '-f', 'lavfi', '-i', 'sine=frequency=440:duration=10', '-ac', '2', str(tone)],
+        check=True,
+    )
+    handler.body = tone.read_bytes()
+    url = f"http://127.0.0.1:{server.server_port}/tone.mp3"
+    proxy_id = app.add_proxy_url(url)
+    key = app.get_stream_key(url)
+
+    with app.loudness_lock:
+        app.loudness_in_flight.add(key)
+    app.run_loudness_analysis(key, proxy_id)
+
+    assert key in app.stream_loudness_cache
+    # Every upstream GET came from a relay fetcher, so the bytes stay cached for playback
+    assert seen and all(header and header.startswith('bytes=') for header in seen)
+    assert app.stream_relays[key]['blocks']
+    assert not [name for name in os.listdir(app.STREAM_RELAY_DIR) if name.endswith('.tmp')]